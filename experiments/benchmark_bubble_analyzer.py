@@ -0,0 +1,123 @@
+import argparse
+import os
+import time
+import cv2
+import numpy as np
+from translator.utils import (
+    BubbleAnalyzer,
+    get_bounds_for_text,
+    has_white,
+    mask_text_and_make_bubble_mask,
+)
+
+# Per bubble cost of has_white => mask_text_and_make_bubble_mask => get_bounds_for_text (what extract_text_regions
+# used to run for every text_bubble) against BubbleAnalyzer.analyze, and whether both give the same text crop,
+# bubble mask and draw rectangle. Crops come from --images with a box in the middle as the mask, or are synthetic bubbles
+#
+# python -m experiments.benchmark_bubble_analyzer --bubbles 200 --repeat 5
+
+
+def make_bubbles(images: list[np.ndarray], count: int, seed: int = 0):
+    """(crop, text mask, cleaned crop) of count speech bubbles"""
+    rng = np.random.default_rng(seed)
+    bubbles = []
+    for i in range(count):
+        h, w = int(rng.integers(80, 320)), int(rng.integers(80, 320))
+        if len(images) > 0:
+            image = images[i % len(images)]
+            h, w = min(h, image.shape[0]), min(w, image.shape[1])
+            y, x = int(rng.integers(0, image.shape[0] - h + 1)), int(rng.integers(0, image.shape[1] - w + 1))
+            crop = np.ascontiguousarray(image[y : y + h, x : x + w])
+            clean = crop.copy()
+        else:
+            # screentone around a white bubble with a black outline
+            crop = np.full((h, w, 3), 230, dtype=np.uint8)
+            crop[(np.indices((h, w)).sum(axis=0) % 5) == 0] = 110
+            cv2.ellipse(crop, (w // 2, h // 2), (w // 2 - 4, h // 2 - 4), 0, 0, 360, (255, 255, 255), -1)
+            cv2.ellipse(crop, (w // 2, h // 2), (w // 2 - 4, h // 2 - 4), 0, 0, 360, (0, 0, 0), 2)
+            clean = crop.copy()
+            for line in range(max(1, h // 60)):
+                cv2.putText(crop, "TEXT", (w // 4, h // 3 + line * 28), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 0), 2)
+
+        mask = np.zeros((h, w, 3), dtype=np.uint8)
+        mask[h // 4 : h - h // 4, w // 5 : w - w // 5] = 255
+        bubbles.append((crop, mask, clean))
+
+    return bubbles
+
+
+def run_chain(crop: np.ndarray, mask: np.ndarray, clean: np.ndarray):
+    if not has_white(mask):
+        return None
+
+    text_only, bubble_mask = mask_text_and_make_bubble_mask(crop, mask, clean)
+    return text_only, cv2.cvtColor(bubble_mask, cv2.COLOR_BGR2GRAY), get_bounds_for_text(bubble_mask)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per bubble cost of the helper chain against BubbleAnalyzer")
+    parser.add_argument("-i", "--images", default=None, help="Folder of pages to take crops from, synthetic bubbles are used if not given")
+    parser.add_argument("--bubbles", default=200, type=int)
+    parser.add_argument("--repeat", default=5, type=int)
+    parser.add_argument("--seed", default=0, type=int)
+    args = parser.parse_args()
+
+    images = []
+    if args.images is not None:
+        images = [cv2.imread(os.path.join(args.images, x)) for x in sorted(os.listdir(args.images))]
+        images = [x for x in images if x is not None]
+
+    bubbles = make_bubbles(images, args.bubbles, args.seed)
+    analyzer = BubbleAnalyzer()
+
+    def run_chain_analysis(crop, mask, clean):
+        return mask_text_and_make_bubble_mask(crop, mask, clean) if has_white(mask) else None
+
+    def run_analyzer_analysis(crop, mask, clean):
+        text = analyzer.get_text(crop, mask)
+        return None if text is None else (text, analyzer.get_bubble_mask(clean))
+
+    # the draw rectangle (lir) is most of the cost of the chain, so the rest is also timed on its own
+    runs = [
+        ("chain", run_chain),
+        ("analyzer", analyzer.analyze),
+        ("chain without lir", run_chain_analysis),
+        ("analyzer without lir", run_analyzer_analysis),
+    ]
+
+    timings = {}
+    for _ in range(args.repeat):
+        # interleaved so both see the same machine load
+        for name, run in runs:
+            start = time.perf_counter()
+            results = []
+            for crop, mask, clean in bubbles:
+                try:
+                    results.append(run(crop, mask, clean))
+                except:
+                    results.append(None)
+            elapsed = time.perf_counter() - start
+            best = timings[name][0] if name in timings else elapsed
+            timings[name] = (min(best, elapsed), results)
+
+    for name, _ in runs:
+        print(f"{name:<20} {timings[name][0] / len(bubbles) * 1000:8.3f} ms/bubble")
+
+    print(
+        f"analyzer is {timings['chain'][0] / timings['analyzer'][0]:.2f}x faster, {timings['chain without lir'][0] / timings['analyzer without lir'][0]:.2f}x without lir"
+    )
+
+    same = [0, 0, 0]
+    for expected, actual in zip(timings["chain"][1], timings["analyzer"][1]):
+        if expected is None or actual is None:
+            same = [x + (expected is None and actual is None) for x in same]
+            continue
+        same[0] += np.array_equal(expected[0], actual[0])
+        same[1] += np.array_equal(expected[1], actual[1])
+        same[2] += expected[2] == actual[2]
+
+    print(f"identical text crops {same[0]}/{len(bubbles)}, bubble masks {same[1]}/{len(bubbles)}, draw rectangles {same[2]}/{len(bubbles)}")
+
+
+if __name__ == "__main__":
+    main()
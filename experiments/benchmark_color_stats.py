@@ -0,0 +1,96 @@
+import argparse
+import os
+import time
+import tracemalloc
+import cv2
+import numpy as np
+from translator.color_stats import get_color_stats
+from translator.utils import get_histogram_for_region
+
+# Compares finding the dominant colour of a bubble crop with the full 256x256x256 cv2.calcHist (what
+# mask_text_for_in_painting used to do) against get_color_stats, and checks both agree on bright / dark,
+# which is all mask_text_for_in_painting uses it for. Also compares the mean against cv2.mean (get_average_color)
+#
+# python -m experiments.benchmark_color_stats -i pages/ --crops 200
+
+
+def dominant_from_histogram(crop: np.ndarray) -> np.ndarray:
+    hist = get_histogram_for_region(crop, np.full_like(crop, 255, dtype=crop.dtype))
+    return np.array(np.unravel_index(hist.argmax(), hist.shape), dtype=np.float64)
+
+
+def make_crops(images: list[np.ndarray], count: int, seed: int = 0) -> list[np.ndarray]:
+    """Random bubble sized crops, synthetic bubbles (flat background with dark strokes) if there are no images"""
+    rng = np.random.default_rng(seed)
+    crops = []
+    for i in range(count):
+        h, w = int(rng.integers(40, 300)), int(rng.integers(40, 300))
+        if len(images) > 0:
+            image = images[i % len(images)]
+            h, w = min(h, image.shape[0]), min(w, image.shape[1])
+            y = int(rng.integers(0, image.shape[0] - h + 1))
+            x = int(rng.integers(0, image.shape[1] - w + 1))
+            crops.append(np.ascontiguousarray(image[y : y + h, x : x + w]))
+            continue
+
+        background = rng.integers(0, 256, 3)
+        crop = np.empty((h, w, 3), dtype=np.uint8)
+        crop[:] = background
+        for _ in range(int(rng.integers(2, 12))):
+            start = (int(rng.integers(0, w)), int(rng.integers(0, h)))
+            end = (int(rng.integers(0, w)), int(rng.integers(0, h)))
+            cv2.line(crop, start, end, (255 - background).tolist(), int(rng.integers(1, 4)))
+        # scan / jpeg noise
+        crops.append(np.clip(crop + rng.normal(0, 3, crop.shape), 0, 255).astype(np.uint8))
+
+    return crops
+
+
+def measure(run, crops: list[np.ndarray]) -> tuple[list, float, int, int]:
+    """Returns the results, seconds per crop, the highest and the average traced peak over the crops"""
+    results, elapsed, peaks = [], 0.0, []
+    for crop in crops:
+        tracemalloc.start()
+        start = time.time()
+        results.append(run(crop))
+        elapsed += time.time() - start
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    return results, elapsed / len(crops), max(peaks), sum(peaks) // len(peaks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="calcHist against get_color_stats for the dominant colour of a crop")
+    parser.add_argument("-i", "--images", default=None, help="Folder of pages to take crops from, synthetic bubbles are used if not given")
+    parser.add_argument("--crops", default=100, type=int)
+    parser.add_argument("--seed", default=0, type=int)
+    args = parser.parse_args()
+
+    images = []
+    if args.images is not None:
+        images = [cv2.imread(os.path.join(args.images, x)) for x in sorted(os.listdir(args.images))]
+        images = [x for x in images if x is not None]
+
+    crops = make_crops(images, args.crops, args.seed)
+
+    expected, hist_time, hist_peak, hist_average = measure(dominant_from_histogram, crops)
+    stats, stats_time, stats_peak, stats_average = measure(get_color_stats, crops)
+
+    print(
+        f"calcHist    {hist_time * 1000:8.2f} ms/crop | traced peak max {hist_peak / 1024:10.1f} KiB, average {hist_average / 1024:10.1f} KiB"
+    )
+    print(
+        f"color stats {stats_time * 1000:8.2f} ms/crop | traced peak max {stats_peak / 1024:10.1f} KiB, average {stats_average / 1024:10.1f} KiB | {hist_time / stats_time:.1f}x faster, {hist_average / stats_average:.0f}x less memory on average"
+    )
+
+    agree = sum([(x.mean() / 255 > 0.5) == y.is_bright(0.5) for x, y in zip(expected, stats)])
+    distance = np.array([np.abs(x - y.dominant).max() for x, y in zip(expected, stats)])
+    mean_diff = max([np.abs(np.array(cv2.mean(x)[:3]) - y.mean).max() for x, y in zip(crops, stats)])
+    print(
+        f"bright / dark agrees on {agree}/{len(crops)} crops | dominant colour off by {np.median(distance):.1f} (median), {distance.max():.1f} (max) | mean off cv2.mean by {mean_diff:.2e}"
+    )
+
+
+if __name__ == "__main__":
+    main()
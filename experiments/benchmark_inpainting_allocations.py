@@ -0,0 +1,129 @@
+import argparse
+import time
+import tracemalloc
+import cv2
+import numpy as np
+import torch
+import torchvision.transforms as T
+from PIL import Image
+from translator.cleaners.deepfillv2 import DeepFillV2Cleaner
+from translator.utils import InPaintJob, cv2_to_pil, pil_to_cv2
+
+# Compares the host memory traffic of the three ways a crop can get from the frame through DeepFill and back:
+#   pil      cv2_to_pil => ToTensor => generator => Image.fromarray => pil_to_cv2 => paste
+#   copy     in_paint_batch returning a BGR copy that is then pasted
+#   in place in_paint_batch writing the target region straight into the frame
+# tracemalloc sees the numpy / python side (torch's cpu allocator and PIL's buffers are not traced),
+# which is where the per crop copies were
+#
+# python -m experiments.benchmark_inpainting_allocations --crops 16
+
+
+def make_jobs(count: int, seed: int = 0) -> tuple[np.ndarray, list[InPaintJob]]:
+    """A synthetic page with count 256x256 windows, each with an ellipse shaped hole inside its target"""
+    rng = np.random.default_rng(seed)
+    frame = cv2.GaussianBlur(rng.integers(0, 256, (1600, 1200, 3), dtype=np.uint8), (15, 15), 0)
+
+    jobs = []
+    for _ in range(count):
+        x1, y1 = int(rng.integers(0, 1200 - 256)) // 8 * 8, int(rng.integers(0, 1600 - 256)) // 8 * 8
+        target = (32, 48, 224, 208)
+        mask = np.zeros((256, 256), dtype=np.uint8)
+        cv2.ellipse(mask, (128, 128), (int(rng.integers(30, 90)), int(rng.integers(30, 75))), 0, 0, 360, 255, -1)
+        jobs.append(InPaintJob((x1, y1, x1 + 256, y1 + 256), target, mask))
+
+    return frame, jobs
+
+
+def in_paint_pil(image: Image, mask: Image, model_path: str) -> Image:
+    """The PIL based path DeepFillV2Cleaner used before in_paint_batch, kept as the reference"""
+    device = DeepFillV2Cleaner.IN_PAINT_MODEL_DEVICE
+    generator = DeepFillV2Cleaner.get_model(model_path)
+
+    image = T.ToTensor()(image)
+    mask = T.ToTensor()(mask.convert("L"))
+
+    # pad to multiple of 8
+    h, w = image.shape[1:]
+    pad_height = 8 - h % 8 if h % 8 > 0 else 0
+    pad_width = 8 - w % 8 if w % 8 > 0 else 0
+    image = torch.nn.functional.pad(image, (0, pad_width, 0, pad_height)).unsqueeze(0)
+    mask = torch.nn.functional.pad(mask, (0, pad_width, 0, pad_height)).unsqueeze(0)
+
+    image = (image * 2 - 1.0).to(device)  # map image values to [-1, 1] range
+    mask = (mask > 0.5).to(dtype=torch.float32, device=device)  # 1.: masked 0.: unmasked
+
+    image_masked = image * (1.0 - mask)
+    ones_x = torch.ones_like(image_masked)[:, 0:1, :, :]
+    x = torch.cat([image_masked, ones_x, ones_x * mask], dim=1)
+
+    with torch.inference_mode():
+        _, x_stage2 = generator(x, mask)
+
+    image_in_painted = image * (1.0 - mask) + x_stage2 * mask
+
+    img_out = (image_in_painted[0].permute(1, 2, 0) + 1) * 127.5
+    return Image.fromarray(img_out.to(device="cpu", dtype=torch.uint8).numpy())
+
+
+def run_pil(final: np.ndarray, job: InPaintJob, model_path: str):
+    in_painted = in_paint_pil(
+        cv2_to_pil(job.get_section(final)), cv2_to_pil(job.mask), model_path
+    )
+    job.paste(final, pil_to_cv2(in_painted))
+
+
+def run_copy(final: np.ndarray, job: InPaintJob, model_path: str):
+    job.paste(final, DeepFillV2Cleaner.in_paint_batch([job.get_section(final)], [job.mask], model_path)[0])
+
+
+def run_in_place(final: np.ndarray, job: InPaintJob, model_path: str):
+    DeepFillV2Cleaner.in_paint_batch(
+        [job.get_section(final)],
+        [job.mask],
+        model_path,
+        destinations=[job.get_destinations(final)],
+    )
+
+
+def measure(run, frame: np.ndarray, jobs: list[InPaintJob], model_path: str) -> tuple[np.ndarray, float, int, int]:
+    """Returns the cleaned frame, seconds per crop, the highest and the average peak of traced bytes over the crops"""
+    final = frame.copy()
+    run(final.copy(), jobs[0], model_path)  # warm up, loads the model and allocates the bucket buffers
+
+    elapsed, peaks = 0.0, []
+    for job in jobs:
+        tracemalloc.start()
+        start = time.time()
+        run(final, job, model_path)
+        elapsed += time.time() - start
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    return final, elapsed / len(jobs), max(peaks), sum(peaks) // len(peaks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Host allocations per crop of the DeepFill cleaning paths")
+    parser.add_argument("-m", "--model", default=DeepFillV2Cleaner.DEFAULT_MODEL_PATH)
+    parser.add_argument("--crops", default=16, type=int)
+    parser.add_argument("--seed", default=0, type=int)
+    args = parser.parse_args()
+
+    frame, jobs = make_jobs(args.crops, args.seed)
+
+    results = {}
+    for name, run in [("pil", run_pil), ("copy", run_copy), ("in place", run_in_place)]:
+        final, elapsed, peak, average = measure(run, frame, jobs, args.model)
+        results[name] = final
+        print(
+            f"{name:<8} {elapsed * 1000:8.1f} ms/crop | traced peak max {peak / 1024:8.1f} KiB, average {average / 1024:8.1f} KiB"
+        )
+
+    for name in ["copy", "in place"]:
+        identical = np.array_equal(results["pil"], results[name])
+        print(f"{name} matches pil: {identical}")
+
+
+if __name__ == "__main__":
+    main()
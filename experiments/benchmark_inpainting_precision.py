@@ -0,0 +1,120 @@
+import argparse
+import os
+import sys
+import time
+import cv2
+import numpy as np
+from translator.cleaners.deepfillv2 import DeepFillV2Cleaner
+
+# Compares bf16 / int8 / onnxruntime inpainting against fp32 pytorch on a fixed (seeded) set of masked crops.
+# PSNR is only measured on the masked pixels since everything else is copied from the input.
+# Exits with 1 if any crop falls below --min-psnr so it can gate enabling a precision on a machine.
+# int8 needs the weights written by scripts/quantize_deepfill.py next to --model, onnx the graph from scripts/export_onnx.py
+#
+# python -m experiments.benchmark_inpainting_precision -i pages/ --crops 64 --min-psnr 35 --variants bf16 int8 onnx
+
+
+def make_crops(
+    images: list[np.ndarray], count: int, seed: int = 0
+) -> tuple[list[np.ndarray], list[np.ndarray]]:
+    """Random crops with one to three filled ellipses as the mask, synthetic noise crops if there are no images"""
+    rng = np.random.default_rng(seed)
+    crops, masks = [], []
+    for i in range(count):
+        size = int(rng.choice([128, 256, 384]))
+        if len(images) > 0:
+            image = images[i % len(images)]
+            h, w = image.shape[:2]
+            crop_h, crop_w = min(size, h), min(size, w)
+            y = int(rng.integers(0, h - crop_h + 1))
+            x = int(rng.integers(0, w - crop_w + 1))
+            crop = np.ascontiguousarray(image[y : y + crop_h, x : x + crop_w])
+        else:
+            crop = cv2.GaussianBlur(
+                rng.integers(0, 256, (size, size, 3), dtype=np.uint8), (9, 9), 0
+            )
+
+        mask = np.zeros(crop.shape[:2], dtype=np.uint8)
+        crop_h, crop_w = mask.shape
+        for _ in range(int(rng.integers(1, 4))):
+            center = (int(rng.integers(0, crop_w)), int(rng.integers(0, crop_h)))
+            axes = (int(rng.integers(8, crop_w // 3 + 9)), int(rng.integers(8, crop_h // 3 + 9)))
+            cv2.ellipse(mask, center, axes, 0, 0, 360, 255, -1)
+
+        crops.append(crop)
+        masks.append(mask)
+
+    return crops, masks
+
+
+def masked_psnr(expected: np.ndarray, actual: np.ndarray, mask: np.ndarray) -> float:
+    selected = mask > 127
+    if not selected.any():
+        return float("inf")
+    diff = expected[selected].astype(np.float64) - actual[selected].astype(np.float64)
+    mse = np.mean(diff**2)
+    return float("inf") if mse == 0 else 10 * np.log10(255**2 / mse)
+
+
+VARIANTS = {
+    "fp32": ("fp32", "torch"),
+    "bf16": ("bf16", "torch"),
+    "int8": ("int8", "torch"),
+    "onnx": ("fp32", "onnx"),
+}
+
+
+def run_variant(crops, masks, model_path: str, variant: str, batch_size: int) -> tuple[list[np.ndarray], float, float]:
+    """Returns the results, the time taken and the time of the first call (model loading included)"""
+    precision, backend = VARIANTS[variant]
+
+    start = time.time()
+    DeepFillV2Cleaner.in_paint_batch(crops[:1], masks[:1], model_path, batch_size, precision, backend)
+    startup = time.time() - start
+
+    start = time.time()
+    results = DeepFillV2Cleaner.in_paint_batch(crops, masks, model_path, batch_size, precision, backend)
+    return results, time.time() - start, startup
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Output quality and speed of bf16 / int8 / onnx inpainting against fp32")
+    parser.add_argument("-i", "--images", default=None, help="Folder of pages to take crops from, noise is used if not given")
+    parser.add_argument("-m", "--model", default=DeepFillV2Cleaner.DEFAULT_MODEL_PATH)
+    parser.add_argument("--variants", default=["bf16", "int8", "onnx"], nargs="+", choices=["bf16", "int8", "onnx"])
+    parser.add_argument("--crops", default=32, type=int)
+    parser.add_argument("--batch-size", default=8, type=int)
+    parser.add_argument("--seed", default=0, type=int)
+    parser.add_argument("--min-psnr", default=35.0, type=float, help="Lowest masked PSNR (dB) still counted as a pass")
+    args = parser.parse_args()
+
+    images = []
+    if args.images is not None:
+        images = [cv2.imread(os.path.join(args.images, x)) for x in sorted(os.listdir(args.images))]
+        images = [x for x in images if x is not None]
+
+    crops, masks = make_crops(images, args.crops, args.seed)
+
+    expected, fp32_time, startup = run_variant(crops, masks, args.model, "fp32", args.batch_size)
+    print(f"fp32 {fp32_time / len(crops) * 1000:8.1f} ms/crop | startup {startup:.2f}s")
+
+    failed = 0
+    for variant in args.variants:
+        if variant == "bf16" and not DeepFillV2Cleaner.is_bf16_supported():
+            print("bf16 not supported on this device, skipped")
+            continue
+
+        actual, elapsed, startup = run_variant(crops, masks, args.model, variant, args.batch_size)
+        psnr = np.array([masked_psnr(x, y, m) for x, y, m in zip(expected, actual, masks)])
+        below = int((psnr < args.min_psnr).sum())
+        failed += below
+
+        print(
+            f"{variant} {elapsed / len(crops) * 1000:8.1f} ms/crop | {fp32_time / elapsed:.2f}x | startup {startup:.2f}s | masked psnr min {psnr.min():.2f} dB median {np.median(psnr):.2f} dB | {below}/{len(crops)} below {args.min_psnr} dB"
+        )
+
+    sys.exit(1 if failed > 0 else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import argparse
+import time
+import numpy as np
+from experiments.benchmark_inpainting_allocations import make_jobs
+from translator.cleaners.deepfill_workers import InPaintWorkerPool
+from translator.cleaners.deepfillv2 import DeepFillV2Cleaner
+
+# Throughput of DeepFill inpainting in one process against InPaintWorkerPool with 1, 2, 4, 8 worker processes.
+# Every run inpaints the same synthetic page and is compared to the in process result, small differences come from
+# torch picking different kernels for the different thread counts.
+# Workers are started (and load their generator) before the clock starts, like a long running server would have them.
+#
+# python -m experiments.benchmark_inpainting_workers --crops 32 --pages 4 --workers 1 2 4 8
+
+
+def run_in_process(frame: np.ndarray, jobs, model_path: str, precision: str, backend: str) -> np.ndarray:
+    """Crops one at a time from the original frame, pasted in order (in_paint_optimized_batched with batches of one)"""
+    final = frame.copy()
+    for job in jobs:
+        DeepFillV2Cleaner.in_paint_batch(
+            [job.get_section(frame)],
+            [job.mask],
+            model_path,
+            1,
+            precision,
+            backend,
+            destinations=[job.get_destinations(final)],
+        )
+    return final
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inpainting throughput in one process against a pool of worker processes")
+    parser.add_argument("-m", "--model", default=DeepFillV2Cleaner.DEFAULT_MODEL_PATH)
+    parser.add_argument("--workers", default=[1, 2, 4, 8], nargs="+", type=int)
+    parser.add_argument("--crops", default=32, type=int, help="Windows per page")
+    parser.add_argument("--pages", default=4, type=int)
+    parser.add_argument("--precision", default="fp32", choices=["fp32", "bf16", "int8"])
+    parser.add_argument("--backend", default="torch", choices=["torch", "onnx"])
+    parser.add_argument("--seed", default=0, type=int)
+    args = parser.parse_args()
+
+    frame, jobs = make_jobs(args.crops, args.seed)
+
+    run_in_process(frame, jobs[:1], args.model, args.precision, args.backend)  # warm up
+    start = time.time()
+    for _ in range(args.pages):
+        expected = run_in_process(frame, jobs, args.model, args.precision, args.backend)
+    baseline = (time.time() - start) / args.pages
+    print(f"in process {baseline * 1000:8.1f} ms/page | {args.crops / baseline:6.1f} crops/s")
+
+    for workers in args.workers:
+        pool = InPaintWorkerPool(workers, args.model, args.precision, args.backend)
+        pool.in_paint(frame, jobs[:workers])  # waits for every worker to start and load the generator
+
+        start = time.time()
+        for _ in range(args.pages):
+            actual = pool.in_paint(frame, jobs)
+        elapsed = (time.time() - start) / args.pages
+        pool.shutdown()
+
+        max_diff = int(np.abs(expected.astype(np.int16) - actual.astype(np.int16)).max())
+        print(
+            f"{workers} workers ({pool.threads} threads each) {elapsed * 1000:8.1f} ms/page | {args.crops / elapsed:6.1f} crops/s | {baseline / elapsed:.2f}x | max diff {max_diff}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import argparse
+import sys
+import time
+import cv2
+import numpy as np
+import largestinteriorrectangle as lir
+from translator import interior_rectangle
+from translator.interior_rectangle import get_interior_rectangle
+
+# lir.lir against get_interior_rectangle (cold and memoised) on bubble shaped masks of increasing size.
+# A rectangle matches if every edge is within --tolerance pixels of the one lir.lir finds, exits with 1 if any does not
+#
+# python -m experiments.benchmark_interior_rectangle --sizes 64 128 256 512 1024 2048 --shapes 6
+
+
+def make_polygon(kind: str, w: int, h: int, rng) -> np.ndarray:
+    """Largest external contour (1, n, 2) of a bubble shaped mask"""
+    mask = np.zeros((h + 10, w + 10), dtype=np.uint8)
+    if kind == "ellipse":
+        cv2.ellipse(mask, (w // 2 + 5, h // 2 + 5), (w // 2, h // 2), 0, 0, 360, 255, -1)
+    elif kind == "rounded":
+        r = min(w, h) // 5
+        cv2.rectangle(mask, (5 + r, 5), (5 + w - r, 5 + h), 255, -1)
+        cv2.rectangle(mask, (5, 5 + r), (5 + w, 5 + h - r), 255, -1)
+        for x, y in [(5 + r, 5 + r), (5 + w - r, 5 + r), (5 + r, 5 + h - r), (5 + w - r, 5 + h - r)]:
+            cv2.circle(mask, (x, y), r, 255, -1)
+    else:
+        # spiky / hand drawn bubble
+        points = []
+        for angle in np.linspace(0, 2 * np.pi, int(rng.integers(10, 24)), endpoint=False):
+            radius = rng.uniform(0.7, 1.0)
+            points.append((w / 2 + 5 + np.cos(angle) * w / 2 * radius, h / 2 + 5 + np.sin(angle) * h / 2 * radius))
+        cv2.fillPoly(mask, [np.array(points, dtype=np.int32)], 255)
+
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+    return np.array([max(contours, key=cv2.contourArea)[:, 0, :]])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="lir.lir against get_interior_rectangle")
+    parser.add_argument("--sizes", default=[64, 128, 256, 512, 1024], nargs="+", type=int, help="Widths of the bubbles")
+    parser.add_argument("--shapes", default=6, type=int, help="Bubbles per size, cycling through ellipse / rounded / spiky")
+    parser.add_argument("--tolerance", default=1, type=int)
+    parser.add_argument("--seed", default=0, type=int)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    kinds = ["ellipse", "rounded", "spiky"]
+
+    # compile / load the numba kernels
+    lir.lir(make_polygon("ellipse", 64, 48, rng))
+    get_interior_rectangle(make_polygon("ellipse", 64, 40, rng))
+
+    failed = 0
+    for size in args.sizes:
+        exact_time, fast_time, cached_time = 0.0, 0.0, 0.0
+        worst, areas, matched = 0, [], 0
+        for i in range(args.shapes):
+            polygon = make_polygon(kinds[i % len(kinds)], size, int(size * rng.uniform(0.6, 1.4)), rng)
+
+            start = time.perf_counter()
+            rect = lir.lir(polygon)
+            exact_time += time.perf_counter() - start
+            expected = (*lir.pt1(rect), *lir.pt2(rect))
+
+            interior_rectangle._cache.clear()
+            start = time.perf_counter()
+            (x1, y1), (x2, y2) = get_interior_rectangle(polygon)
+            fast_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            get_interior_rectangle(polygon)
+            cached_time += time.perf_counter() - start
+
+            difference = max([abs(int(a) - int(b)) for a, b in zip(expected, (x1, y1, x2, y2))])
+            worst = max(worst, difference)
+            matched += difference <= args.tolerance
+            areas.append(((x2 - x1 + 1) * (y2 - y1 + 1)) / (int(rect[2]) * int(rect[3])))
+
+        failed += args.shapes - matched
+        print(
+            f"{size:>5} px | lir {exact_time / args.shapes * 1000:8.2f} ms | interior rectangle {fast_time / args.shapes * 1000:7.2f} ms ({exact_time / fast_time:5.1f}x) | cached {cached_time / args.shapes * 1000:5.2f} ms | {matched}/{args.shapes} within {args.tolerance} px, worst {worst} px | area min {min(areas) * 100:.1f}% mean {np.mean(areas) * 100:.1f}%"
+        )
+
+    sys.exit(1 if failed > 0 else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import argparse
+import asyncio
+import time
+import cv2
+import numpy as np
+from translator.cleaners.deepfillv2 import DeepFillV2Cleaner
+from translator.cleaners.hybrid import HybridCleaner
+from translator.pipelines import FullConversion
+
+# Cost of FullConversion.reclean after editing the mask of one bubble against cleaning the whole page again,
+# and whether both end up with the same page. The batched DeepFill mode cuts every window from the original frame
+# so the two match exactly, the sequential mode lets earlier results leak into later windows and can differ slightly.
+#
+# python -m experiments.benchmark_reclean --bubbles 24 --edits 5
+
+
+def make_page(count: int, seed: int = 0):
+    """A screentone page with count speech bubbles, their text masks and boxes"""
+    rng = np.random.default_rng(seed)
+    h, w = 1600, 1200
+    frame = np.full((h, w, 3), 235, dtype=np.uint8)
+    frame[(np.indices((h, w)).sum(axis=0) % 6) == 0] = 120
+    mask = np.zeros_like(frame)
+
+    detections = []
+    for _ in range(count):
+        bw, bh = int(rng.integers(90, 200)), int(rng.integers(60, 160))
+        x1, y1 = int(rng.integers(0, w - bw)), int(rng.integers(0, h - bh))
+        cv2.ellipse(frame, (x1 + bw // 2, y1 + bh // 2), (bw // 2, bh // 2), 0, 0, 360, (255, 255, 255), -1)
+        for line in range(bh // 30):
+            cv2.putText(
+                frame, "TEXT", (x1 + bw // 4, y1 + 25 + line * 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 0), 2
+            )
+        mask[y1 + 5 : y1 + bh - 5, x1 + bw // 5 : x1 + bw - bw // 5] = 255
+        detections.append(((x1, y1, x1 + bw, y1 + bh), "text_bubble", 0.9))
+
+    return frame, mask, detections
+
+
+def edit_mask(mask: np.ndarray, detection, rng) -> tuple[np.ndarray, tuple[int, int, int, int]]:
+    """Grows or shrinks the mask of one bubble like a user fixing it would, returns the new mask and the dirty region"""
+    x1, y1, x2, y2 = detection[0]
+    edited = mask.copy()
+    edited[y1:y2, x1:x2] = 0
+    grow = int(rng.integers(-8, 9))
+    ex1, ey1 = max(x1, x1 + (x2 - x1) // 5 - grow), max(y1, y1 + 5 - grow)
+    ex2, ey2 = min(x2, x2 - (x2 - x1) // 5 + grow), min(y2, y2 - 5 + grow)
+    edited[ey1:ey2, ex1:ex2] = 255
+    return edited, (x1, y1, x2, y2)
+
+
+async def run(args):
+    if args.cleaner == "hybrid":
+        cleaner = HybridCleaner()
+    else:
+        cleaner = DeepFillV2Cleaner(batched="yes" if args.cleaner == "deepfill-batched" else "no")
+    converter = FullConversion(cleaner=cleaner)
+
+    rng = np.random.default_rng(args.seed)
+    frame, mask, detections = make_page(args.bubbles, args.seed)
+    await cleaner(frame, mask, detections[:1])  # warm up
+
+    start = time.time()
+    frame_clean, text_mask = await cleaner(frame, mask, detections)
+    full_time = time.time() - start
+    print(f"full page {full_time * 1000:8.1f} ms ({len(detections)} bubbles)")
+
+    reclean_time, full_times = 0.0, 0.0
+    for i in range(args.edits):
+        mask, region = edit_mask(mask, detections[int(rng.integers(0, len(detections)))], rng)
+
+        start = time.time()
+        frame_clean, text_mask = await converter.reclean(frame, frame_clean, text_mask, mask, detections, [region])
+        elapsed = time.time() - start
+        reclean_time += elapsed
+
+        start = time.time()
+        expected_clean, expected_text_mask = await cleaner(frame, mask, detections)
+        full_times += time.time() - start
+
+        max_diff = int(np.abs(expected_clean.astype(np.int16) - frame_clean.astype(np.int16)).max())
+        print(
+            f"edit {i}: reclean {elapsed * 1000:8.1f} ms | max diff to a full clean {max_diff} | text mask matches {np.array_equal(expected_text_mask, text_mask)}"
+        )
+
+    print(
+        f"reclean {reclean_time / args.edits * 1000:.1f} ms/edit against {full_times / args.edits * 1000:.1f} ms for the full page ({reclean_time / full_times * 100:.1f}%)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recleaning the edited regions of a page against cleaning the whole page")
+    parser.add_argument("--cleaner", default="deepfill-batched", choices=["deepfill", "deepfill-batched", "hybrid"])
+    parser.add_argument("--bubbles", default=24, type=int)
+    parser.add_argument("--edits", default=5, type=int)
+    parser.add_argument("--seed", default=0, type=int)
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import argparse
+import asyncio
+import os
+import time
+import cv2
+import numpy as np
+from translator.pipelines import FullConversion
+from translator.detection import DetectionResult
+
+# Compares the default (squashed to the model size) detection against tiled detection.
+# Recall is measured against yolo format labels (class cx cy w h, normalized) if --labels is given
+#
+# python -m experiments.benchmark_tiled_detection -i strips/ -l strips_labels/ --tile-size 1024 --tile-overlap 256
+
+
+def load_labels(label_path: str, shape: tuple[int, int]) -> tuple[np.ndarray, np.ndarray]:
+    h, w = shape
+    if not os.path.exists(label_path):
+        return np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.int64)
+
+    data = np.loadtxt(label_path, ndmin=2)
+    if len(data) == 0:
+        return np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.int64)
+
+    cx, cy, bw, bh = data[:, 1] * w, data[:, 2] * h, data[:, 3] * w, data[:, 4] * h
+    boxes = np.stack([cx - bw / 2, cy - bh / 2, cx + bw / 2, cy + bh / 2], axis=1)
+    return boxes.astype(np.float32), data[:, 0].astype(np.int64)
+
+
+def box_iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    inter_w = np.maximum(np.minimum(a[:, None, 2], b[None, :, 2]) - np.maximum(a[:, None, 0], b[None, :, 0]), 0)
+    inter_h = np.maximum(np.minimum(a[:, None, 3], b[None, :, 3]) - np.maximum(a[:, None, 1], b[None, :, 1]), 0)
+    inter = inter_w * inter_h
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-6)
+
+
+def count_found(result: DetectionResult, boxes: np.ndarray, classes: np.ndarray, iou_threshold: float = 0.5) -> int:
+    if len(boxes) == 0 or len(result) == 0:
+        return 0
+    iou = box_iou(boxes, result.boxes)
+    iou[classes[:, None] != result.classes[None, :]] = 0
+    return int((iou.max(axis=1) >= iou_threshold).sum())
+
+
+async def run(args):
+    converter = FullConversion(
+        color_detect_model=None,
+        tile_size=args.tile_size,
+        tile_overlap=args.tile_overlap,
+        tile_batch_size=args.tile_batch_size,
+    )
+
+    files = sorted([os.path.join(args.images, x) for x in os.listdir(args.images)])
+    images = [(x, cv2.imread(x)) for x in files]
+    images = [(x, y) for x, y in images if y is not None]
+
+    # warm up both paths so model loading is not timed
+    for tiled in [False, True]:
+        converter.tiled_detection = tiled
+        await converter.run_detection([images[0][1]])
+
+    totals = {}
+    for tiled in [False, True]:
+        converter.tiled_detection = tiled
+        name = "tiled" if tiled else "default"
+        elapsed, found, expected, detections = 0.0, 0, 0, 0
+
+        for file, image in images:
+            start = time.time()
+            detect_result, _ = (await converter.run_detection([image]))[0]
+            elapsed += time.time() - start
+            detections += len(detect_result)
+
+            if args.labels is not None:
+                stem = os.path.splitext(os.path.basename(file))[0]
+                boxes, classes = load_labels(os.path.join(args.labels, stem + ".txt"), image.shape[:2])
+                found += count_found(detect_result, boxes, classes)
+                expected += len(boxes)
+
+        totals[name] = (elapsed, found, expected, detections)
+
+    for name, (elapsed, found, expected, detections) in totals.items():
+        recall = f"{found / expected * 100:.1f}%" if expected > 0 else "n/a"
+        print(
+            f"{name:<8} {elapsed / len(images) * 1000:8.1f} ms/page | {detections} boxes | recall {recall}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks tiled detection against the default path")
+    parser.add_argument("-i", "--images", required=True, help="Folder of pages / strips")
+    parser.add_argument("-l", "--labels", default=None, help="Folder of yolo labels named like the images")
+    parser.add_argument("--tile-size", default=1024, type=int)
+    parser.add_argument("--tile-overlap", default=256, type=int)
+    parser.add_argument("--tile-batch-size", default=16, type=int)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,10 +2,10 @@ import argparse
 import cv2
 import asyncio
 import os
-import math
 import re
 import numpy as np
 from translator.pipelines import FullConversion
+from translator.core.executors import StageExecutor, create_stage_executors
 from translator.translators.get import get_translators
 from translator.ocr.get import get_ocr
 from translator.drawers.get import get_drawers
@@ -43,25 +43,30 @@ def json_to_args(args_str: str):
     return args
 
 
-async def do_convert(files: list[str], translator: int, translator_args: str, ocr: int, ocr_args: str,drawer: int, drawer_args: str):
+async def do_convert(files: list[str], translator: int, translator_args: str, ocr: int, ocr_args: str,drawer: int, drawer_args: str, stage_executor: str = StageExecutor.THREAD, stage_workers: int = None):
+    # cleaning, masking, color detection and drawing of the pages in flight run in parallel on these
+    executors = create_stage_executors(stage_executor, stage_workers)
     converter = FullConversion(
         translator=get_translators()[translator](**json_to_args(translator_args)),
         ocr=get_ocr()[ocr](**json_to_args(ocr_args)),drawer=get_drawers()[drawer](**json_to_args(drawer_args)),
+        executors=executors,
     )
     filenames = files
-    batches = math.ceil(len(filenames) / 4)
-    for i in range(batches):
-        files_to_convert = filenames[i * 4: (i + 1) * 4]
-        for filename, data in zip(
-                files_to_convert, await converter([cv2.imread(file) for file in files_to_convert])
-        ):
-            frame = data
+    converted = 0
+    try:
+        # pages are written as soon as they finish, only a few are ever loaded at once and they are detected 4 at a time
+        async for index, frame in converter.stream(filenames, read_ahead=8, detect_batch_size=4):
+            filename = filenames[index]
             ext = re.findall(EXTENSION_REGEX, filename)[0]
             cv2.imwrite(
                 filename[0: len(filename) - (len(ext) + 1)] + "_converted." + ext,
                 frame,
             )
-        print(f"Converted Batch {i + 1}/{batches}")
+            converted += 1
+            print(f"Converted {filename} {converted}/{len(filenames)}")
+    finally:
+        for executor in executors.values():
+            executor.shutdown()
 
 
 def main():
@@ -136,6 +141,24 @@ def main():
         required=False,
     )
 
+    parser.add_argument(
+        "-se",
+        "--stage-executor",
+        default=StageExecutor.THREAD,
+        choices=[StageExecutor.NONE, StageExecutor.THREAD, StageExecutor.PROCESS],
+        help="Where the cpu heavy stages run, 'none' runs them on the event loop one page at a time",
+        required=False,
+    )
+
+    parser.add_argument(
+        "-sw",
+        "--stage-workers",
+        default=None,
+        type=int,
+        help="Workers per stage executor, defaults to the number of cpus",
+        required=False,
+    )
+
     args = parser.parse_args()
 
     if args.files is None:
@@ -151,6 +174,8 @@ def main():
                 args.ocr_args,
                 args.drawer,
                 args.drawer_args,
+                args.stage_executor,
+                args.stage_workers,
             ))
         else:
             asyncio.run(do_convert(
@@ -161,6 +186,8 @@ def main():
                 args.ocr_args,
                 args.drawer,
                 args.drawer_args,
+                args.stage_executor,
+                args.stage_workers,
             ))
 
 
@@ -0,0 +1,107 @@
+import argparse
+import inspect
+import os
+import sys
+import numpy as np
+import torch
+from translator.cleaners.deepfillv2_impl import load_model
+
+# Exports the DeepFill generator to ONNX with dynamic batch / height / width for DeepFillV2Cleaner(backend="onnx")
+# and checks onnxruntime against the pytorch output on a few shapes the graph was not traced with.
+#
+# python -m scripts.export_onnx -m models/inpainting.pt -o models/inpainting.onnx
+#
+# Needs the onnx extra (poetry install -E onnx) and torch 2.5 or newer for the dynamo exporter, the torchscript exporter
+# can not export fold (the patch pasting in ContextualAttention) with a dynamic output size
+#
+# LaMa is not exported: the simple_lama checkpoint is TorchScript and its fourier convolutions (fft_rfftn / fft_irfftn)
+# are not supported by either torch onnx exporter
+
+
+class GeneratorOutput(torch.nn.Module):
+    """Only returns the refined stage, which is all the cleaner uses"""
+
+    def __init__(self, generator: torch.nn.Module) -> None:
+        super().__init__()
+        self.generator = generator
+
+    def forward(self, x, mask):
+        return self.generator(x, mask)[1]
+
+
+def make_inputs(n: int, h: int, w: int, seed: int = 0) -> tuple[torch.Tensor, torch.Tensor]:
+    """Input in the layout DeepFillV2Cleaner.in_paint_batch builds, [-1, 1] image with the hole zeroed + ones + mask"""
+    generator = torch.Generator().manual_seed(seed)
+    image = torch.rand(n, 3, h, w, generator=generator) * 2 - 1
+    mask = (torch.rand(n, 1, h // 8, w // 8, generator=generator) > 0.6).float()
+    mask = torch.nn.functional.interpolate(mask, size=(h, w), mode="nearest")
+    return torch.cat([image * (1.0 - mask), torch.ones_like(mask), mask], dim=1), mask
+
+
+def export(model: torch.nn.Module, path: str, opset: int = 18):
+    """Traces model on a 256x256 crop with dynamic batch / height / width"""
+    if "dynamo" not in inspect.signature(torch.onnx.export).parameters:
+        raise BaseException(
+            f"torch {torch.__version__} has no dynamo onnx exporter, torch 2.5 or newer is needed to export the generator"
+        )
+
+    x, mask = make_inputs(1, 256, 256)
+    axes = {0: "batch", 2: "height", 3: "width"}
+    torch.onnx.export(
+        model,
+        (x, mask),
+        path,
+        input_names=["x", "mask"],
+        output_names=["output"],
+        dynamic_axes={"x": axes, "mask": axes, "output": axes},
+        opset_version=opset,
+        dynamo=True,
+    )
+
+
+def check_parity(
+    model: torch.nn.Module,
+    onnx_path: str,
+    shapes: list[tuple[int, int, int]],
+    tolerance: float,
+) -> bool:
+    import onnxruntime
+
+    session = onnxruntime.InferenceSession(onnx_path, providers=["CPUExecutionProvider"])
+    passed = True
+    for i, (n, h, w) in enumerate(shapes):
+        x, mask = make_inputs(n, h, w, seed=i)
+        with torch.inference_mode():
+            expected = model(x, mask).numpy()
+        actual = session.run(None, {"x": x.numpy(), "mask": mask.numpy()})[0]
+
+        max_diff = float(np.abs(expected - actual).max())
+        ok = max_diff <= tolerance
+        passed = passed and ok
+        print(f"{n}x{h}x{w} max diff {max_diff:.2e} ({'ok' if ok else 'MISMATCH'})")
+
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exports the DeepFill generator to ONNX")
+    parser.add_argument("-m", "--model", default=os.path.join("models", "inpainting.pt"))
+    parser.add_argument("-o", "--output", default=os.path.join("models", "inpainting.onnx"))
+    parser.add_argument("--opset", default=18, type=int, help="Fold (Col2Im) needs at least 18")
+    parser.add_argument("--tolerance", default=1e-3, type=float, help="Largest difference to pytorch (outputs are in [-1, 1])")
+    parser.add_argument("--check-only", action="store_true", help="Only run the parity check on an existing export")
+    args = parser.parse_args()
+
+    model = GeneratorOutput(load_model(args.model, torch.device("cpu"))).eval()
+
+    if not args.check_only:
+        export(model, args.output, args.opset)
+        print(f"Saved {args.output}")
+
+    # bucket shapes the cleaner actually uses, none of them the traced one
+    shapes = [(1, 384, 256), (2, 256, 512), (4, 512, 384)]
+    sys.exit(0 if check_parity(model, args.output, shapes, args.tolerance) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import argparse
+import os
+import cv2
+import numpy as np
+import torch
+from translator.cleaners.deepfillv2_impl import (
+    load_model,
+    prepare_quantization,
+    convert_quantization,
+    get_quantized_engine,
+)
+
+# Calibrates and writes an int8 copy of the DeepFill generator for DeepFillV2Cleaner(precision="int8").
+# Calibration runs on synthetic manga like crops (flat backgrounds, outlines, screentone and text under the mask),
+# crops from real pages can be added with --images
+#
+# python -m scripts.quantize_deepfill -m models/inpainting.pt -o models/inpainting_int8.pt --crops 256
+
+
+def make_synthetic_crop(rng: np.random.Generator, size: int) -> tuple[np.ndarray, np.ndarray]:
+    background = int(rng.integers(180, 256))
+    crop = np.full((size, size, 3), background, dtype=np.uint8)
+
+    # screentone
+    if rng.random() < 0.4:
+        spacing = int(rng.integers(3, 8))
+        tone = int(rng.integers(60, 180))
+        crop[::spacing, ::spacing] = tone
+
+    # panel borders / bubble outlines
+    for _ in range(int(rng.integers(1, 5))):
+        center = (int(rng.integers(0, size)), int(rng.integers(0, size)))
+        axes = (int(rng.integers(size // 8, size // 2)), int(rng.integers(size // 8, size // 2)))
+        cv2.ellipse(crop, center, axes, 0, 0, 360, (0, 0, 0), int(rng.integers(1, 4)))
+
+    # text, which is what the mask covers
+    mask = np.zeros((size, size), dtype=np.uint8)
+    for _ in range(int(rng.integers(2, 7))):
+        text = "".join(rng.choice(list("ABCDEFGHIJKLMNOPQRSTUVWXYZ!?"), int(rng.integers(3, 10))))
+        origin = (int(rng.integers(0, size // 2)), int(rng.integers(16, size)))
+        scale = float(rng.uniform(0.4, 1.2))
+        cv2.putText(crop, text, origin, cv2.FONT_HERSHEY_SIMPLEX, scale, (0, 0, 0), 2)
+        cv2.putText(mask, text, origin, cv2.FONT_HERSHEY_SIMPLEX, scale, 255, 6)
+
+    return crop, mask
+
+
+def make_real_crop(rng: np.random.Generator, image: np.ndarray, size: int) -> tuple[np.ndarray, np.ndarray]:
+    h, w = image.shape[:2]
+    image = cv2.copyMakeBorder(image, 0, max(size - h, 0), 0, max(size - w, 0), cv2.BORDER_REPLICATE)
+    h, w = image.shape[:2]
+    y, x = int(rng.integers(0, h - size + 1)), int(rng.integers(0, w - size + 1))
+    crop = np.ascontiguousarray(image[y : y + size, x : x + size])
+
+    mask = np.zeros((size, size), dtype=np.uint8)
+    for _ in range(int(rng.integers(1, 4))):
+        center = (int(rng.integers(0, size)), int(rng.integers(0, size)))
+        axes = (int(rng.integers(8, size // 3)), int(rng.integers(8, size // 3)))
+        cv2.ellipse(mask, center, axes, 0, 0, 360, 255, -1)
+
+    return crop, mask
+
+
+def to_model_input(crops: list[np.ndarray], masks: list[np.ndarray]) -> tuple[torch.Tensor, torch.Tensor]:
+    """Same preprocessing as DeepFillV2Cleaner.in_paint_batch"""
+    image = torch.from_numpy(np.stack(crops)).permute(0, 3, 1, 2).flip(1).float() / 127.5 - 1.0
+    mask = (torch.from_numpy(np.stack(masks)).unsqueeze(1) > 127).float()
+    x = torch.cat([image * (1.0 - mask), torch.ones_like(mask), mask], dim=1)
+    return x, mask
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Static int8 quantization of the DeepFill generator")
+    parser.add_argument("-m", "--model", default=os.path.join("models", "inpainting.pt"))
+    parser.add_argument("-o", "--output", default=os.path.join("models", "inpainting_int8.pt"))
+    parser.add_argument("-i", "--images", default=None, help="Folder of pages to take additional calibration crops from")
+    parser.add_argument("--crops", default=128, type=int, help="Number of synthetic calibration crops")
+    parser.add_argument("--size", default=256, type=int)
+    parser.add_argument("--batch-size", default=8, type=int)
+    parser.add_argument("--seed", default=0, type=int)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    samples = [make_synthetic_crop(rng, args.size) for _ in range(args.crops)]
+
+    if args.images is not None:
+        for file in sorted(os.listdir(args.images)):
+            image = cv2.imread(os.path.join(args.images, file))
+            if image is not None:
+                samples.append(make_real_crop(rng, image, args.size))
+
+    engine = get_quantized_engine()
+    gen = load_model(args.model, torch.device("cpu"))
+    prepare_quantization(gen, engine)
+
+    with torch.inference_mode():
+        for start in range(0, len(samples), args.batch_size):
+            crops, masks = zip(*samples[start : start + args.batch_size])
+            gen(*to_model_input(list(crops), list(masks)))
+            print(f"Calibrated {min(start + args.batch_size, len(samples))}/{len(samples)}")
+
+    convert_quantization(gen)
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    torch.save({"G": gen.state_dict(), "engine": engine}, args.output)
+    print(f"Saved {args.output} ({engine})")
+
+
+if __name__ == "__main__":
+    main()
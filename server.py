@@ -18,10 +18,15 @@ from translator.ocr.get import get_ocr
 from translator.ocr.no import NoOcr
 from translator.ocr.huggingface_ja import JapaneseOcr
 from translator.drawers.get import get_drawers
+from translator.core.timing import METRICS, TimingReport
+from translator.core.cache import PageCache, StageCache
+from translator.core.executors import StageExecutor, create_stage_executors
+from translator.core.registry import MODELS
 from translator.cleaners.get import get_cleaners
 from PIL import Image
 import json
 import re
+import base64
 import webbrowser
 import traceback
 import os
@@ -39,6 +44,42 @@ def cv2_image_from_url(url: str):
         return data
 
 
+PAGE_CACHE = PageCache(
+    memory_bytes=int(os.getenv("PAGE_CACHE_MEMORY_MB", "256")) * 1024 * 1024,
+    disk_path=os.getenv("PAGE_CACHE_DIR", os.path.join("cache", "pages")),
+    disk_bytes=int(os.getenv("PAGE_CACHE_DISK_MB", "2048")) * 1024 * 1024,
+)
+
+# shared by every converter so i.e. changing the translator only reruns translation and drawing
+STAGE_CACHE = StageCache(
+    max_bytes=int(os.getenv("STAGE_CACHE_MEMORY_MB", "512")) * 1024 * 1024
+)
+
+# shared by every converter so the cpu heavy stages of concurrent pages and requests run in parallel off the event loop
+STAGE_EXECUTORS = create_stage_executors(
+    os.getenv("STAGE_EXECUTOR", StageExecutor.THREAD),
+    int(os.getenv("STAGE_WORKERS")) if os.getenv("STAGE_WORKERS") else None,
+)
+
+
+def encode_png(frame: np.ndarray) -> bytes:
+    converted_pil = cv2_to_pil(frame)
+    img_byte_arr = io.BytesIO()
+    converted_pil.save(img_byte_arr, format="PNG")
+    return img_byte_arr.getvalue()
+
+
+async def convert_and_cache(converter: FullConversion, image: np.ndarray, cache_key: str) -> bytes:
+    """Converts image and returns it as a png, only pages that converted cleanly are cached so retrying one that failed
+    (i.e. the translator timed out) converts it again"""
+    report = TimingReport()
+    results = await converter([image], report)
+    converted = encode_png(results[0])
+    if not report.is_failed(0):
+        PAGE_CACHE.put(cache_key, converted)
+    return converted
+
+
 REQUEST_SECTION_REGEX = r"id=([0-9]+)(.*)"
 REQUEST_SECTION_PARAMS_REGEX = r"\$([a-z0-9_]+)=([^\/$]+)"
 
@@ -89,15 +130,24 @@ class CleanFromWebHandler(RequestHandler):
                 "cleanerArgs", {}
             )
             image_cv2 = pil_to_cv2(Image.open(io.BytesIO(image[0]["body"])))
+
+            cache_key = PageCache.make_key(
+                image_cv2, {"route": "clean", "cleaner": [cleaner_id, cleaner_params]}
+            )
+            cached = PAGE_CACHE.get(cache_key)
+            if cached is not None:
+                self.write(cached)
+                return
+
             converter = FullConversion(
-                ocr=NoOcr(), cleaner=get_cleaners()[cleaner_id](**cleaner_params)
+                ocr=NoOcr(),
+                cleaner=get_cleaners()[cleaner_id](**cleaner_params),
+                stage_cache=STAGE_CACHE,
+                executors=STAGE_EXECUTORS,
             )
-            results = await converter([image_cv2])
-            converted_pil = cv2_to_pil(results[0])
-            img_byte_arr = io.BytesIO()
-            converted_pil.save(img_byte_arr, format="PNG")
+            converted = await convert_and_cache(converter, image_cv2, cache_key)
             # Create response given the bytes
-            self.write(img_byte_arr.getvalue())
+            self.write(converted)
         except:
             self.set_header("Content-Type", "text/html")
             self.set_status(500)
@@ -138,21 +188,34 @@ class TranslateFromWebHandler(RequestHandler):
 
             image_cv2 = pil_to_cv2(Image.open(io.BytesIO(image[0]["body"])))
 
+            cache_key = PageCache.make_key(
+                image_cv2,
+                {
+                    "route": "translate",
+                    "translator": [translator_id, translator_params],
+                    "ocr": [ocr_id, ocr_params],
+                    "drawer": [drawer_id, drawer_params],
+                    "cleaner": [cleaner_id, cleaner_params],
+                },
+            )
+            cached = PAGE_CACHE.get(cache_key)
+            if cached is not None:
+                self.write(cached)
+                return
+
             converter = FullConversion(
                 translator=get_translators()[translator_id](**translator_params),
                 ocr=get_ocr()[ocr_id](**ocr_params),
                 drawer=get_drawers()[drawer_id](**drawer_params),
                 cleaner=get_cleaners()[cleaner_id](**cleaner_params),
                 color_detect_model=None,
+                stage_cache=STAGE_CACHE,
+                executors=STAGE_EXECUTORS,
             )
 
-            results = await converter([image_cv2])
-
-            converted_pil = cv2_to_pil(results[0])
-            img_byte_arr = io.BytesIO()
-            converted_pil.save(img_byte_arr, format="PNG")
+            converted = await convert_and_cache(converter, image_cv2, cache_key)
             # Create response given the bytes
-            self.write(img_byte_arr.getvalue())
+            self.write(converted)
         except:
             self.set_header("Content-Type", "text/html")
             self.set_status(500)
@@ -160,6 +223,105 @@ class TranslateFromWebHandler(RequestHandler):
             traceback.print_exc()
 
 
+class ChapterTranslateWebHandler(RequestHandler):
+    """Translates every page sent as "file" and streams them back as newline delimited json as they finish"""
+
+    def set_default_headers(self):
+        self.set_header("Access-Control-Allow-Origin", "*")
+        self.set_header("Access-Control-Allow-Headers", "*")
+        self.set_header("Access-Control-Allow-Methods", "POST, GET, OPTIONS")
+        self.set_header("Content-Type", "application/x-ndjson")
+
+    def options(self):
+        self.set_status(200)
+
+    def write_page(self, index: int, data: bytes):
+        self.streaming = True
+        self.write(
+            json.dumps({"index": index, "image": base64.b64encode(data).decode()})
+            + "\n"
+        )
+
+    async def post(self):
+        # set once the first page is written, after that errors have to be sent as part of the stream
+        self.streaming = False
+        try:
+            images = self.request.files.get("file")
+
+            if images is None or len(images) == 0:
+                raise BaseException("No Images Sent")
+
+            data = json.loads(self.get_argument("data"))
+
+            translator_id, translator_params = data.get("translator", 0), data.get(
+                "translatorArgs", {}
+            )
+
+            ocr_id, ocr_params = data.get("ocr", 0), data.get("ocrArgs", {})
+
+            drawer_id, drawer_params = data.get("drawer", 0), data.get("drawerArgs", {})
+
+            cleaner_id, cleaner_params = data.get("cleaner", 0), data.get(
+                "cleanerArgs", {}
+            )
+
+            # same config as /translate so pages converted by either route are shared
+            config = {
+                "route": "translate",
+                "translator": [translator_id, translator_params],
+                "ocr": [ocr_id, ocr_params],
+                "drawer": [drawer_id, drawer_params],
+                "cleaner": [cleaner_id, cleaner_params],
+            }
+
+            converter = FullConversion(
+                translator=get_translators()[translator_id](**translator_params),
+                ocr=get_ocr()[ocr_id](**ocr_params),
+                drawer=get_drawers()[drawer_id](**drawer_params),
+                cleaner=get_cleaners()[cleaner_id](**cleaner_params),
+                color_detect_model=None,
+                stage_cache=STAGE_CACHE,
+                executors=STAGE_EXECUTORS,
+            )
+
+            page_indices = []
+            cache_keys = []
+
+            def pages_to_convert():
+                # decoded lazily so only the pages being converted are held in memory
+                for index, image in enumerate(images):
+                    image_cv2 = pil_to_cv2(Image.open(io.BytesIO(image["body"])))
+                    cache_key = PageCache.make_key(image_cv2, config)
+                    cached = PAGE_CACHE.get(cache_key)
+                    if cached is not None:
+                        self.write_page(index, cached)
+                        continue
+
+                    page_indices.append(index)
+                    cache_keys.append(cache_key)
+                    yield image_cv2
+
+            report = TimingReport()
+            async for index, frame in converter.stream(pages_to_convert(), report=report):
+                converted = encode_png(frame)
+                if not report.is_failed(index):
+                    PAGE_CACHE.put(cache_keys[index], converted)
+                self.write_page(page_indices[index], converted)
+                await self.flush()
+
+        except:
+            traceback.print_exc()
+            if self.streaming:
+                # the status and headers may already be sent, so the client gets a last record instead
+                self.write(json.dumps({"error": traceback.format_exc()}) + "\n")
+                self.finish()
+                return
+
+            self.set_header("Content-Type", "text/html")
+            self.set_status(500)
+            self.write(traceback.format_exc())
+
+
 class ImageHandler(RequestHandler):
     def set_default_headers(self):
         self.set_header("Access-Control-Allow-Origin", "*")
@@ -275,6 +437,15 @@ class MiraTranslateWebHandler(RequestHandler):
             if image is None:
                 raise BaseException("No Image Sent")
 
+            to_convert = pil_to_cv2(Image.open(io.BytesIO(image[0]["body"])))
+
+            cache_key = PageCache.make_key(to_convert, {"route": "mira"})
+            cached = PAGE_CACHE.get(cache_key)
+            if cached is not None:
+                self.set_status(200)
+                self.write(cached)
+                return
+
             if MiraTranslateWebHandler.converter is None:
                 MiraTranslateWebHandler.converter = FullConversion(
                     color_detect_model=None,
@@ -282,22 +453,17 @@ class MiraTranslateWebHandler(RequestHandler):
                     translator=DeepLTranslator(auth_token=os.getenv("DEEPL_AUTH")),
                     ocr=JapaneseOcr(),
                     translate_free_text=True,
+                    micro_batching=True,  # the converter is shared so concurrent requests can share batches
+                    stage_cache=STAGE_CACHE,
+                    executors=STAGE_EXECUTORS,
                 )
 
-            to_convert = pil_to_cv2(Image.open(io.BytesIO(image[0]["body"])))
-
-            translated = await MiraTranslateWebHandler.converter([to_convert])
-
-            # display_image(translated,"Translated")
-            converted_pil = cv2_to_pil(translated[0])
+            converted = await convert_and_cache(MiraTranslateWebHandler.converter, to_convert, cache_key)
 
-            img_byte_arr = io.BytesIO()
-
-            converted_pil.save(img_byte_arr, format="PNG")
             # Create response given the bytes
             self.set_status(200)
 
-            self.write(img_byte_arr.getvalue())
+            self.write(converted)
 
         except:
             self.set_header("Content-Type", "text/html")
@@ -306,6 +472,12 @@ class MiraTranslateWebHandler(RequestHandler):
             self.write(traceback.format_exc())
 
 
+class MetricsHandler(RequestHandler):
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4")
+        self.write(METRICS.render() + MODELS.render())
+
+
 class UiFilesHandler(RequestHandler):
     def initialize(self, build_path) -> None:
         self.build_path = build_path
@@ -333,8 +505,10 @@ async def main():
             (r"/info", BaseHandler),
             (r"/clean", CleanFromWebHandler),
             (r"/translate", TranslateFromWebHandler),
+            (r"/chapter/translate", ChapterTranslateWebHandler),
             # (r"/images/.*", ImageHandler),
             (r"/mira/translate", MiraTranslateWebHandler),
+            (r"/metrics", MetricsHandler),
             # (r"/(.*)", UiFilesHandler, dict(build_path=build_path)),
         ],
         **settings,
@@ -0,0 +1,69 @@
+import io
+import json
+import uuid
+import numpy as np
+from PIL import Image
+from tornado.testing import AsyncHTTPTestCase
+from tornado.web import Application
+import server
+from translator.core.cache import PageCache
+
+
+class FailingConversion:
+    """Converts the first page, then fails like a translator timing out would"""
+
+    def __init__(self, **kwargs) -> None:
+        pass
+
+    async def stream(self, images, report=None):
+        for index, image in enumerate(images):
+            if index > 0:
+                raise BaseException("Translator timed out")
+            yield index, image
+
+
+def make_body(count: int) -> tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    parts = []
+    for i in range(count):
+        png = io.BytesIO()
+        Image.fromarray(np.full((32, 32, 3), i * 40, dtype=np.uint8)).save(png, format="PNG")
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{i}.png"\r\nContent-Type: image/png\r\n\r\n'.encode()
+            + png.getvalue()
+            + b"\r\n"
+        )
+    parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="data"\r\n\r\n{{}}\r\n--{boundary}--\r\n'.encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+class ChapterStreamTest(AsyncHTTPTestCase):
+    def get_app(self):
+        return Application([(r"/chapter/translate", server.ChapterTranslateWebHandler)])
+
+    def setUp(self):
+        super().setUp()
+        self.conversion, self.cache = server.FullConversion, server.PAGE_CACHE
+        server.FullConversion = FailingConversion
+        server.PAGE_CACHE = PageCache(memory_bytes=16 * 1024 * 1024)
+
+    def tearDown(self):
+        server.FullConversion, server.PAGE_CACHE = self.conversion, self.cache
+        super().tearDown()
+
+    def test_error_after_first_page_is_an_ndjson_record(self):
+        body, content_type = make_body(3)
+        response = self.fetch("/chapter/translate", method="POST", body=body, headers={"Content-Type": content_type})
+
+        assert response.code == 200
+        assert response.headers["Content-Type"] == "application/x-ndjson"
+        records = [json.loads(x) for x in response.body.decode().splitlines()]
+        assert [x.get("index") for x in records[:-1]] == [0]
+        assert "Translator timed out" in records[-1]["error"]
+
+    def test_error_before_any_page_is_a_500(self):
+        body, content_type = make_body(0)
+        response = self.fetch("/chapter/translate", method="POST", body=body, headers={"Content-Type": content_type})
+
+        assert response.code == 500
+        assert response.headers["Content-Type"] == "text/html"
@@ -0,0 +1,244 @@
+import torch
+import torch.nn.functional as F
+from translator.cleaners.deepfillv2_impl import (
+    ContextualAttention,
+    extract_image_patches,
+    flow_to_image,
+)
+
+
+def baseline_forward(self, f, b, mask=None):
+    """
+    Args:
+        f: Input feature to match (foreground).
+        b: Input feature for match (background).
+        mask: Input mask for b, indicating patches not available.
+
+    ContextualAttention.forward as it was before it was batched, copied verbatim (it uses the mask of the first
+    sample for every sample)
+    """
+    device = f.device
+    # get shapes
+    raw_int_fs, raw_int_bs = list(f.size()), list(b.size())  # b*c*h*w
+
+    # extract patches from background with stride and rate
+    kernel = 2 * self.rate
+    # raw_w is extracted for reconstruction
+    raw_w = extract_image_patches(
+        b, ksize=kernel, stride=self.rate * self.stride, rate=1, padding="auto"
+    )  # [N, C*k*k, L]
+    # raw_shape: [N, C, k, k, L]
+    raw_w = raw_w.view(raw_int_bs[0], raw_int_bs[1], kernel, kernel, -1)
+    raw_w = raw_w.permute(0, 4, 1, 2, 3)  # raw_shape: [N, L, C, k, k]
+    raw_w_groups = torch.split(raw_w, 1, dim=0)
+
+    # downscaling foreground option: downscaling both foreground and
+    # background for matching and use original background for reconstruction.
+    f = F.interpolate(
+        f,
+        scale_factor=1.0 / self.rate,
+        mode="nearest",
+        recompute_scale_factor=False,
+    )
+    b = F.interpolate(
+        b,
+        scale_factor=1.0 / self.rate,
+        mode="nearest",
+        recompute_scale_factor=False,
+    )
+    int_fs, int_bs = list(f.size()), list(b.size())  # b*c*h*w
+    # split tensors along the batch dimension
+    f_groups = torch.split(f, 1, dim=0)
+    # w shape: [N, C*k*k, L]
+    w = extract_image_patches(
+        b, ksize=self.ksize, stride=self.stride, rate=1, padding="auto"
+    )
+    # w shape: [N, C, k, k, L]
+    w = w.view(int_bs[0], int_bs[1], self.ksize, self.ksize, -1)
+    w = w.permute(0, 4, 1, 2, 3)  # w shape: [N, L, C, k, k]
+    w_groups = torch.split(w, 1, dim=0)
+
+    # process mask
+    if mask is None:
+        mask = torch.zeros([int_bs[0], 1, int_bs[2], int_bs[3]], device=device)
+    else:
+        mask = F.interpolate(
+            mask,
+            scale_factor=1.0 / ((2**self.n_down) * self.rate),
+            mode="nearest",
+            recompute_scale_factor=False,
+        )
+    int_ms = list(mask.size())
+    # m shape: [N, C*k*k, L]
+    m = extract_image_patches(
+        mask, ksize=self.ksize, stride=self.stride, rate=1, padding="auto"
+    )
+    # m shape: [N, C, k, k, L]
+    m = m.view(int_ms[0], int_ms[1], self.ksize, self.ksize, -1)
+    m = m.permute(0, 4, 1, 2, 3)  # m shape: [N, L, C, k, k]
+    m = m[0]  # m shape: [L, C, k, k]
+    # mm shape: [L, 1, 1, 1]
+
+    mm = (torch.mean(m, dim=[1, 2, 3], keepdim=True) == 0.0).to(torch.float32)
+    mm = mm.permute(1, 0, 2, 3)  # mm shape: [1, L, 1, 1]
+
+    y = []
+    offsets = []
+    scale = self.softmax_scale  # to fit the PyTorch tensor image value range
+
+    for xi, wi, raw_wi in zip(f_groups, w_groups, raw_w_groups):
+        """
+        O => output channel as a conv filter
+        I => input channel as a conv filter
+        xi : separated tensor along batch dimension of front; (B=1, C=128, H=32, W=32)
+        wi : separated patch tensor along batch dimension of back; (B=1, O=32*32, I=128, KH=3, KW=3)
+        raw_wi : separated tensor along batch dimension of back; (B=1, I=32*32, O=128, KH=4, KW=4)
+        """
+        # conv for compare
+        wi = wi[0]  # [L, C, k, k]
+        max_wi = torch.sqrt(
+            torch.sum(torch.square(wi), dim=[1, 2, 3], keepdim=True)
+        ).clamp_min(1e-4)
+        wi_normed = wi / max_wi
+        # xi shape: [1, C, H, W], yi shape: [1, L, H, W]
+        yi = F.conv2d(
+            xi, wi_normed, stride=1, padding=(self.ksize - 1) // 2
+        )  # [1, L, H, W]
+        # conv implementation for fuse scores to encourage large patches
+        if self.fuse:
+            # make all of depth to spatial resolution
+            # (B=1, I=1, H=32*32, W=32*32)
+            yi = yi.view(1, 1, int_bs[2] * int_bs[3], int_fs[2] * int_fs[3])
+            # (B=1, C=1, H=32*32, W=32*32)
+            yi = F.conv2d(
+                yi, self.fuse_weight, stride=1, padding=(self.fuse_k - 1) // 2
+            )
+            # (B=1, 32, 32, 32, 32)
+            yi = yi.contiguous().view(1, int_bs[2], int_bs[3], int_fs[2], int_fs[3])
+            yi = yi.permute(0, 2, 1, 4, 3)
+
+            yi = yi.contiguous().view(
+                1, 1, int_bs[2] * int_bs[3], int_fs[2] * int_fs[3]
+            )
+            yi = F.conv2d(
+                yi, self.fuse_weight, stride=1, padding=(self.fuse_k - 1) // 2
+            )
+            yi = yi.contiguous().view(1, int_bs[3], int_bs[2], int_fs[3], int_fs[2])
+            yi = yi.permute(0, 2, 1, 4, 3).contiguous()
+
+        # (B=1, C=32*32, H=32, W=32)
+        yi = yi.view(1, int_bs[2] * int_bs[3], int_fs[2], int_fs[3])
+        # softmax to match
+        yi = yi * mm
+        yi = F.softmax(yi * scale, dim=1)
+        yi = yi * mm  # [1, L, H, W]
+
+        if self.return_flow:
+            offset = torch.argmax(yi, dim=1, keepdim=True)  # 1*1*H*W
+
+            if int_bs != int_fs:
+                # Normalize the offset value to match foreground dimension
+                times = (int_fs[2] * int_fs[3]) / (int_bs[2] * int_bs[3])
+                offset = ((offset + 1).float() * times - 1).to(torch.int64)
+            offset = torch.cat(
+                [
+                    torch.div(offset, int_fs[3], rounding_mode="trunc"),
+                    offset % int_fs[3],
+                ],
+                dim=1,
+            )  # 1*2*H*W
+            offsets.append(offset)
+
+        # deconv for patch pasting
+        wi_center = raw_wi[0]
+        yi = (
+            F.conv_transpose2d(yi, wi_center, stride=self.rate, padding=1) / 4.0
+        )  # (B=1, C=128, H=64, W=64)
+        y.append(yi)
+
+    y = torch.cat(y, dim=0)  # back to the mini-batch
+    y = y.contiguous().view(raw_int_fs)
+
+    if not self.return_flow:
+        return y, None
+
+    offsets = torch.cat(offsets, dim=0)
+    offsets = offsets.view(int_fs[0], 2, *int_fs[2:])
+
+    # case1: visualize optical flow: minus current position
+    h_add = (
+        torch.arange(int_fs[2], device=device)
+        .view([1, 1, int_fs[2], 1])
+        .expand(int_fs[0], -1, -1, int_fs[3])
+    )
+    w_add = (
+        torch.arange(int_fs[3], device=device)
+        .view([1, 1, 1, int_fs[3]])
+        .expand(int_fs[0], -1, int_fs[2], -1)
+    )
+    offsets = offsets - torch.cat([h_add, w_add], dim=1)
+    # to flow image
+    flow = (
+        torch.from_numpy(
+            flow_to_image(offsets.permute(0, 2, 3, 1).cpu().data.numpy())
+        )
+        / 255.0
+    )
+    flow = flow.permute(0, 3, 1, 2)
+    # case2: visualize which pixels are attended
+    # flow = torch.from_numpy(highlight_flow((offsets * mask.long()).cpu().data.numpy()))
+
+    if self.rate != 1:
+        flow = F.interpolate(
+            flow, scale_factor=self.rate, mode="bilinear", align_corners=True
+        )
+
+    return y, flow
+
+
+def make_layer(return_flow: bool = False) -> ContextualAttention:
+    return ContextualAttention(
+        ksize=3, stride=1, rate=2, fuse_k=3, softmax_scale=10, fuse=True, n_down=2, return_flow=return_flow
+    ).eval()
+
+
+def make_inputs(batch_size: int, size: int = 128, channels: int = 32, seed: int = 0):
+    generator = torch.Generator().manual_seed(seed)
+    features = torch.relu(torch.randn(batch_size, channels, size // 4, size // 4, generator=generator))
+    mask = torch.zeros(batch_size, 1, size, size)
+    for i in range(batch_size):
+        offset = i * 16
+        mask[i, :, offset : offset + size // 3, size // 4 : size // 4 + size // 3] = 1.0
+    return features, mask
+
+
+def test_matches_the_original_forward_at_batch_one():
+    layer = make_layer()
+    features, mask = make_inputs(1)
+    with torch.inference_mode():
+        for m in [mask, None]:
+            expected, _ = baseline_forward(layer, features, features, m)
+            actual, _ = layer(features, features, m)
+            torch.testing.assert_close(actual, expected, atol=1e-4, rtol=1e-4)
+
+
+def test_matches_the_original_flow_at_batch_one():
+    layer = make_layer(return_flow=True)
+    features, mask = make_inputs(1, seed=1)
+    with torch.inference_mode():
+        expected, expected_flow = baseline_forward(layer, features, features, mask)
+        actual, actual_flow = layer(features, features, mask)
+    torch.testing.assert_close(actual, expected, atol=1e-4, rtol=1e-4)
+    torch.testing.assert_close(actual_flow, expected_flow)
+
+
+def test_batch_uses_the_mask_of_each_sample():
+    # the original used the first mask for the whole batch, a batch is now the same as converting each sample alone
+    layer = make_layer()
+    features, mask = make_inputs(3)
+    with torch.inference_mode():
+        actual, _ = layer(features, features, mask)
+        expected = torch.cat(
+            [baseline_forward(layer, features[i : i + 1], features[i : i + 1], mask[i : i + 1])[0] for i in range(3)]
+        )
+    torch.testing.assert_close(actual, expected, atol=1e-4, rtol=1e-4)
@@ -0,0 +1,27 @@
+import torch
+from translator.cleaners.deepfillv2 import DeepFillV2Cleaner
+
+
+def test_only_bucket_shapes_are_kept(monkeypatch):
+    monkeypatch.setattr(DeepFillV2Cleaner, "_buffers", {})
+    device = torch.device("cpu")
+
+    kept = DeepFillV2Cleaner.get_buffers(256, 384, 2, device)
+    assert DeepFillV2Cleaner.get_buffers(256, 384, 1, device) is kept
+
+    for h, w in [(520, 512), (512, 1536), (2000, 700)]:
+        size = DeepFillV2Cleaner.get_bucket_size(h), DeepFillV2Cleaner.get_bucket_size(w)
+        buffers = DeepFillV2Cleaner.get_buffers(*size, 1, device)
+        assert buffers.image.shape == (1, 3, *size)
+        assert DeepFillV2Cleaner.get_buffers(*size, 1, device) is not buffers
+
+    assert list(DeepFillV2Cleaner._buffers.keys()) == [(256, 384, "cpu")]
+
+
+def test_oversize_crops_are_barely_padded():
+    assert [DeepFillV2Cleaner.get_bucket_size(x) for x in [200, 300, 512]] == [256, 384, 512]
+    # not a multiple of the largest bucket, a 520 px side used to become 1024
+    assert DeepFillV2Cleaner.get_bucket_size(513) == 576
+    assert DeepFillV2Cleaner.get_bucket_size(520) == 576
+    assert DeepFillV2Cleaner.get_bucket_size(1024) == 1024
+    assert DeepFillV2Cleaner.get_bucket_size(1025) == 1088
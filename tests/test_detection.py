@@ -0,0 +1,66 @@
+import numpy as np
+from translator.detection import DetectionResult, make_tiles, merge_tile_results
+
+NAMES = {0: "text_bubble", 1: "text_free"}
+
+
+def make_result(boxes: list, classes: list, masks: bool = False) -> DetectionResult:
+    boxes = np.array(boxes, dtype=np.float32).reshape(-1, 4)
+    return DetectionResult(
+        boxes=boxes,
+        classes=np.array(classes, dtype=np.int64),
+        confidences=np.full(len(boxes), 0.9, dtype=np.float32),
+        names=NAMES,
+        masks=[np.array([[x1, y1], [x2, y1], [x2, y2], [x1, y2]], dtype=np.float32) for x1, y1, x2, y2 in boxes]
+        if masks
+        else None,
+    )
+
+
+def to_tile(box, tile):
+    x1, y1, x2, y2 = box
+    h, w = tile.image.shape[:2]
+    return [max(0, x1 - tile.x), max(0, y1 - tile.y), min(w, x2 - tile.x), min(h, y2 - tile.y)]
+
+
+def test_box_larger_than_overlap_is_merged():
+    # tiles at y 0 - 1024 and 768 - 1792, the bubble (600 tall) is larger than the 256 overlap so no tile sees all of it
+    tiles = make_tiles(np.zeros((1792, 800, 3), dtype=np.uint8), 1024, 256)
+    assert [x.y for x in tiles] == [0, 768]
+
+    bubble = (100, 600, 500, 1200)
+    small = (300, 1500, 400, 1600)
+    results = [
+        make_result([to_tile(bubble, tiles[0])], [0], True),
+        make_result([to_tile(bubble, tiles[1]), to_tile(small, tiles[1])], [0, 0], True),
+    ]
+
+    merged = merge_tile_results(results, tiles)
+    assert sorted([tuple(x) for x in merged.boxes.tolist()]) == [bubble, small]
+
+    # the masks are unioned along with the boxes
+    text = merge_tile_results(results, tiles, ios_threshold=None)
+    mask = text.masks[[tuple(x) for x in text.boxes.tolist()].index(bubble)]
+    assert tuple(mask.min(axis=0)) == (100, 600) and tuple(mask.max(axis=0)) == (500, 1200)
+
+
+def test_box_inside_overlap_is_deduplicated():
+    tiles = make_tiles(np.zeros((1792, 800, 3), dtype=np.uint8), 1024, 256)
+    bubble = (100, 850, 500, 1100)
+    results = [make_result([to_tile(bubble, tiles[0])], [0]), make_result([to_tile(bubble, tiles[1])], [0])]
+
+    merged = merge_tile_results(results, tiles)
+    assert [tuple(x) for x in merged.boxes.tolist()] == [bubble]
+
+
+def test_pieces_are_only_merged_with_their_own_class_and_alignment():
+    tiles = make_tiles(np.zeros((1792, 800, 3), dtype=np.uint8), 1024, 256)
+    top, bottom = (100, 600, 300, 1200), (500, 700, 700, 1300)
+    results = [
+        make_result([to_tile(top, tiles[0]), to_tile(bottom, tiles[0])], [0, 1]),
+        # the other class, and a piece that does not line up with the one above it
+        make_result([to_tile(top, tiles[1]), (650, 0, 790, 300)], [1, 1]),
+    ]
+
+    merged = merge_tile_results(results, tiles)
+    assert len(merged) == 4
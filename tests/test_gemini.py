@@ -0,0 +1,87 @@
+import asyncio
+import numpy as np
+import translator.translators.gemini as gemini
+from translator.core.cache import StageCache
+from translator.core.constants import PipelineStages
+from translator.core.plugin import Ocr, OcrResult
+from translator.core.timing import TimingReport
+from translator.pipelines import FullConversion
+
+
+class FakeResponse:
+    def __init__(self, data: dict) -> None:
+        self.data = data
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    async def json(self):
+        return self.data
+
+
+class FakeSession:
+    """Stands in for aiohttp.ClientSession, answers every post with the next of responses"""
+
+    def __init__(self, responses: list[dict]) -> None:
+        self.responses = responses
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    def post(self, *args, **kwargs):
+        return FakeResponse(self.responses.pop(0))
+
+
+BLOCKED = {"promptFeedback": {"blockReason": "SAFETY"}}
+
+ERROR = {"error": {"code": 500}}
+
+TRANSLATED = {"candidates": [{"content": {"parts": [{"text": "Hello"}]}}]}
+
+
+def translate(monkeypatch, responses: list[dict]):
+    session = FakeSession(responses)
+    monkeypatch.setattr(gemini.aiohttp, "ClientSession", lambda: session)
+    return asyncio.run(gemini.GeminiTranslator(api_key="key").do_api(OcrResult("こんにちは", "ja")))
+
+
+def test_blocked_translation_is_failed(monkeypatch):
+    assert translate(monkeypatch, [dict(BLOCKED)]).failed
+
+
+def test_errors_are_retried(monkeypatch):
+    result = translate(monkeypatch, [dict(ERROR), dict(ERROR), dict(TRANSLATED)])
+    assert result.text == "Hello"
+    assert not result.failed
+
+
+def test_blocked_translation_is_not_cached(monkeypatch):
+    responses = [dict(BLOCKED), dict(TRANSLATED)]
+    session = FakeSession(responses)
+    monkeypatch.setattr(gemini.aiohttp, "ClientSession", lambda: session)
+
+    stage_cache = StageCache()
+    converter = FullConversion(
+        ocr=Ocr(),
+        translator=gemini.GeminiTranslator(api_key="key"),
+        color_detect_model=None,
+        stage_cache=stage_cache,
+    )
+    to_translate = [((0, 0, 10, 10), np.zeros((10, 10, 3), dtype=np.uint8))]
+    cache_keys = {PipelineStages.OCR: "ocr", PipelineStages.TRANSLATION: "translation"}
+
+    report = TimingReport()
+    results = asyncio.run(converter.translate_regions(to_translate, report=report, cache_keys=cache_keys))
+    assert results[0].failed
+    assert report.is_failed(0)
+    assert stage_cache.get(PipelineStages.TRANSLATION, "translation") is None
+
+    results = asyncio.run(converter.translate_regions(to_translate, cache_keys=cache_keys))
+    assert results[0].text == "Hello"
+    assert stage_cache.get(PipelineStages.TRANSLATION, "translation")[0].text == "Hello"
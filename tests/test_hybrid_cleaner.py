@@ -0,0 +1,46 @@
+import numpy as np
+from translator.cleaners.hybrid import HybridCleaner
+from translator.utils import InPaintJob
+
+
+def make_job(window: int, target: tuple[int, int, int, int], text: tuple[int, int, int, int]) -> InPaintJob:
+    mask = np.zeros((window, window), dtype=np.uint8)
+    x1, y1, x2, y2 = text
+    mask[y1:y2, x1:x2] = 255
+    return InPaintJob((0, 0, window, window), target, mask)
+
+
+def make_frame(window: int, flat: tuple[int, int, int, int], seed: int = 0) -> np.ndarray:
+    """Noise everywhere but the flat (x1, y1, x2, y2) grey area"""
+    frame = np.random.default_rng(seed).integers(0, 255, (window, window, 3), dtype=np.uint8)
+    x1, y1, x2, y2 = flat
+    frame[y1:y2, x1:x2] = 200
+    return frame
+
+
+def test_flat_background_is_filled():
+    frame = make_frame(128, (0, 0, 128, 128))
+    frame[50:70, 40:90] = 0  # the text
+    job = make_job(128, (32, 32, 96, 96), (36, 44, 94, 76))
+    final = frame.copy()
+
+    assert HybridCleaner().try_fill_flat(frame, final, job)
+    assert (final[44:76, 36:94] == 200).all()
+
+
+def test_texture_around_a_full_target_is_not_filled():
+    # only a 2 px border of the target is flat, the rest of the window around it is textured
+    frame = make_frame(128, (32, 32, 96, 96))
+    job = make_job(128, (32, 32, 96, 96), (34, 34, 94, 94))
+    final = frame.copy()
+
+    assert not HybridCleaner().try_fill_flat(frame, final, job)
+    assert (final == frame).all()
+
+
+def test_small_ring_is_not_trusted():
+    # the text fills the window, so there is next to no ring even though what is left is flat
+    frame = make_frame(64, (0, 0, 64, 64))
+    job = make_job(64, (0, 0, 64, 64), (1, 1, 63, 63))
+
+    assert not HybridCleaner().try_fill_flat(frame, frame.copy(), job)
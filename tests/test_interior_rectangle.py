@@ -0,0 +1,64 @@
+import cv2
+import numpy as np
+import pytest
+import largestinteriorrectangle as lir
+from translator import interior_rectangle
+from translator.interior_rectangle import get_interior_rectangle
+from translator.utils import BubbleAnalyzer
+
+# pixels every edge of the draw rectangle may be away from the one lir.lir finds
+TOLERANCE = 1
+
+
+def make_mask(kind: str, w: int, h: int, seed: int) -> np.ndarray:
+    mask = np.zeros((h + 10, w + 10), dtype=np.uint8)
+    if kind == "ellipse":
+        cv2.ellipse(mask, (w // 2 + 5, h // 2 + 5), (w // 2, h // 2), 0, 0, 360, 255, -1)
+    else:
+        rng = np.random.default_rng(seed)
+        points = []
+        for angle in np.linspace(0, 2 * np.pi, int(rng.integers(8, 24)), endpoint=False):
+            radius = rng.uniform(0.5, 1.0)
+            points.append((w / 2 + 5 + np.cos(angle) * w / 2 * radius, h / 2 + 5 + np.sin(angle) * h / 2 * radius))
+        cv2.fillPoly(mask, [np.array(points, dtype=np.int32)], 255)
+    return mask
+
+
+def get_polygon(mask: np.ndarray) -> np.ndarray:
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+    return np.array([max(contours, key=cv2.contourArea)[:, 0, :]])
+
+
+def assert_within_tolerance(expected, actual):
+    (ex1, ey1), (ex2, ey2) = expected
+    (ax1, ay1), (ax2, ay2) = actual
+    assert max([abs(int(a) - int(b)) for a, b in zip((ex1, ey1, ex2, ey2), (ax1, ay1, ax2, ay2))]) <= TOLERANCE
+    # never smaller than the exact one
+    assert (ax2 - ax1 + 1) * (ay2 - ay1 + 1) >= (ex2 - ex1 + 1) * (ey2 - ey1 + 1)
+
+
+@pytest.mark.parametrize("kind", ["ellipse", "irregular"])
+@pytest.mark.parametrize("size", [(40, 30), (120, 200), (333, 181), (700, 520)])
+def test_matches_lir(kind, size):
+    for seed in range(4):
+        w, h = size[0] + seed * 7, size[1] + seed * 5
+        polygon = get_polygon(make_mask(kind, w, h, seed))
+        rect = lir.lir(polygon)
+
+        interior_rectangle._cache.clear()
+        assert_within_tolerance((lir.pt1(rect), lir.pt2(rect)), get_interior_rectangle(polygon))
+        # memoised
+        assert_within_tolerance((lir.pt1(rect), lir.pt2(rect)), get_interior_rectangle(polygon))
+
+
+@pytest.mark.parametrize("kind", ["ellipse", "irregular"])
+def test_bubble_analyzer_matches_exact(kind):
+    fast, exact = BubbleAnalyzer(), BubbleAnalyzer(exact_lir=True)
+    for seed in range(6):
+        mask = make_mask(kind, 150 + seed * 31, 110 + seed * 17, seed)
+        assert_within_tolerance(exact.get_draw_bounds(mask), fast.get_draw_bounds(mask))
+
+
+def test_empty_mask():
+    assert interior_rectangle.largest_interior_rectangle(np.zeros((20, 30), dtype=bool)) == (0, 0, 0, 0)
+    assert BubbleAnalyzer().get_draw_bounds(np.zeros((20, 30), dtype=np.uint8)) is None
@@ -0,0 +1,29 @@
+import inspect
+import numpy as np
+import pytest
+import torch
+from translator.cleaners.deepfillv2 import DeepFillV2Cleaner
+from translator.cleaners.deepfillv2_impl import Generator
+from scripts.export_onnx import GeneratorOutput, export, make_inputs
+
+pytest.importorskip("onnxruntime")
+pytest.importorskip("onnxscript")
+
+if "dynamo" not in inspect.signature(torch.onnx.export).parameters:
+    pytest.skip("needs the dynamo onnx exporter (torch 2.5 or newer)", allow_module_level=True)
+
+
+def test_onnx_matches_torch(tmp_path):
+    torch.manual_seed(0)
+    model = GeneratorOutput(Generator(cnum_in=5, cnum=16)).eval()
+    path = str(tmp_path / "generator.onnx")
+    export(model, path)
+
+    session = DeepFillV2Cleaner.load_onnx_session(path)
+    # the traced shape and bucket shapes it was not traced with
+    for i, (n, h, w) in enumerate([(1, 256, 256), (2, 256, 384), (1, 384, 512)]):
+        x, mask = make_inputs(n, h, w, seed=i)
+        with torch.inference_mode():
+            expected = model(x, mask).numpy()
+        actual = session.run(None, {"x": x.numpy(), "mask": mask.numpy()})[0]
+        np.testing.assert_allclose(actual, expected, atol=1e-3)
@@ -0,0 +1,93 @@
+import asyncio
+import cv2
+import numpy as np
+import server
+from translator.core.cache import PageCache, StageCache
+from translator.core.plugin import Cleaner, Drawer, Translator, TranslatorResult
+from translator.detection import DetectionResult
+from translator.pipelines import FullConversion
+
+
+class CopyCleaner(Cleaner):
+    async def clean(self, frame, mask, detection_results=[]):
+        return frame.copy(), mask
+
+
+class CopyDrawer(Drawer):
+    async def draw(self, batch):
+        return [(x.frame, np.zeros(x.frame.shape[:2], dtype=np.uint8)) for x in batch]
+
+
+class FlakyTranslator(Translator):
+    """Fails the way it is told to the first time, then translates"""
+
+    def __init__(self, failure: str) -> None:
+        super().__init__()
+        self.failure = failure
+        self.calls = 0
+
+    async def translate(self, batch):
+        self.calls += 1
+        if self.calls == 1:
+            if self.failure == "raise":
+                raise BaseException("429 Too Many Requests")
+            return [TranslatorResult("Failed To Get Translation", failed=True) for _ in batch]
+        return [TranslatorResult("Hello") for _ in batch]
+
+
+def make_page():
+    frame = np.full((300, 300, 3), 120, dtype=np.uint8)
+    cv2.ellipse(frame, (150, 150), (110, 80), 0, 0, 360, (255, 255, 255), -1)
+    cv2.putText(frame, "TEXT", (100, 160), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 0), 2)
+    detection = DetectionResult(
+        boxes=np.array([[40, 70, 260, 230]], dtype=np.float32),
+        classes=np.array([0]),
+        confidences=np.array([0.9]),
+        names={0: "text_bubble"},
+    )
+    segmentation = DetectionResult(
+        boxes=np.zeros((1, 4), dtype=np.float32),
+        classes=np.array([0]),
+        confidences=np.array([0.9]),
+        names={0: "text"},
+        masks=[np.array([[95, 130], [205, 130], [205, 170], [95, 170]], dtype=np.float32)],
+    )
+    return frame, detection, segmentation
+
+
+def run_twice(tmp_path, monkeypatch, failure: str):
+    monkeypatch.setattr(server, "PAGE_CACHE", PageCache(memory_bytes=64 * 1024 * 1024, disk_path=str(tmp_path)))
+    frame, detection, segmentation = make_page()
+    translator = FlakyTranslator(failure)
+    converter = FullConversion(
+        translator=translator,
+        drawer=CopyDrawer(),
+        cleaner=CopyCleaner(),
+        color_detect_model=None,
+        stage_cache=StageCache(),
+    )
+    detections = []
+
+    async def run_detection(images):
+        detections.append(len(images))
+        return [(detection, segmentation) for _ in images]
+
+    monkeypatch.setattr(converter, "run_detection", run_detection)
+
+    key = PageCache.make_key(frame, {"route": "test"})
+    asyncio.run(server.convert_and_cache(converter, frame, key))
+    assert server.PAGE_CACHE.get(key) is None
+
+    asyncio.run(server.convert_and_cache(converter, frame, key))
+    assert translator.calls == 2
+    assert server.PAGE_CACHE.get(key) is not None
+    return detections
+
+
+def test_page_is_converted_again_after_translator_raised(tmp_path, monkeypatch):
+    run_twice(tmp_path, monkeypatch, "raise")
+
+
+def test_page_is_converted_again_after_failed_translation(tmp_path, monkeypatch):
+    # the detections of the first attempt are still reused from the stage cache
+    assert run_twice(tmp_path, monkeypatch, "result") == [1]
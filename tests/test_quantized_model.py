@@ -0,0 +1,49 @@
+import pytest
+import torch
+from translator.cleaners.deepfillv2_impl import (
+    Generator,
+    convert_quantization,
+    get_quantized_engine,
+    load_quantized_model,
+    prepare_quantization,
+)
+
+
+def make_checkpoint(path):
+    """Quantizes an untrained generator the way scripts/quantize_deepfill.py does"""
+    engine = get_quantized_engine()
+    gen = Generator(cnum_in=5, cnum=48, return_flow=False)
+    prepare_quantization(gen, engine)
+    with torch.inference_mode():
+        gen(torch.rand(1, 5, 64, 64) * 2 - 1, (torch.rand(1, 1, 64, 64) > 0.5).float())
+    convert_quantization(gen)
+    torch.save({"G": gen.state_dict(), "engine": engine}, path)
+    return gen
+
+
+def test_loads_quantized_weights(tmp_path):
+    path = str(tmp_path / "inpainting_int8.pt")
+    saved = make_checkpoint(path).state_dict()
+    loaded = load_quantized_model(path).state_dict()
+
+    assert saved.keys() == loaded.keys()
+    for key, value in saved.items():
+        if isinstance(value, torch.Tensor):
+            expected = value.dequantize() if value.is_quantized else value
+            actual = loaded[key].dequantize() if loaded[key].is_quantized else loaded[key]
+            assert torch.equal(expected, actual), key
+
+
+@pytest.mark.parametrize("change", ["missing", "unexpected"])
+def test_rejects_checkpoints_with_other_keys(tmp_path, change):
+    path = str(tmp_path / "inpainting_int8.pt")
+    make_checkpoint(path)
+    checkpoint = torch.load(path)
+    if change == "missing":
+        checkpoint["G"].pop(next(iter(checkpoint["G"].keys())))
+    else:
+        checkpoint["G"]["stale.weight"] = torch.zeros(1)
+    torch.save(checkpoint, path)
+
+    with pytest.raises(BaseException, match="do not match the generator"):
+        load_quantized_model(path)
@@ -0,0 +1,55 @@
+import threading
+import time
+from translator.core.registry import ModelRegistry
+
+
+class StatefulModel:
+    """Fails if two threads run it at once, like an ultralytics predictor"""
+
+    def __init__(self) -> None:
+        self.running = 0
+        self.overlapped = False
+
+    def __call__(self):
+        self.running += 1
+        self.overlapped |= self.running > 1
+        time.sleep(0.01)
+        self.running -= 1
+
+
+def run_in_threads(target, count: int = 8):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_use_runs_a_model_on_one_thread_at_a_time():
+    registry = ModelRegistry()
+
+    def run():
+        for _ in range(3):
+            with registry.use("yolo", StatefulModel) as model:
+                model()
+
+    run_in_threads(run)
+    model = registry.get("yolo", StatefulModel)
+    assert registry.loads == 1
+    assert not model.overlapped
+
+
+def test_different_models_run_at_the_same_time():
+    registry = ModelRegistry()
+    inside = threading.Barrier(2, timeout=5)
+
+    def run(key):
+        with registry.use(key, StatefulModel):
+            inside.wait()
+
+    threads = [threading.Thread(target=run, args=(key,)) for key in ["detection", "segmentation"]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not inside.broken
@@ -0,0 +1,93 @@
+import asyncio
+import threading
+import numpy as np
+import server
+from translator.core.constants import PipelineStages
+from translator.core.executors import StageExecutor, create_stage_executors
+from translator.core.plugin import Cleaner, Drawer, Translator, TranslatorResult
+from translator.pipelines import FullConversion
+from tests.test_page_cache import make_page
+
+
+class ThreadRecorder:
+    def __init__(self) -> None:
+        self.threads: dict[str, int] = {}
+
+
+class RecordingCleaner(Cleaner):
+    def __init__(self, recorder: ThreadRecorder) -> None:
+        super().__init__()
+        self.recorder = recorder
+
+    async def clean(self, frame, mask, detection_results=[]):
+        self.recorder.threads[PipelineStages.CLEANING] = threading.get_ident()
+        return frame.copy(), mask
+
+
+class RecordingDrawer(Drawer):
+    def __init__(self, recorder: ThreadRecorder) -> None:
+        super().__init__()
+        self.recorder = recorder
+
+    async def draw(self, batch):
+        self.recorder.threads[PipelineStages.DRAWING] = threading.get_ident()
+        return [(x.frame, np.zeros(x.frame.shape[:2], dtype=np.uint8)) for x in batch]
+
+
+class HelloTranslator(Translator):
+    async def translate(self, batch):
+        return [TranslatorResult("Hello") for _ in batch]
+
+
+def convert(kind: str) -> tuple[int, dict[str, int]]:
+    """Converts a page with executors of kind, returns the thread of the event loop and the threads the stages ran on"""
+    frame, detection, segmentation = make_page()
+    recorder = ThreadRecorder()
+    executors = create_stage_executors(kind, 2)
+    converter = FullConversion(
+        translator=HelloTranslator(),
+        drawer=RecordingDrawer(recorder),
+        cleaner=RecordingCleaner(recorder),
+        color_detect_model=None,
+        executors=executors,
+    )
+
+    async def run_detection(images):
+        return [(detection, segmentation) for _ in images]
+
+    converter.run_detection = run_detection
+
+    async def run():
+        return threading.get_ident(), await converter.convert_page(frame)
+
+    try:
+        loop_thread, _ = asyncio.run(run())
+    finally:
+        for executor in executors.values():
+            executor.shutdown()
+
+    return loop_thread, recorder.threads
+
+
+def test_stages_run_off_the_event_loop():
+    loop_thread, threads = convert(StageExecutor.THREAD)
+    assert set(threads.keys()) == {PipelineStages.CLEANING, PipelineStages.DRAWING}
+    for thread in threads.values():
+        assert thread != loop_thread
+
+
+def test_none_runs_stages_on_the_event_loop():
+    loop_thread, threads = convert(StageExecutor.NONE)
+    assert set(threads.keys()) == {PipelineStages.CLEANING, PipelineStages.DRAWING}
+    for thread in threads.values():
+        assert thread == loop_thread
+
+
+def test_server_converters_use_thread_executors():
+    assert set(server.STAGE_EXECUTORS.keys()) == {
+        PipelineStages.CLEANING,
+        PipelineStages.MASKING,
+        PipelineStages.COLOR_DETECTION,
+        PipelineStages.DRAWING,
+    }
+    assert all([x.kind == StageExecutor.THREAD for x in server.STAGE_EXECUTORS.values()])
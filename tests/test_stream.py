@@ -0,0 +1,44 @@
+import asyncio
+from translator.core.plugin import Translator, TranslatorResult
+from translator.pipelines import FullConversion
+from tests.test_page_cache import CopyCleaner, CopyDrawer, make_page
+
+
+class HelloTranslator(Translator):
+    async def translate(self, batch):
+        return [TranslatorResult("Hello") for _ in batch]
+
+
+def stream(pages: int, **kwargs) -> tuple[list[int], list[int]]:
+    """Streams pages copies of the test page, returns the indices yielded and the size of every detection batch"""
+    frame, detection, segmentation = make_page()
+    converter = FullConversion(
+        translator=HelloTranslator(),
+        drawer=CopyDrawer(),
+        cleaner=CopyCleaner(),
+        color_detect_model=None,
+    )
+    batches = []
+
+    async def run_detection(images):
+        batches.append(len(images))
+        return [(detection, segmentation) for _ in images]
+
+    converter.run_detection = run_detection
+
+    async def run():
+        return [index async for index, _ in converter.stream((frame.copy() for _ in range(pages)), **kwargs)]
+
+    return asyncio.run(run()), batches
+
+
+def test_read_ahead_pages_are_detected_together():
+    indices, batches = stream(10, read_ahead=8, detect_batch_size=4)
+    assert sorted(indices) == list(range(10))
+    assert batches == [4, 4, 2]
+
+
+def test_pages_are_detected_one_at_a_time_by_default():
+    indices, batches = stream(5)
+    assert sorted(indices) == list(range(5))
+    assert batches == [1, 1, 1, 1, 1]
@@ -0,0 +1,208 @@
+import atexit
+import multiprocessing
+import os
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Union
+import numpy as np
+import torch
+from translator.utils import (
+    InPaintJob,
+    log_in_paint_area,
+    merge_in_paint_jobs,
+    plan_in_paint_jobs,
+)
+
+# settings of the worker process, set once by _init_worker
+_worker_settings: dict = {}
+
+
+def _init_worker(model_path: str, precision: str, backend: str, threads: int):
+    torch.set_num_threads(threads)
+    os.environ.setdefault("ONNX_INTRA_OP_THREADS", str(threads))
+    _worker_settings.update(model_path=model_path, precision=precision, backend=backend)
+
+    from translator.cleaners.deepfillv2 import DeepFillV2Cleaner
+
+    # load the generator up front so the first page does not pay for it
+    blank = np.zeros((8, 8, 3), dtype=np.uint8)
+    DeepFillV2Cleaner.in_paint_batch([blank], [blank[:, :, 0]], model_path, 1, precision, backend)
+
+
+def _in_paint_shared(
+    source_name: str, destination_name: str, shape: tuple[int, int, int], jobs: list[InPaintJob]
+):
+    """Runs in a worker, inpaints jobs from the shared source frame straight into the shared destination frame"""
+    from translator.cleaners.deepfillv2 import DeepFillV2Cleaner
+
+    source_memory = shared_memory.SharedMemory(name=source_name)
+    destination_memory = shared_memory.SharedMemory(name=destination_name)
+    try:
+        source = np.ndarray(shape, dtype=np.uint8, buffer=source_memory.buf)
+        destination = np.ndarray(shape, dtype=np.uint8, buffer=destination_memory.buf)
+
+        DeepFillV2Cleaner.in_paint_batch(
+            [job.get_section(source) for job in jobs],
+            [job.mask for job in jobs],
+            _worker_settings["model_path"],
+            len(jobs),
+            _worker_settings["precision"],
+            _worker_settings["backend"],
+            destinations=[job.get_destinations(destination) for job in jobs],
+        )
+        del source, destination
+    finally:
+        source_memory.close()
+        destination_memory.close()
+
+
+def get_target_in_frame(job: InPaintJob) -> tuple[int, int, int, int]:
+    """x1, y1, x2, y2 of the frame the job writes to"""
+    x1, y1 = job.window[:2]
+    tx1, ty1, tx2, ty2 = job.target
+    return x1 + tx1, y1 + ty1, x1 + tx2, y1 + ty2
+
+
+def split_into_waves(jobs: list[InPaintJob]) -> list[list[InPaintJob]]:
+    """Groups jobs so no two jobs in a wave write to the same pixels. A job always lands in a later wave than every
+    earlier job it overlaps, so running the waves in order resolves overlaps the same way as pasting in order"""
+    waves: list[list[InPaintJob]] = []
+    placed: list[tuple[tuple[int, int, int, int], int]] = []
+    for job in jobs:
+        x1, y1, x2, y2 = get_target_in_frame(job)
+        wave = 0
+        for (px1, py1, px2, py2), index in placed:
+            if x1 < px2 and px1 < x2 and y1 < py2 and py1 < y2:
+                wave = max(wave, index + 1)
+
+        if wave == len(waves):
+            waves.append([])
+        waves[wave].append(job)
+        placed.append(((x1, y1, x2, y2), wave))
+
+    return waves
+
+
+class InPaintWorkerPool:
+    """Worker processes that each hold their own DeepFill generator and inpaint the windows of a page held in shared memory.
+
+    The page and the cleaned result live in multiprocessing.shared_memory, so only the jobs (window, target and mask)
+    are sent to the workers and results are written straight into the shared result instead of being sent back.
+    Torch threads are split between the workers since small crops barely use more than a few each.
+    """
+
+    _pools: dict[tuple[str, str, str, int], "InPaintWorkerPool"] = {}
+
+    _pools_lock = threading.Lock()
+
+    def __init__(
+        self,
+        workers: int,
+        model_path: str,
+        precision: str = "fp32",
+        backend: str = "torch",
+        threads: Union[int, None] = None,
+    ) -> None:
+        self.workers = workers
+        self.threads = (
+            threads if threads is not None else max(1, (os.cpu_count() or 1) // workers)
+        )
+        # spawned rather than forked, forking a process that already started torch's thread pools can hang
+        self.pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(model_path, precision, backend, self.threads),
+        )
+
+    @staticmethod
+    def get(workers: int, model_path: str, precision: str = "fp32", backend: str = "torch") -> "InPaintWorkerPool":
+        """Pool shared by every cleaner with the same settings, started on first use"""
+        key = (model_path, precision, backend, workers)
+        with InPaintWorkerPool._pools_lock:
+            pool = InPaintWorkerPool._pools.get(key, None)
+            if pool is None:
+                pool = InPaintWorkerPool(workers, model_path, precision, backend)
+                InPaintWorkerPool._pools[key] = pool
+            return pool
+
+    @staticmethod
+    def shutdown_all():
+        with InPaintWorkerPool._pools_lock:
+            for pool in InPaintWorkerPool._pools.values():
+                pool.shutdown()
+            InPaintWorkerPool._pools.clear()
+
+    def in_paint(self, frame: np.ndarray, jobs: list[InPaintJob]) -> np.ndarray:
+        """Copy of frame with jobs inpainted, windows are cut from frame itself like in_paint_optimized_batched"""
+        source_memory = shared_memory.SharedMemory(create=True, size=frame.nbytes)
+        destination_memory = shared_memory.SharedMemory(create=True, size=frame.nbytes)
+        try:
+            source = np.ndarray(frame.shape, dtype=np.uint8, buffer=source_memory.buf)
+            destination = np.ndarray(frame.shape, dtype=np.uint8, buffer=destination_memory.buf)
+            source[:] = frame
+            destination[:] = frame
+
+            for wave in split_into_waves(jobs):
+                # a handful of jobs per task keeps the workers busy without paying for a round trip per crop
+                chunk = max(1, len(wave) // (self.workers * 2))
+                futures = [
+                    self.pool.submit(
+                        _in_paint_shared,
+                        source_memory.name,
+                        destination_memory.name,
+                        frame.shape,
+                        wave[start : start + chunk],
+                    )
+                    for start in range(0, len(wave), chunk)
+                ]
+                for future in futures:
+                    try:
+                        future.result()
+                    except:
+                        traceback.print_exc()
+
+            final = destination.copy()
+            del source, destination
+            return final
+        finally:
+            source_memory.close()
+            source_memory.unlink()
+            destination_memory.close()
+            destination_memory.unlink()
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+atexit.register(InPaintWorkerPool.shutdown_all)
+
+
+def in_paint_in_workers(
+    frame: np.ndarray,
+    mask: np.ndarray,
+    filtered: list[tuple[tuple[int, int, int, int], str, float]],
+    pool: InPaintWorkerPool,
+    max_height: int = 256,
+    max_width: int = 256,
+    mask_dilation_kernel_size: int = 9,
+    max_merged_area: Union[int, None] = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """in_paint_optimized_batched with the windows spread over the processes of pool"""
+    text_mask = np.zeros_like(mask)
+
+    jobs = plan_in_paint_jobs(
+        frame, mask, text_mask, filtered, max_height, max_width, mask_dilation_kernel_size
+    )
+
+    if max_merged_area is not None:
+        merged = merge_in_paint_jobs(jobs, max_merged_area)
+        log_in_paint_area(jobs, merged)
+        jobs = merged
+
+    if len(jobs) == 0:
+        return frame.copy(), text_mask
+
+    return pool.in_paint(np.ascontiguousarray(frame), jobs), text_mask
@@ -1,20 +1,36 @@
-import queue
+import copy
+import math
+import os
+import threading
 from typing import Union
 import numpy as np
-from PIL import Image
 from numpy import ndarray
 import torch
-from translator.core.plugin import Cleaner
-from translator.utils import cv2_to_pil, in_paint_optimized, pil_to_cv2, get_model_path
-from PIL import Image
-from translator.cleaners.deepfillv2_impl import load_model
-import torch
-import torchvision.transforms as T
-import threading
-import os
-import asyncio
-import sys
-import atexit
+from translator.core.plugin import (
+    Cleaner,
+    PluginArgument,
+    PluginTextArgument,
+    PluginSelectArgument,
+    PluginSelectArgumentOption,
+)
+from translator.utils import (
+    in_paint_optimized,
+    in_paint_optimized_batched,
+)
+from translator.cleaners.deepfillv2_impl import load_model, load_quantized_model
+from translator.core.registry import MODELS
+
+
+class InPaintBuffers:
+    """Input and output tensors for one bucket shape, reused for every batch that falls into it"""
+
+    def __init__(self, h: int, w: int, batch_size: int, device: torch.device) -> None:
+        self.batch_size = batch_size
+        self.image = torch.empty((batch_size, 3, h, w), device=device)
+        self.mask = torch.empty((batch_size, 1, h, w), device=device)
+        self.x = torch.empty((batch_size, 5, h, w), device=device)
+        self.output = torch.empty((batch_size, h, w, 3), dtype=torch.uint8)
+        self.lock = threading.Lock()
 
 
 class DeepFillV2Cleaner(Cleaner):
@@ -24,84 +40,341 @@ class DeepFillV2Cleaner(Cleaner):
 
     DEFAULT_MODEL_PATH = os.path.join("models", "inpainting.pt")
 
-    _model = None
-
-    _model_path = ""
     @staticmethod
     def get_model(path: str):
-        if path == DeepFillV2Cleaner._model_path:
-            return DeepFillV2Cleaner._model
-        else:
-            DeepFillV2Cleaner._model = load_model(
-                path, DeepFillV2Cleaner.IN_PAINT_MODEL_DEVICE
+        device = DeepFillV2Cleaner.IN_PAINT_MODEL_DEVICE
+        return MODELS.get(f"deepfill:{path}:{device}", lambda: load_model(path, device))
+
+    @staticmethod
+    def get_channels_last_model(path: str):
+        """Copy of the generator with its weights in channels_last, used by the bf16 mode"""
+        device = DeepFillV2Cleaner.IN_PAINT_MODEL_DEVICE
+        return MODELS.get(
+            f"deepfill-channels-last:{path}:{device}",
+            lambda: copy.deepcopy(DeepFillV2Cleaner.get_model(path)).to(
+                memory_format=torch.channels_last
+            ),
+        )
+
+    @staticmethod
+    def get_quantized_model(path: str):
+        """The int8 generator written by scripts/quantize_deepfill.py for the model at path"""
+        path = DeepFillV2Cleaner.get_quantized_model_path(path)
+        # packed int8 weights are not visible as parameters, so the file size stands in for the model size
+        return MODELS.get(
+            f"deepfill-int8:{path}",
+            lambda: load_quantized_model(path),
+            os.path.getsize(path) if os.path.exists(path) else None,
+        )
+
+    @staticmethod
+    def get_quantized_model_path(path: str) -> str:
+        """models/inpainting.pt => models/inpainting_int8.pt"""
+        base, extension = os.path.splitext(path)
+        return f"{base}_int8{extension}"
+
+    @staticmethod
+    def load_onnx_session(path: str):
+        if not os.path.exists(path):
+            raise BaseException("ONNX model not found! Create it with scripts/export_onnx.py")
+
+        try:
+            import onnxruntime
+        except ImportError:
+            raise BaseException("onnxruntime is not installed! Install the onnx extra with poetry install -E onnx")
+
+        options = onnxruntime.SessionOptions()
+        # one crop batch runs at a time, so all threads go to the ops themselves
+        options.intra_op_num_threads = int(
+            os.environ.get("ONNX_INTRA_OP_THREADS", torch.get_num_threads())
+        )
+        options.inter_op_num_threads = 1
+        options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        return onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+    @staticmethod
+    def get_onnx_session(path: str):
+        """onnxruntime session for the graph written by scripts/export_onnx.py for the model at path"""
+        path = f"{os.path.splitext(path)[0]}.onnx"
+        return MODELS.get(
+            f"deepfill-onnx:{path}",
+            lambda: DeepFillV2Cleaner.load_onnx_session(path),
+            os.path.getsize(path) if os.path.exists(path) else None,
+        )
+
+    @staticmethod
+    def is_bf16_supported() -> bool:
+        """Whether the inpainting device has fast bfloat16 kernels (avx512_bf16 / amx on cpu)"""
+        device = DeepFillV2Cleaner.IN_PAINT_MODEL_DEVICE
+        if device.type == "cuda":
+            return torch.cuda.is_bf16_supported()
+
+        try:
+            return (
+                torch.backends.mkldnn.is_available()
+                and torch.ops.mkldnn._is_mkldnn_bf16_supported()
             )
-            DeepFillV2Cleaner._model_path = path
-            return DeepFillV2Cleaner._model
+        except (AttributeError, RuntimeError):
+            return False
+
+    BUCKET_SIZES = [256, 384, 512]
+
+    # lengths above the largest bucket are only padded to this, the generator needs a multiple of 8
+    OVERSIZE_MULTIPLE = 64
+
+    # (h, w, device type) => buffers, only ever holds the BUCKET_SIZES x BUCKET_SIZES shapes
+    _buffers: dict[tuple[int, int, str], "InPaintBuffers"] = {}
+
+    _buffers_lock = threading.Lock()
+
+    @staticmethod
+    def get_bucket_size(length: int) -> int:
+        """The smallest bucket length fits in, lengths above the largest bucket are rounded up to a multiple of
+        OVERSIZE_MULTIPLE so large crops (where inpainting costs the most) are barely padded"""
+        for size in DeepFillV2Cleaner.BUCKET_SIZES:
+            if length <= size:
+                return size
+
+        multiple = DeepFillV2Cleaner.OVERSIZE_MULTIPLE
+        return int(math.ceil(length / multiple) * multiple)
 
     @staticmethod
-    def in_paint(
-        image: Image,
-        mask: Image,
+    def get_buffers(
+        h: int, w: int, batch_size: int, device: Union[torch.device, None] = None
+    ) -> "InPaintBuffers":
+        """Buffers for a batch of (h, w) crops. Only the fixed bucket shapes are kept between calls, crops above the
+        largest bucket can be any multiple of OVERSIZE_MULTIPLE so their buffers are made for the call and freed
+        after it"""
+        device = device if device is not None else DeepFillV2Cleaner.IN_PAINT_MODEL_DEVICE
+        if h not in DeepFillV2Cleaner.BUCKET_SIZES or w not in DeepFillV2Cleaner.BUCKET_SIZES:
+            return InPaintBuffers(h, w, batch_size, device)
+
+        with DeepFillV2Cleaner._buffers_lock:
+            buffers = DeepFillV2Cleaner._buffers.get((h, w, device.type), None)
+            if buffers is None or buffers.batch_size < batch_size:
+                buffers = InPaintBuffers(h, w, batch_size, device)
+                DeepFillV2Cleaner._buffers[(h, w, device.type)] = buffers
+            return buffers
+
+    @staticmethod
+    def in_paint_batch(
+        images: list[np.ndarray],
+        masks: list[np.ndarray],
         model_path: str = DEFAULT_MODEL_PATH,
-    ) -> Image:
-        generator = DeepFillV2Cleaner.get_model(model_path)
+        max_batch_size: int = 16,
+        precision: str = "fp32",
+        backend: str = "torch",
+        destinations: Union[list[list[tuple[np.ndarray, tuple[int, int, int, int]]]], None] = None,
+    ) -> list[Union[np.ndarray, None]]:
+        """Inpaints BGR images with a forward per bucket of images instead of one per image.
+        Every image is padded up to one of a few bucket shapes, the padding is masked so the model ignores it.
 
-        # prepare input
-        image = T.ToTensor()(image)
-        mask = T.ToTensor()(mask.convert("L"))
+        With precision "bf16" the generator runs under bfloat16 autocast on channels_last tensors,
+        falling back to fp32 if the device does not support it.
+        With precision "int8" the quantized copy of the model is used, which always runs on the cpu.
+        With backend "onnx" the exported graph runs in onnxruntime on the cpu and precision is ignored.
 
-        h, w = image.shape[1:]
-        grid = 8
+        If destinations are given, every result is written straight into its destinations (usually views of the frame
+        being cleaned, each with the (x1, y1, x2, y2) region of the result that goes there) and None is returned in its place.
+        """
+        device = DeepFillV2Cleaner.IN_PAINT_MODEL_DEVICE
+        use_bf16 = False
+        if backend == "onnx":
+            session = DeepFillV2Cleaner.get_onnx_session(model_path)
+            generator = lambda x, mask: (
+                None,
+                torch.from_numpy(session.run(None, {"x": x.numpy(), "mask": mask.numpy()})[0]),
+            )
+            device = torch.device("cpu")
+        elif precision == "int8":
+            generator = DeepFillV2Cleaner.get_quantized_model(model_path)
+            device = torch.device("cpu")
+        elif precision == "bf16" and DeepFillV2Cleaner.is_bf16_supported():
+            generator = DeepFillV2Cleaner.get_channels_last_model(model_path)
+            use_bf16 = True
+        else:
+            generator = DeepFillV2Cleaner.get_model(model_path)
 
-        # pad to multiple of grid
-        pad_height = grid - h % grid if h % grid > 0 else 0
-        pad_width = grid - w % grid if w % grid > 0 else 0
+        buckets: dict[tuple[int, int], list[int]] = {}
+        for i, image in enumerate(images):
+            h, w = image.shape[:2]
+            key = (
+                DeepFillV2Cleaner.get_bucket_size(h),
+                DeepFillV2Cleaner.get_bucket_size(w),
+            )
+            buckets.setdefault(key, []).append(i)
 
-        image = torch.nn.functional.pad(image, (0, pad_width, 0, pad_height)).unsqueeze(
-            0
-        )
-        mask = torch.nn.functional.pad(mask, (0, pad_width, 0, pad_height)).unsqueeze(0)
+        results: list[Union[np.ndarray, None]] = [None for _ in images]
 
-        image = (image * 2 - 1.0).to(
-            DeepFillV2Cleaner.IN_PAINT_MODEL_DEVICE
-        )  # map image values to [-1, 1] range
-        mask = (mask > 0.5).to(
-            dtype=torch.float32, device=DeepFillV2Cleaner.IN_PAINT_MODEL_DEVICE
-        )  # 1.: masked 0.: unmasked
+        for (bucket_h, bucket_w), indices in buckets.items():
+            for start in range(0, len(indices), max_batch_size):
+                batch_indices = indices[start : start + max_batch_size]
+                count = len(batch_indices)
 
-        image_masked = image * (1.0 - mask)  # mask image
+                buffers = DeepFillV2Cleaner.get_buffers(bucket_h, bucket_w, count, device)
+                with buffers.lock:
+                    image = buffers.image[:count]
+                    mask = buffers.mask[:count]
+                    x = buffers.x[:count]
+                    output = buffers.output[:count]
 
-        ones_x = torch.ones_like(image_masked)[:, 0:1, :, :]
-        x = torch.cat(
-            [image_masked, ones_x, ones_x * mask], dim=1
-        )  # concatenate channels
+                    # set up so the in place normalisation below maps padding to 0 (image) and 1 (mask, treated as a hole)
+                    image.fill_(127.5)
+                    mask.fill_(255.0)
 
-        with torch.inference_mode():
-            _, x_stage2 = generator(x, mask)
+                    for j, i in enumerate(batch_indices):
+                        h, w = images[i].shape[:2]
+                        section = torch.from_numpy(images[i])
+                        section_mask = masks[i] if masks[i].ndim == 2 else masks[i][:, :, 0]
 
-        # complete image
-        image_in_painted = image * (1.0 - mask) + x_stage2 * mask
+                        # strided copies straight from the BGR uint8 crop, the cast to float happens inside copy_
+                        for c in range(3):
+                            image[j, c, :h, :w].copy_(section[:, :, 2 - c])  # BGR => RGB
+                        mask[j, 0, :h, :w].copy_(torch.from_numpy(section_mask))
 
-        # convert in_painted image to PIL Image
-        img_out = (image_in_painted[0].permute(1, 2, 0) + 1) * 127.5
-        img_out = img_out.to(device="cpu", dtype=torch.uint8)
-        img_out = Image.fromarray(img_out.numpy())
+                    image.div_(127.5).sub_(1.0)  # map image values to [-1, 1] range
+                    mask.gt_(127.0)  # 1.: masked 0.: unmasked
 
-        # # crop padding
-        # img_out = img_out.crop((0, 0, w, h))
+                    torch.mul(image, 1.0 - mask, out=x[:, 0:3])  # mask image
+                    x[:, 3:4].fill_(1.0)
+                    x[:, 4:5].copy_(mask)
 
-        return img_out
+                    with torch.inference_mode():
+                        if use_bf16:
+                            with torch.autocast(device.type, dtype=torch.bfloat16):
+                                _, x_stage2 = generator(
+                                    x.contiguous(memory_format=torch.channels_last), mask
+                                )
+                            x_stage2 = x_stage2.float()
+                        else:
+                            _, x_stage2 = generator(x, mask)
 
+                    # complete image, the mask is binary so this is the same as image * (1 - mask) + x_stage2 * mask
+                    torch.where(mask.bool(), x_stage2, image, out=image)
+                    image.add_(1.0).mul_(127.5)
+                    for c in range(3):
+                        output[:, :, :, c].copy_(image[:, 2 - c])  # RGB => BGR, truncated to uint8
 
-    def __init__(self) -> None:
+                    output_np = output.numpy()
+                    for j, i in enumerate(batch_indices):
+                        h, w = images[i].shape[:2]
+                        if destinations is not None:
+                            for destination, (x1, y1, x2, y2) in destinations[i]:
+                                np.copyto(destination, output_np[j, y1:y2, x1:x2])
+                        else:
+                            # copied out since the buffer is reused by the next batch
+                            results[i] = output_np[j, :h, :w].copy()
+
+        return results
+
+    # merged windows are kept within the area of the largest bucket
+    MAX_MERGED_AREA = BUCKET_SIZES[-1] * BUCKET_SIZES[-1]
+
+    def __init__(
+        self,
+        batched: str = "no",
+        precision: str = "fp32",
+        backend: str = "torch",
+        merge: str = "no",
+        workers: str = "0",
+    ) -> None:
         super().__init__()
+        self.workers = int(workers)
+        if self.workers > 0 and DeepFillV2Cleaner.IN_PAINT_MODEL_DEVICE.type != "cpu":
+            print("Inpainting workers are only used on the cpu, inpainting in this process on the gpu instead")
+            self.workers = 0
+        self.batched = batched == "yes"
+        self.max_merged_area = DeepFillV2Cleaner.MAX_MERGED_AREA if merge == "yes" else None
+        self.precision = precision
+        self.backend = backend
+        if self.backend == "onnx" and self.precision != "fp32":
+            print("The onnx backend always runs in fp32, precision is ignored")
+            self.precision = "fp32"
+        if self.precision == "bf16" and not DeepFillV2Cleaner.is_bf16_supported():
+            print("bfloat16 is not supported on this device, inpainting in fp32")
+            self.precision = "fp32"
+        if self.precision == "int8" and DeepFillV2Cleaner.IN_PAINT_MODEL_DEVICE.type != "cpu":
+            print("The int8 model only runs on the cpu, inpainting in fp32 on the gpu instead")
+            self.precision = "fp32"
 
     @staticmethod
     def get_name() -> str:
         return "Deep Fill V2"
+
+    @staticmethod
+    def get_arguments() -> list[PluginArgument]:
+        return [
+            PluginSelectArgument(
+                id="batched",
+                name="Batched",
+                description="Inpaint every bubble on a page in a few batches instead of one at a time",
+                options=[
+                    PluginSelectArgumentOption(name="No", value="no"),
+                    PluginSelectArgumentOption(name="Yes", value="yes"),
+                ],
+                default="no",
+            ),
+            PluginSelectArgument(
+                id="precision",
+                name="Precision",
+                description="Bfloat16 is faster on cpus with avx512_bf16 / amx, int8 needs the weights from scripts/quantize_deepfill.py. Both slightly change the output",
+                options=[
+                    PluginSelectArgumentOption(name="FP32", value="fp32"),
+                    PluginSelectArgumentOption(name="BF16", value="bf16"),
+                    PluginSelectArgumentOption(name="INT8", value="int8"),
+                ],
+                default="fp32",
+            ),
+            PluginSelectArgument(
+                id="backend",
+                name="Backend",
+                description="ONNX Runtime runs the graph from scripts/export_onnx.py on the cpu, which starts faster and has less overhead per crop",
+                options=[
+                    PluginSelectArgumentOption(name="PyTorch", value="torch"),
+                    PluginSelectArgumentOption(name="ONNX Runtime", value="onnx"),
+                ],
+                default="torch",
+            ),
+            PluginSelectArgument(
+                id="merge",
+                name="Merge Windows",
+                description="Inpaint overlapping windows as one so crowded pages do not run the model over the same pixels again",
+                options=[
+                    PluginSelectArgumentOption(name="No", value="no"),
+                    PluginSelectArgumentOption(name="Yes", value="yes"),
+                ],
+                default="no",
+            ),
+            PluginTextArgument(
+                id="workers",
+                name="Worker Processes",
+                description="Inpaint the windows of a page in this many processes (cpu only), 0 inpaints in this process",
+                default="0",
+            ),
+        ]
     
     def clean_section(self,frame: np.ndarray,mask: np.ndarray) -> np.ndarray:
-        return pil_to_cv2(DeepFillV2Cleaner.in_paint(cv2_to_pil(frame),cv2_to_pil(mask)))
+        # goes through the same buckets as the batched mode so only a few shapes ever reach the model
+        return DeepFillV2Cleaner.in_paint_batch(
+            [frame], [mask], precision=self.precision, backend=self.backend
+        )[0]
+
+    def clean_section_into(
+        self,
+        frame: np.ndarray,
+        mask: np.ndarray,
+        destinations: list[tuple[np.ndarray, tuple[int, int, int, int]]],
+    ):
+        """Same as clean_section but the result is written straight into destinations"""
+        DeepFillV2Cleaner.in_paint_batch(
+            [frame],
+            [mask],
+            precision=self.precision,
+            backend=self.backend,
+            destinations=[destinations],
+        )
     
     async def clean(
         self,
@@ -109,9 +382,34 @@ class DeepFillV2Cleaner(Cleaner):
         mask: ndarray,
         detection_results: list[tuple[tuple[int, int, int, int], str, float]] = [],
     ) -> tuple[ndarray, ndarray]:
+        if self.workers > 0:
+            from translator.cleaners.deepfill_workers import InPaintWorkerPool, in_paint_in_workers
+
+            return in_paint_in_workers(
+                frame,
+                mask,
+                detection_results,
+                InPaintWorkerPool.get(
+                    self.workers, DeepFillV2Cleaner.DEFAULT_MODEL_PATH, self.precision, self.backend
+                ),
+                max_merged_area=self.max_merged_area,
+            )
+
+        if self.batched:
+            return in_paint_optimized_batched(
+                frame,
+                mask=mask,
+                filtered=detection_results,
+                inpaint_batch_fun=lambda images, masks: DeepFillV2Cleaner.in_paint_batch(
+                    images, masks, precision=self.precision, backend=self.backend
+                ),
+                max_merged_area=self.max_merged_area,
+            )
+
         return in_paint_optimized(
             frame,
             mask=mask,
             filtered=detection_results,  # segmentation_results.boxes.xyxy.cpu().numpy()
-            inpaint_fun=lambda frame, mask: self.clean_section(frame,mask),
+            inpaint_into_fun=self.clean_section_into,
+            max_merged_area=self.max_merged_area,
         )
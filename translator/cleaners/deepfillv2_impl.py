@@ -1,3 +1,4 @@
+import warnings
 import numpy as np
 import torch
 import torch.nn as nn
@@ -115,13 +116,17 @@ class GConv(nn.Module):
 
         _init_conv_layer(self.conv, activation=self.activation)
 
+        # identities unless the generator is quantized, the gating itself always runs in fp32
+        self.quant = torch.ao.quantization.QuantStub()
+        self.dequant = torch.ao.quantization.DeQuantStub()
+
         self.ksize = ksize
         self.stride = stride
         self.rate = rate
         self.padding = padding
 
     def forward(self, x):
-        x = self.conv(x)
+        x = self.dequant(self.conv(self.quant(x)))
         if self.cnum_out == 3 or self.activation is None:
             return x
         x, y = torch.split(x, self.cnum_out, dim=1)
@@ -471,16 +476,28 @@ class ContextualAttention(nn.Module):
             "fuse_weight", torch.eye(fuse_k).view(1, 1, fuse_k, fuse_k)
         )
 
+    def _fuse(self, y):
+        """Same as convolving y [N, H, W] with fuse_weight, which is the identity, so it is just a sum of diagonal shifts"""
+        pad = (self.fuse_k - 1) // 2
+        padded = F.pad(y, (pad, pad, pad, pad))
+        h, w = y.shape[1:]
+        return sum([padded[:, i : i + h, i : i + w] for i in range(self.fuse_k)])
+
     def forward(self, f, b, mask=None):
         """
         Args:
             f: Input feature to match (foreground).
             b: Input feature for match (background).
             mask: Input mask for b, indicating patches not available.
+
+        The whole batch is matched and pasted with batched matrix multiplies instead of a conv per sample.
+        Each sample uses its own mask, the per sample loop this replaced used the mask of the first sample for the
+        whole batch, so results for a batch > 1 with different masks differ from it (batch 1 is unchanged)
         """
         device = f.device
         # get shapes
         raw_int_fs, raw_int_bs = list(f.size()), list(b.size())  # b*c*h*w
+        n = raw_int_fs[0]
 
         # extract patches from background with stride and rate
         kernel = 2 * self.rate
@@ -491,7 +508,6 @@ class ContextualAttention(nn.Module):
         # raw_shape: [N, C, k, k, L]
         raw_w = raw_w.view(raw_int_bs[0], raw_int_bs[1], kernel, kernel, -1)
         raw_w = raw_w.permute(0, 4, 1, 2, 3)  # raw_shape: [N, L, C, k, k]
-        raw_w_groups = torch.split(raw_w, 1, dim=0)
 
         # downscaling foreground option: downscaling both foreground and
         # background for matching and use original background for reconstruction.
@@ -508,8 +524,6 @@ class ContextualAttention(nn.Module):
             recompute_scale_factor=False,
         )
         int_fs, int_bs = list(f.size()), list(b.size())  # b*c*h*w
-        # split tensors along the batch dimension
-        f_groups = torch.split(f, 1, dim=0)
         # w shape: [N, C*k*k, L]
         w = extract_image_patches(
             b, ksize=self.ksize, stride=self.stride, rate=1, padding="auto"
@@ -517,7 +531,7 @@ class ContextualAttention(nn.Module):
         # w shape: [N, C, k, k, L]
         w = w.view(int_bs[0], int_bs[1], self.ksize, self.ksize, -1)
         w = w.permute(0, 4, 1, 2, 3)  # w shape: [N, L, C, k, k]
-        w_groups = torch.split(w, 1, dim=0)
+        num_patches = w.size(1)
 
         # process mask
         if mask is None:
@@ -537,93 +551,82 @@ class ContextualAttention(nn.Module):
         # m shape: [N, C, k, k, L]
         m = m.view(int_ms[0], int_ms[1], self.ksize, self.ksize, -1)
         m = m.permute(0, 4, 1, 2, 3)  # m shape: [N, L, C, k, k]
-        m = m[0]  # m shape: [L, C, k, k]
-        # mm shape: [L, 1, 1, 1]
 
-        mm = (torch.mean(m, dim=[1, 2, 3], keepdim=True) == 0.0).to(torch.float32)
-        mm = mm.permute(1, 0, 2, 3)  # mm shape: [1, L, 1, 1]
+        # every sample has its own mask when inpainting a batch
+        # mm shape: [N, L, 1, 1]
+        mm = (torch.mean(m, dim=[2, 3, 4]) == 0.0).to(torch.float32)
+        mm = mm.view(int_ms[0], -1, 1, 1).expand(n, -1, -1, -1)
 
-        y = []
-        offsets = []
         scale = self.softmax_scale  # to fit the PyTorch tensor image value range
 
-        for xi, wi, raw_wi in zip(f_groups, w_groups, raw_w_groups):
-            """
-            O => output channel as a conv filter
-            I => input channel as a conv filter
-            xi : separated tensor along batch dimension of front; (B=1, C=128, H=32, W=32)
-            wi : separated patch tensor along batch dimension of back; (B=1, O=32*32, I=128, KH=3, KW=3)
-            raw_wi : separated tensor along batch dimension of back; (B=1, I=32*32, O=128, KH=4, KW=4)
-            """
-            # conv for compare
-            wi = wi[0]  # [L, C, k, k]
-            max_wi = torch.sqrt(
-                torch.sum(torch.square(wi), dim=[1, 2, 3], keepdim=True)
-            ).clamp_min(1e-4)
-            wi_normed = wi / max_wi
-            # xi shape: [1, C, H, W], yi shape: [1, L, H, W]
-            yi = F.conv2d(
-                xi, wi_normed, stride=1, padding=(self.ksize - 1) // 2
-            )  # [1, L, H, W]
-            # conv implementation for fuse scores to encourage large patches
-            if self.fuse:
-                # make all of depth to spatial resolution
-                # (B=1, I=1, H=32*32, W=32*32)
-                yi = yi.view(1, 1, int_bs[2] * int_bs[3], int_fs[2] * int_fs[3])
-                # (B=1, C=1, H=32*32, W=32*32)
-                yi = F.conv2d(
-                    yi, self.fuse_weight, stride=1, padding=(self.fuse_k - 1) // 2
-                )
-                # (B=1, 32, 32, 32, 32)
-                yi = yi.contiguous().view(1, int_bs[2], int_bs[3], int_fs[2], int_fs[3])
-                yi = yi.permute(0, 2, 1, 4, 3)
-
-                yi = yi.contiguous().view(
-                    1, 1, int_bs[2] * int_bs[3], int_fs[2] * int_fs[3]
-                )
-                yi = F.conv2d(
-                    yi, self.fuse_weight, stride=1, padding=(self.fuse_k - 1) // 2
-                )
-                yi = yi.contiguous().view(1, int_bs[3], int_bs[2], int_fs[3], int_fs[2])
-                yi = yi.permute(0, 2, 1, 4, 3).contiguous()
-
-            # (B=1, C=32*32, H=32, W=32)
-            yi = yi.view(1, int_bs[2] * int_bs[3], int_fs[2], int_fs[3])
-            # softmax to match
-            yi = yi * mm
-            yi = F.softmax(yi * scale, dim=1)
-            yi = yi * mm  # [1, L, H, W]
-
-            if self.return_flow:
-                offset = torch.argmax(yi, dim=1, keepdim=True)  # 1*1*H*W
-
-                if int_bs != int_fs:
-                    # Normalize the offset value to match foreground dimension
-                    times = (int_fs[2] * int_fs[3]) / (int_bs[2] * int_bs[3])
-                    offset = ((offset + 1).float() * times - 1).to(torch.int64)
-                offset = torch.cat(
-                    [
-                        torch.div(offset, int_fs[3], rounding_mode="trunc"),
-                        offset % int_fs[3],
-                    ],
-                    dim=1,
-                )  # 1*2*H*W
-                offsets.append(offset)
-
-            # deconv for patch pasting
-            wi_center = raw_wi[0]
-            yi = (
-                F.conv_transpose2d(yi, wi_center, stride=self.rate, padding=1) / 4.0
-            )  # (B=1, C=128, H=64, W=64)
-            y.append(yi)
-
-        y = torch.cat(y, dim=0)  # back to the mini-batch
+        # conv for compare, as a matmul of the normalized patches with the unfolded foreground
+        max_w = torch.sqrt(
+            torch.sum(torch.square(w), dim=[2, 3, 4], keepdim=True)
+        ).clamp_min(1e-4)
+        w_normed = (w / max_w).reshape(n, num_patches, -1)  # [N, L, C*k*k]
+        f_cols = extract_image_patches(
+            f, ksize=self.ksize, stride=1, rate=1, padding="auto"
+        )  # [N, C*k*k, H*W]
+        y = torch.bmm(w_normed, f_cols)  # [N, L, H*W]
+        # conv implementation for fuse scores to encourage large patches
+        if self.fuse:
+            # make all of depth to spatial resolution
+            # (B=N, H=32*32, W=32*32)
+            y = self._fuse(y.view(n, int_bs[2] * int_bs[3], int_fs[2] * int_fs[3]))
+            # (B=N, 32, 32, 32, 32)
+            y = y.view(n, int_bs[2], int_bs[3], int_fs[2], int_fs[3])
+            y = y.permute(0, 2, 1, 4, 3)
+
+            y = y.contiguous().view(n, int_bs[2] * int_bs[3], int_fs[2] * int_fs[3])
+            y = self._fuse(y)
+            y = y.view(n, int_bs[3], int_bs[2], int_fs[3], int_fs[2])
+            y = y.permute(0, 2, 1, 4, 3).contiguous()
+
+        # (B=N, C=32*32, H=32, W=32)
+        y = y.view(n, int_bs[2] * int_bs[3], int_fs[2], int_fs[3])
+        # softmax to match
+        y = y * mm
+        y = F.softmax(y * scale, dim=1)
+        y = y * mm  # [N, L, H, W]
+
+        offsets = None
+        if self.return_flow:
+            offsets = torch.argmax(y, dim=1, keepdim=True)  # N*1*H*W
+
+            if int_bs != int_fs:
+                # Normalize the offset value to match foreground dimension
+                times = (int_fs[2] * int_fs[3]) / (int_bs[2] * int_bs[3])
+                offsets = ((offsets + 1).float() * times - 1).to(torch.int64)
+            offsets = torch.cat(
+                [
+                    torch.div(offsets, int_fs[3], rounding_mode="trunc"),
+                    offsets % int_fs[3],
+                ],
+                dim=1,
+            )  # N*2*H*W
+
+        # deconv for patch pasting, as a matmul with the raw patches followed by folding the columns back into an image
+        # most attention weights underflow to denormals which make the cpu matmul several times slower, they are flushed to 0
+        y = y.masked_fill(y < torch.finfo(y.dtype).tiny, 0.0)
+        y_cols = torch.bmm(
+            raw_w.reshape(n, num_patches, -1).transpose(1, 2),
+            y.view(n, num_patches, int_fs[2] * int_fs[3]),
+        )  # [N, C*k*k, H*W]
+        y = (
+            F.fold(
+                y_cols,
+                (raw_int_fs[2], raw_int_fs[3]),
+                kernel,
+                stride=self.rate,
+                padding=1,
+            )
+            / 4.0
+        )  # (B=N, C=128, H=64, W=64)
         y = y.contiguous().view(raw_int_fs)
 
         if not self.return_flow:
             return y, None
 
-        offsets = torch.cat(offsets, dim=0)
         offsets = offsets.view(int_fs[0], 2, *int_fs[2:])
 
         # case1: visualize optical flow: minus current position
@@ -893,3 +896,61 @@ def load_model(path, device=torch.device("cuda")):
 
     gen.load_state_dict(gen_sd, strict=False)
     return gen
+
+
+def get_quantized_engine() -> str:
+    engines = torch.backends.quantized.supported_engines
+    for engine in ["x86", "fbgemm", "qnnpack"]:
+        if engine in engines:
+            return engine
+    raise BaseException("No quantized engine available!")
+
+
+def prepare_quantization(gen, engine=None):
+    """Inserts observers for static int8 quantization of the gated convolutions.
+    Contextual attention, resizing and the gating activations stay in fp32
+    """
+    engine = engine if engine is not None else get_quantized_engine()
+    torch.backends.quantized.engine = engine
+    qconfig = torch.ao.quantization.get_default_qconfig(engine)
+
+    gen.eval()
+    for module in gen.modules():
+        if isinstance(module, GConv):
+            module.qconfig = qconfig
+            if module.activation is not None:
+                module.activation.qconfig = None
+
+    return torch.ao.quantization.prepare(gen, inplace=True)
+
+
+def convert_quantization(gen):
+    """Replaces the calibrated convolutions of a prepared generator with int8 ones"""
+    return torch.ao.quantization.convert(gen, inplace=True)
+
+
+def load_quantized_model(path):
+    """Loads weights written by scripts/quantize_deepfill.py, quantized models only run on the cpu"""
+    try:
+        checkpoint = torch.load(path, map_location="cpu")
+    except FileNotFoundError:
+        raise BaseException(
+            "Quantized model weights not found! Create them with scripts/quantize_deepfill.py"
+        )
+
+    gen = Generator(cnum_in=5, cnum=48, return_flow=False)
+    with warnings.catch_warnings():
+        # the observers are never run here, the real scales come from the state dict
+        warnings.simplefilter("ignore")
+        prepare_quantization(gen, checkpoint.get("engine", None))
+        convert_quantization(gen)
+
+    try:
+        # strict so a checkpoint from another layout (or a stale file) fails here instead of running with default weights
+        gen.load_state_dict(checkpoint["G"], strict=True)
+    except (KeyError, RuntimeError) as e:
+        raise BaseException(
+            f"Quantized model weights at {path} do not match the generator, create them again with scripts/quantize_deepfill.py ({e})"
+        )
+
+    return gen
@@ -1,7 +1,8 @@
 from translator.core.plugin import Cleaner
 from translator.cleaners.deepfillv2 import DeepFillV2Cleaner
 from translator.cleaners.lama import LamaCleaner
+from translator.cleaners.hybrid import HybridCleaner
 
 
 def get_cleaners() -> list[Cleaner]:
-    return [DeepFillV2Cleaner, LamaCleaner]
+    return [DeepFillV2Cleaner, LamaCleaner, HybridCleaner]
@@ -0,0 +1,127 @@
+import traceback
+import cv2
+import numpy as np
+from numpy import ndarray
+from translator.core.plugin import (
+    Cleaner,
+    PluginArgument,
+    PluginTextArgument,
+    PluginSelectArgument,
+    PluginSelectArgumentOption,
+)
+from translator.utils import InPaintJob, ensure_gray, plan_in_paint
+
+
+class HybridCleaner(Cleaner):
+    """Fills text on flat backgrounds with the background colour and only sends textured regions to a neural cleaner"""
+
+    def __init__(self, cleaner: str = "deepfill", threshold: str = "12", ring: str = "5") -> None:
+        super().__init__()
+        self.cleaner = cleaner
+        self.threshold = float(threshold)
+        self.ring = int(ring)
+
+        if self.cleaner == "lama":
+            from translator.cleaners.lama import LamaCleaner
+
+            self.neural = LamaCleaner()
+        else:
+            from translator.cleaners.deepfillv2 import DeepFillV2Cleaner
+
+            self.neural = DeepFillV2Cleaner()
+
+        self.stats = {"flat": 0, "neural": 0}
+
+    @staticmethod
+    def get_name() -> str:
+        return "Hybrid Cleaner"
+
+    @staticmethod
+    def get_arguments() -> list[PluginArgument]:
+        return [
+            PluginSelectArgument(
+                id="cleaner",
+                name="Cleaner",
+                description="Cleaner used for regions that are not flat",
+                options=[
+                    PluginSelectArgumentOption(name="Deep Fill V2", value="deepfill"),
+                    PluginSelectArgumentOption(name="Lama", value="lama"),
+                ],
+                default="deepfill",
+            ),
+            PluginTextArgument(
+                id="threshold",
+                name="Flat Threshold",
+                description="Highest standard deviation of the pixels around the text for it to be filled with a flat colour",
+                default="12",
+            ),
+            PluginTextArgument(
+                id="ring",
+                name="Ring Width",
+                description="Width in pixels of the ring around the text the background is estimated from",
+                default="5",
+            ),
+        ]
+
+    # a ring with fewer pixels than this (or this fraction of the text) is too small to tell a flat background
+    MIN_RING_PIXELS = 64
+
+    MIN_RING_FRACTION = 0.1
+
+    @staticmethod
+    def get_text(job: InPaintJob) -> ndarray:
+        """Boolean mask of the (dilated) text in the target of job"""
+        tx1, ty1, tx2, ty2 = job.target
+        return ensure_gray(job.mask[ty1:ty2, tx1:tx2]) > 127
+
+    def get_ring(self, section: ndarray, text: ndarray) -> ndarray:
+        """Pixels of section in a ring around text, both the whole window of the job. Only the target is filled but
+        the ring is not limited to it, text that fills most of the target would leave just a few pixels to judge by"""
+        kernel = np.ones((self.ring * 2 + 1, self.ring * 2 + 1), np.uint8)
+        ring = cv2.dilate(text.astype(np.uint8), kernel, iterations=1).astype(bool) & ~text
+        return section[ring]
+
+    def try_fill_flat(self, frame: ndarray, final: ndarray, job: InPaintJob) -> bool:
+        """Fills the text of job in final if the ring around it in frame is flat, returns whether it did"""
+        window_text = ensure_gray(job.mask) > 127
+        ring = self.get_ring(job.get_section(frame), window_text)
+        min_ring = max(HybridCleaner.MIN_RING_PIXELS, HybridCleaner.MIN_RING_FRACTION * window_text.sum())
+        if len(ring) < min_ring or ring.std(axis=0).max() > self.threshold:
+            return False
+
+        job.get_target(final)[HybridCleaner.get_text(job)] = np.median(ring, axis=0).astype(np.uint8)
+        return True
+
+    async def clean(
+        self,
+        frame: ndarray,
+        mask: ndarray,
+        detection_results: list[tuple[tuple[int, int, int, int], str, float]] = [],
+    ) -> tuple[ndarray, ndarray]:
+        final = frame.copy()
+        text_mask = np.zeros_like(mask)
+
+        flat, textured = 0, []
+        for detection in detection_results:
+            try:
+                job = plan_in_paint(frame, mask, text_mask, detection[0])
+                if job is None:
+                    continue
+
+                if self.try_fill_flat(frame, final, job):
+                    flat += 1
+                else:
+                    textured.append(detection)
+            except:
+                traceback.print_exc()
+                textured.append(detection)
+
+        self.stats["flat"] += flat
+        self.stats["neural"] += len(textured)
+        print(f"Hybrid Cleaner: {flat} regions filled flat, {len(textured)} inpainted with {self.neural.get_name()}")
+
+        if len(textured) == 0:
+            return final, text_mask
+
+        final, neural_text_mask = await self.neural(final, mask, textured)
+        return final, np.maximum(text_mask, neural_text_mask)
@@ -1,17 +1,24 @@
 import numpy as np
 from numpy import ndarray
 import asyncio
-from translator.core.plugin import Cleaner, PluginArgument, PluginTextArgument
+from translator.core.plugin import (
+    Cleaner,
+    PluginArgument,
+    PluginTextArgument,
+    PluginSelectArgument,
+    PluginSelectArgumentOption,
+)
+from translator.core.registry import MODELS
 from translator.utils import in_paint_optimized, cv2_to_pil, pil_to_cv2
 
 
 class LamaCleaner(Cleaner):
-    def __init__(self, dilation="9") -> None:
-        super().__init__()
-        from simple_lama_inpainting import SimpleLama
+    MAX_MERGED_AREA = 512 * 512
 
-        self.lama = SimpleLama()
+    def __init__(self, dilation="9", merge="no") -> None:
+        super().__init__()
         self.dilation = int(dilation)
+        self.max_merged_area = LamaCleaner.MAX_MERGED_AREA if merge == "yes" else None
 
     @staticmethod
     def get_name() -> str:
@@ -19,12 +26,31 @@ class LamaCleaner(Cleaner):
 
     @staticmethod
     def get_arguments() -> list[PluginArgument]:
-        return [PluginTextArgument(id="dilation", name="Mask Dilation",description="The dilation used for the text mask", default="9")]
+        return [
+            PluginTextArgument(id="dilation", name="Mask Dilation",description="The dilation used for the text mask", default="9"),
+            PluginSelectArgument(
+                id="merge",
+                name="Merge Windows",
+                description="Inpaint overlapping windows as one so crowded pages do not run the model over the same pixels again",
+                options=[
+                    PluginSelectArgumentOption(name="No", value="no"),
+                    PluginSelectArgumentOption(name="Yes", value="yes"),
+                ],
+                default="no",
+            ),
+        ]
     
+    @staticmethod
+    def use_lama():
+        from simple_lama_inpainting import SimpleLama
+
+        return MODELS.use("lama", lambda: SimpleLama())
+
     def clean_with_lama(self,frame,mask):
-        return pil_to_cv2(
-                self.lama(cv2_to_pil(frame), cv2_to_pil(mask).convert("L"))
-            )
+        with LamaCleaner.use_lama() as lama:
+            return pil_to_cv2(
+                    lama(cv2_to_pil(frame), cv2_to_pil(mask).convert("L"))
+                )
     
     async def clean(
         self,
@@ -38,4 +64,5 @@ class LamaCleaner(Cleaner):
             filtered=detection_results,
             mask_dilation_kernel_size=self.dilation,
             inpaint_fun=lambda f, m: self.clean_with_lama(f,m),
+            max_merged_area=self.max_merged_area,
         )
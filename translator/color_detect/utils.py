@@ -6,6 +6,7 @@ import numpy as np
 from torchvision import transforms
 
 from translator.utils import display_image, draw_text_in_bubble
+from translator.color_stats import get_color_stats
 from .constants import IMAGE_SIZE
 
 
@@ -75,7 +76,7 @@ def rand_color(generator=random.Random()):
 
 
 def get_average_color(surface: np.ndarray):
-    return np.array([round(x) for x in cv2.mean(surface)][0:3])
+    return np.array([round(x) for x in get_color_stats(surface).mean])
 
 
 def get_luminance(color: np.ndarray):
@@ -94,13 +95,13 @@ def luminance_similarity(a: np.ndarray, b: np.ndarray):
 def get_outline_color(
     surface: np.ndarray, text_color: np.ndarray, min_outline_lum=0.35
 ):
-    surface_color = get_average_color(surface)
+    surface_stats = get_color_stats(surface)
 
     color_white, color_black = np.array((255, 255, 255), dtype=np.uint8), np.array(
         (0, 0, 0), dtype=np.uint8
     )
 
-    lum_similarity = luminance_similarity(text_color, surface_color)
+    lum_similarity = 1 - abs(get_luminance(text_color) - surface_stats.luminance)
 
     # debug_image(surface,"Surface")
     if (
@@ -0,0 +1,82 @@
+from typing import Union
+import numpy as np
+
+
+class ColorStats:
+    """Colour statistics of a BGR region, all colours are BGR float arrays"""
+
+    def __init__(
+        self,
+        dominant: np.ndarray,
+        mean: np.ndarray,
+        median: np.ndarray,
+        luminance: float,
+        count: int,
+    ) -> None:
+        self.dominant = dominant  # average colour of the most common quantised bin
+        self.mean = mean
+        self.median = median  # per channel
+        self.luminance = luminance  # relative luminance of mean, 1 is bright, 0 is dark
+        self.count = count  # number of pixels the stats are over
+
+    def is_bright(self, threshold: float = 0.5) -> bool:
+        """Whether the dominant colour is closer to white than black"""
+        return self.dominant.mean() / 255 > threshold
+
+
+def get_luminance(color: np.ndarray) -> float:
+    """Relative luminance of a BGR colour. 1 is bright, 0 is dark"""
+    b, g, r = np.asarray(color, dtype=np.float64) / 255
+
+    return (0.2126 * r) + (0.7152 * g) + (0.0722 * b)  # https://en.wikipedia.org/wiki/Luminance_%28relative%29
+
+
+def get_channel_medians(channel_counts: np.ndarray, count: int) -> np.ndarray:
+    """Median of each channel from its 256 bin histogram (the lower of the two middle values for even counts)"""
+    cumulative = np.cumsum(channel_counts, axis=1)
+    return np.array([np.searchsorted(x, (count + 1) // 2) for x in cumulative], dtype=np.float64)
+
+
+def get_color_stats(image: np.ndarray, mask: Union[np.ndarray, None] = None, bits: int = 5) -> ColorStats:
+    """Dominant, mean and median colour and luminance of the pixels of image (optionally only where mask > 127).
+
+    Every pixel is packed into a single uint32 (b << 16 | g << 8 | r) once, the dominant colour comes from a bincount
+    over the top bits of each channel (2 ** (3 * bits) bins, 32768 by default) instead of a 256x256x256 histogram,
+    and the means / medians from bincounts of 256 bins per channel. That is ~0.3 MB of bins and a few temporaries of
+    the size of the region, where the float32 histogram alone is 64 MB.
+    """
+    pixels = image.reshape(-1, 3)
+    if mask is not None:
+        selected = (mask if mask.ndim == 2 else mask[:, :, 0]).reshape(-1) > 127
+        pixels = pixels[selected]
+
+    count = len(pixels)
+    if count == 0:
+        empty = np.zeros(3, dtype=np.float64)
+        return ColorStats(empty, empty, empty, 0.0, 0)
+
+    channel_counts = np.stack([np.bincount(pixels[:, c], minlength=256) for c in range(3)])
+
+    packed = pixels.astype(np.uint32)
+    packed = (packed[:, 0] << 16) | (packed[:, 1] << 8) | packed[:, 2]
+
+    # top bits of b, g and r next to each other, shifted straight out of the packed pixels
+    shift, top = 8 - bits, (1 << bits) - 1
+    quantised = (
+        (((packed >> (16 + shift)) & top) << (2 * bits))
+        | (((packed >> (8 + shift)) & top) << bits)
+        | ((packed >> shift) & top)
+    )
+    del packed
+    bin_counts = np.bincount(quantised, minlength=1 << (3 * bits))
+    dominant = pixels[quantised == bin_counts.argmax()].mean(axis=0)
+
+    mean = (channel_counts * np.arange(256)).sum(axis=1) / count
+
+    return ColorStats(
+        dominant,
+        mean,
+        get_channel_medians(channel_counts, count),
+        get_luminance(mean),
+        count,
+    )
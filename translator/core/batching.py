@@ -0,0 +1,117 @@
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable
+import numpy as np
+from translator.core.plugin import Ocr, OcrResult, Translator, TranslatorResult
+
+
+class MicroBatcher:
+    """Collects items submitted by different pages / requests and dispatches them as one batch once
+    max_batch_size items are waiting or max_wait seconds have passed since the first one arrived.
+
+    Dispatches run on a dedicated event loop thread so callers on different loops (i.e. server requests
+    run with run_in_thread_decorator) can still share a batch.
+    """
+
+    def __init__(
+        self,
+        dispatch: Callable[[list[Any]], Awaitable[list[Any]]],
+        max_batch_size: int = 32,
+        max_wait: float = 0.02,
+    ) -> None:
+        self.dispatch = dispatch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait
+        self.batches = 0
+        self.items = 0
+        self._loop = None
+        self._loop_lock = threading.Lock()
+        self._pending: list[tuple[Any, asyncio.Future]] = []
+        self._timer = None
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, daemon=True).start()
+            return self._loop
+
+    async def __call__(self, items: list[Any]) -> list[Any]:
+        if len(items) == 0:
+            return []
+
+        return await asyncio.wrap_future(
+            asyncio.run_coroutine_threadsafe(self._submit(list(items)), self._get_loop())
+        )
+
+    async def _submit(self, items: list[Any]) -> list[Any]:
+        loop = asyncio.get_running_loop()
+        futures = [loop.create_future() for _ in items]
+        self._pending.extend(zip(items, futures))
+
+        while len(self._pending) >= self.max_batch_size:
+            self._dispatch_pending()
+
+        if len(self._pending) > 0 and self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+
+        return list(await asyncio.gather(*futures))
+
+    def _dispatch_pending(self):
+        batch = self._pending[: self.max_batch_size]
+        self._pending = self._pending[self.max_batch_size :]
+        asyncio.ensure_future(self._dispatch(batch))
+
+    def _flush(self):
+        self._timer = None
+        while len(self._pending) > 0:
+            self._dispatch_pending()
+
+    async def _dispatch(self, batch: list[tuple[Any, asyncio.Future]]):
+        items, futures = zip(*batch)
+        self.batches += 1
+        self.items += len(items)
+        try:
+            results = await self.dispatch(list(items))
+            for future, result in zip(futures, results):
+                if not future.done():
+                    future.set_result(result)
+        except BaseException as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+
+    def average_batch_size(self) -> float:
+        return self.items / self.batches if self.batches > 0 else 0.0
+
+
+class BatchedOcr(Ocr):
+    """Shares ocr batches across pages and requests"""
+
+    def __init__(self, ocr: Ocr, max_batch_size: int = 32, max_wait: float = 0.02) -> None:
+        super().__init__()
+        self.ocr = ocr
+        self.batcher = MicroBatcher(ocr, max_batch_size, max_wait)
+
+    async def do_ocr(self, batch: list[np.ndarray]) -> list[OcrResult]:
+        return await self.batcher(batch)
+
+    def get_cache_key(self) -> str:
+        return self.ocr.get_cache_key()
+
+
+class BatchedTranslator(Translator):
+    """Shares translation batches across pages and requests"""
+
+    def __init__(
+        self, translator: Translator, max_batch_size: int = 32, max_wait: float = 0.02
+    ) -> None:
+        super().__init__()
+        self.translator = translator
+        self.batcher = MicroBatcher(translator, max_batch_size, max_wait)
+
+    async def translate(self, batch: list[OcrResult]) -> list[TranslatorResult]:
+        return await self.batcher(batch)
+
+    def get_cache_key(self) -> str:
+        return self.translator.get_cache_key()
@@ -0,0 +1,218 @@
+import copy
+import hashlib
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Union
+import numpy as np
+
+
+def hash_image(image: np.ndarray) -> str:
+    """Hashes the decoded pixels so re-encoded copies of the same page share a key"""
+    hasher = hashlib.blake2b(digest_size=20)
+    hasher.update(f"{image.shape}|{image.dtype}".encode())
+    hasher.update(np.ascontiguousarray(image).data)
+    return hasher.hexdigest()
+
+
+def make_cache_key(*parts: Any) -> str:
+    """Combines hashes / json serializable configuration into a single key"""
+    return hashlib.blake2b(
+        json.dumps(parts, sort_keys=True, default=str).encode(), digest_size=20
+    ).hexdigest()
+
+
+class LruCache:
+    """In memory LRU cache for bytes, bounded by the total size of its values"""
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024) -> None:
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items: OrderedDict[str, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Union[bytes, None]:
+        with self._lock:
+            value = self._items.get(key, None)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+
+        with self._lock:
+            existing = self._items.pop(key, None)
+            if existing is not None:
+                self.size -= len(existing)
+
+            self._items[key] = value
+            self.size += len(value)
+
+            while self.size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= len(evicted)
+
+
+class DiskCache:
+    """On disk cache for bytes, evicts the least recently used files once max_bytes is exceeded"""
+
+    def __init__(self, path: str, max_bytes: int = 2 * 1024 * 1024 * 1024) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self.size = sum([os.path.getsize(x) for x in self._files()])
+
+    def _files(self) -> list[str]:
+        files = []
+        for root, _, names in os.walk(self.path):
+            files.extend([os.path.join(root, x) for x in names if not x.endswith(".tmp")])
+        return files
+
+    def _path_for(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], key)
+
+    def get(self, key: str) -> Union[bytes, None]:
+        file_path = self._path_for(key)
+        try:
+            with open(file_path, "rb") as f:
+                data = f.read()
+            os.utime(file_path)  # mark as recently used
+            return data
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+
+        file_path = self._path_for(key)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+        with self._lock:
+            if os.path.exists(file_path):
+                self.size -= os.path.getsize(file_path)
+
+            temp_path = f"{file_path}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(value)
+            os.replace(temp_path, file_path)
+            self.size += len(value)
+
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        files = sorted(
+            [(os.path.getmtime(x), os.path.getsize(x), x) for x in self._files()]
+        )
+        for _, size, file_path in files:
+            if self.size <= self.max_bytes:
+                break
+            try:
+                os.remove(file_path)
+                self.size -= size
+            except FileNotFoundError:
+                pass
+
+
+class PageCache:
+    """Two tier (memory then disk) cache of converted pages"""
+
+    def __init__(
+        self,
+        memory_bytes: int = 256 * 1024 * 1024,
+        disk_path: Union[str, None] = None,
+        disk_bytes: int = 2 * 1024 * 1024 * 1024,
+    ) -> None:
+        self.memory = LruCache(memory_bytes)
+        self.disk = DiskCache(disk_path, disk_bytes) if disk_path is not None else None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(image: np.ndarray, config: Any) -> str:
+        return make_cache_key(hash_image(image), config)
+
+    def get(self, key: str) -> Union[bytes, None]:
+        value = self.memory.get(key)
+
+        if value is None and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.put(key, value)
+
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        return value
+
+    def put(self, key: str, value: bytes):
+        self.memory.put(key, value)
+        if self.disk is not None:
+            self.disk.put(key, value)
+
+
+def estimate_size(value: Any) -> int:
+    """Rough size in bytes of a stage output, dominated by the numpy arrays it holds"""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (list, tuple)):
+        return sum([estimate_size(x) for x in value]) + sys.getsizeof(value)
+    if isinstance(value, dict):
+        return sum([estimate_size(x) for x in value.values()]) + sys.getsizeof(value)
+    if hasattr(value, "__dict__"):
+        return estimate_size(vars(value))
+    return sys.getsizeof(value)
+
+
+class StageCache:
+    """In memory LRU cache of intermediate stage outputs (detections, cleaned frames, ocr results, ...).
+
+    Values are copied on the way in and out since the pipeline modifies frames in place.
+    """
+
+    def __init__(self, max_bytes: int = 512 * 1024 * 1024) -> None:
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits: dict[str, int] = {}
+        self.misses: dict[str, int] = {}
+        self._items: OrderedDict[str, tuple[Any, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, stage: str, key: str) -> Any:
+        with self._lock:
+            entry = self._items.get(key, None)
+            if entry is None:
+                self.misses[stage] = self.misses.get(stage, 0) + 1
+                return None
+
+            self._items.move_to_end(key)
+            self.hits[stage] = self.hits.get(stage, 0) + 1
+
+        return copy.deepcopy(entry[0])
+
+    def put(self, stage: str, key: str, value: Any):
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return
+
+        value = copy.deepcopy(value)
+
+        with self._lock:
+            existing = self._items.pop(key, None)
+            if existing is not None:
+                self.size -= existing[1]
+
+            self._items[key] = (value, size)
+            self.size += size
+
+            while self.size > self.max_bytes:
+                _, (_, evicted_size) = self._items.popitem(last=False)
+                self.size -= evicted_size
@@ -2,3 +2,13 @@ class FilteredYoloInferenceIndices:
     BBOX = 0
     CLASS_NAME = 1
     CONFIDENCE = 2
+
+
+class PipelineStages:
+    DETECTION = "detection"
+    CLEANING = "cleaning"
+    MASKING = "masking"
+    COLOR_DETECTION = "color_detection"
+    OCR = "ocr"
+    TRANSLATION = "translation"
+    DRAWING = "drawing"
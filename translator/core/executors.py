@@ -0,0 +1,70 @@
+import asyncio
+import inspect
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Union
+from translator.core.constants import PipelineStages
+
+
+def _run_stage_func(func: Callable, args: tuple, kwargs: dict):
+    result = func(*args, **kwargs)
+
+    if inspect.isawaitable(result):
+        result = asyncio.run(result)
+
+    return result
+
+
+class StageExecutor:
+    """Runs the work of one stage on its own thread or process pool, max_workers is the stage's concurrency limit.
+
+    Process pools need func and its arguments to be picklable, bound methods of plugins that hold models
+    will be copied into (and loaded by) every worker.
+    """
+
+    NONE = "none"
+    THREAD = "thread"
+    PROCESS = "process"
+
+    def __init__(self, kind: str = THREAD, max_workers: Union[int, None] = None) -> None:
+        self.kind = kind
+        self.max_workers = max_workers if max_workers is not None else os.cpu_count()
+
+        if kind == StageExecutor.THREAD:
+            self.pool: Executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        elif kind == StageExecutor.PROCESS:
+            self.pool = ProcessPoolExecutor(max_workers=self.max_workers)
+        else:
+            raise BaseException(f"Unknown executor kind {kind}")
+
+    async def __call__(self, func: Callable, *args, **kwargs) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(
+            self.pool, _run_stage_func, func, args, kwargs
+        )
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
+
+
+def create_stage_executors(
+    kind: str = StageExecutor.THREAD,
+    max_workers: Union[int, None] = None,
+    limits: dict[str, int] = {},
+) -> dict[str, StageExecutor]:
+    """Creates an executor for each cpu heavy stage, limits overrides max_workers for specific stages.
+    With kind StageExecutor.NONE there are none and every stage runs inline on the event loop"""
+    executors = {}
+    if kind == StageExecutor.NONE:
+        return executors
+
+    for stage in [
+        PipelineStages.CLEANING,
+        PipelineStages.MASKING,
+        PipelineStages.COLOR_DETECTION,
+        PipelineStages.DRAWING,
+    ]:
+        # the color model lives on the pipeline so it can only be shared with threads
+        stage_kind = StageExecutor.THREAD if stage == PipelineStages.COLOR_DETECTION else kind
+        executors[stage] = StageExecutor(stage_kind, limits.get(stage, max_workers))
+
+    return executors
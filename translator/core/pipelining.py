@@ -0,0 +1,172 @@
+import asyncio
+import time
+import traceback
+from typing import Any, Awaitable, Callable, Iterable
+
+
+class StageStats:
+    """Running totals for one stage of a StagedPipeline"""
+
+    def __init__(self, name: str, workers: int = 1) -> None:
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.errors = 0
+        self.busy = 0.0  # seconds spent doing work
+        self.starved = 0.0  # seconds spent waiting on the upstream queue
+        self.blocked = 0.0  # seconds spent waiting on a full downstream queue
+
+    def utilisation(self, wall_time: float) -> float:
+        return self.busy / (wall_time * self.workers) if wall_time > 0 else 0.0
+
+    def get(self, wall_time: float) -> dict[str, float]:
+        return {
+            "name": self.name,
+            "workers": self.workers,
+            "items": self.items,
+            "errors": self.errors,
+            "busy": self.busy,
+            "starved": self.starved,
+            "blocked": self.blocked,
+            "utilisation": self.utilisation(wall_time),
+        }
+
+
+class PipelineReport:
+    def __init__(self, stages: list[StageStats], wall_time: float) -> None:
+        self.stages = stages
+        self.wall_time = wall_time
+
+    def bottleneck(self) -> StageStats:
+        return max(self.stages, key=lambda a: a.utilisation(self.wall_time))
+
+    def get(self) -> dict:
+        return {
+            "wall_time": self.wall_time,
+            "bottleneck": self.bottleneck().name if len(self.stages) > 0 else None,
+            "stages": [x.get(self.wall_time) for x in self.stages],
+        }
+
+    def __str__(self) -> str:
+        lines = [f"Pipeline => {self.wall_time:.3f} seconds"]
+        for stage in self.stages:
+            lines.append(
+                f"  {stage.name:<12} {stage.utilisation(self.wall_time) * 100:5.1f}% busy | {stage.items} items | {stage.busy:.3f}s busy | {stage.starved:.3f}s starved | {stage.blocked:.3f}s blocked"
+            )
+        if len(self.stages) > 0:
+            lines.append(f"  Bottleneck => {self.bottleneck().name}")
+        return "\n".join(lines)
+
+
+class PipelineFailure:
+    """Passed down the pipeline in place of an item whose stage raised"""
+
+    def __init__(self, item: Any, stage: str) -> None:
+        self.item = item
+        self.stage = stage
+
+
+class PipelineStage:
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[Any], Awaitable[Any]],
+        workers: int = 1,
+    ) -> None:
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+
+
+_STAGE_DONE = object()
+
+
+class StagedPipeline:
+    """Runs items through a chain of async stages connected by bounded queues so that
+    different items can occupy different stages at the same time"""
+
+    def __init__(self, stages: list[PipelineStage], queue_size: int = 2) -> None:
+        self.stages = stages
+        self.queue_size = max(1, queue_size)
+
+    async def _run_worker(
+        self,
+        stage: PipelineStage,
+        stats: StageStats,
+        input_queue: asyncio.Queue,
+        output_queue: asyncio.Queue,
+    ):
+        while True:
+            start = time.time()
+            entry = await input_queue.get()
+            stats.starved += time.time() - start
+
+            if entry is _STAGE_DONE:
+                # let the other workers of this stage see the sentinel too
+                await input_queue.put(_STAGE_DONE)
+                return
+
+            index, item = entry
+
+            if not isinstance(item, PipelineFailure):
+                start = time.time()
+                try:
+                    item = await stage.func(item)
+                    stats.items += 1
+                except:
+                    traceback.print_exc()
+                    stats.errors += 1
+                    item = PipelineFailure(item, stage.name)
+                stats.busy += time.time() - start
+
+            start = time.time()
+            await output_queue.put((index, item))
+            stats.blocked += time.time() - start
+
+    async def _run_stage(
+        self,
+        stage: PipelineStage,
+        stats: StageStats,
+        input_queue: asyncio.Queue,
+        output_queue: asyncio.Queue,
+    ):
+        await asyncio.gather(
+            *[
+                self._run_worker(stage, stats, input_queue, output_queue)
+                for _ in range(stage.workers)
+            ]
+        )
+        await output_queue.put(_STAGE_DONE)
+
+    async def __call__(self, items: Iterable[Any]) -> tuple[list[Any], PipelineReport]:
+        start = time.time()
+        stats = [StageStats(x.name, x.workers) for x in self.stages]
+        queues = [asyncio.Queue(self.queue_size) for _ in range(len(self.stages) + 1)]
+
+        tasks = [
+            asyncio.ensure_future(
+                self._run_stage(stage, stage_stats, queues[i], queues[i + 1])
+            )
+            for i, (stage, stage_stats) in enumerate(zip(self.stages, stats))
+        ]
+
+        async def feed():
+            for index, item in enumerate(items):
+                await queues[0].put((index, item))
+            await queues[0].put(_STAGE_DONE)
+
+        feed_task = asyncio.ensure_future(feed())
+
+        results = {}
+        while True:
+            entry = await queues[-1].get()
+            if entry is _STAGE_DONE:
+                break
+            index, item = entry
+            results[index] = item
+
+        await asyncio.gather(feed_task, *tasks)
+
+        return [results[x] for x in sorted(results.keys())], PipelineReport(
+            stats, time.time() - start
+        )
@@ -1,3 +1,4 @@
+import json
 import numpy as np
 from translator.utils import run_in_thread_decorator
 
@@ -77,6 +78,15 @@ class BasePlugin:
     def is_valid() -> bool:
         return True
 
+    def get_cache_key(self) -> str:
+        """Identifies this plugin and its configuration, used to key cached stage outputs"""
+        config = {
+            key: value
+            for key, value in vars(self).items()
+            if value is None or isinstance(value, (str, int, float, bool))
+        }
+        return f"{self.__class__.__name__}:{json.dumps(config, sort_keys=True)}"
+
 
 class OcrResult:
     def __init__(self, text: str = "", language: str = "en") -> None:
@@ -102,9 +112,11 @@ class Ocr(BasePlugin):
 
 
 class TranslatorResult:
-    def __init__(self, text: str = "", lang_code: str = "en") -> None:
+    def __init__(self, text: str = "", lang_code: str = "en", failed: bool = False) -> None:
         self.lang_code = lang_code
         self.text = text
+        # set when text is only an error message (i.e. the api could not be reached), so the page is not cached
+        self.failed = failed
 
 
 class Translator(BasePlugin):
@@ -0,0 +1,134 @@
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Union
+import torch
+
+
+def estimate_model_size(model: Any) -> int:
+    """Bytes taken by the parameters and buffers of model, or of the torch modules it holds (yolo, hugging face pipelines, ...)"""
+    if isinstance(model, torch.nn.Module):
+        return sum(
+            [x.numel() * x.element_size() for x in list(model.parameters()) + list(model.buffers())]
+        )
+
+    if hasattr(model, "__dict__"):
+        return sum(
+            [estimate_model_size(x) for x in vars(model).values() if isinstance(x, torch.nn.Module)]
+        )
+
+    return 0
+
+
+class ModelRegistry:
+    """Process wide store of loaded models shared by every pipeline, plugin and request.
+
+    Models are loaded on first use and the least recently used ones are dropped once the estimated size of all
+    loaded models exceeds max_bytes. Users should ask for the model every time they need it rather than keep it,
+    otherwise an evicted model stays in memory.
+
+    Torch modules in eval mode can run on several threads at once and are fetched with get. Models that keep state
+    between calls (yolo predictors, hugging face pipelines, easyocr readers, ...) are fetched with use, which only
+    lets one thread run each of them at a time.
+    """
+
+    def __init__(self, max_bytes: Union[int, None] = None) -> None:
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.loads = 0
+        self.evictions = 0
+        self._items: OrderedDict[str, tuple[Any, int]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks: dict[str, threading.Lock] = {}
+        self._use_locks: dict[str, threading.Lock] = {}
+
+    def get(self, key: str, loader: Callable[[], Any], size: Union[int, None] = None) -> Any:
+        """The model stored under key, loaded with loader if it is not. size overrides estimate_model_size
+        for models it can not see into (quantized, onnx, ...)"""
+        with self._lock:
+            entry = self._items.get(key, None)
+            if entry is not None:
+                self._items.move_to_end(key)
+                return entry[0]
+
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # loaded outside the registry lock so slow loads of different models do not block each other
+        with key_lock:
+            with self._lock:
+                entry = self._items.get(key, None)
+                if entry is not None:
+                    self._items.move_to_end(key)
+                    return entry[0]
+
+            model = loader()
+            model_size = size if size is not None else estimate_model_size(model)
+
+            with self._lock:
+                self._items[key] = (model, model_size)
+                self.size += model_size
+                self.loads += 1
+                self._evict(keep=key)
+
+            return model
+
+    @contextmanager
+    def use(self, key: str, loader: Callable[[], Any], size: Union[int, None] = None):
+        """Same as get, but the model is used inside a with block that holds the lock of key"""
+        model = self.get(key, loader, size)
+        with self._lock:
+            use_lock = self._use_locks.setdefault(key, threading.Lock())
+
+        with use_lock:
+            yield model
+
+    def _evict(self, keep: str):
+        if self.max_bytes is None:
+            return
+
+        for key in list(self._items.keys()):
+            if self.size <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            _, size = self._items.pop(key)
+            self.size -= size
+            self.evictions += 1
+            print(f"Model registry: evicted {key} ({size / (1024 * 1024):.1f} MB)")
+
+    def remove(self, key: str):
+        with self._lock:
+            entry = self._items.pop(key, None)
+            if entry is not None:
+                self.size -= entry[1]
+
+    def render(self, prefix: str = "manga_translator") -> str:
+        """Loaded models and their sizes in the prometheus text format"""
+        lines = [
+            f"# HELP {prefix}_model_bytes Estimated memory of each loaded model",
+            f"# TYPE {prefix}_model_bytes gauge",
+        ]
+        for key, size in self.get_sizes().items():
+            lines.append(f'{prefix}_model_bytes{{model="{key}"}} {size}')
+
+        lines.append(f"# HELP {prefix}_model_loads_total Models loaded into the registry")
+        lines.append(f"# TYPE {prefix}_model_loads_total counter")
+        lines.append(f"{prefix}_model_loads_total {self.loads}")
+        lines.append(f"# HELP {prefix}_model_evictions_total Models evicted to stay within the memory budget")
+        lines.append(f"# TYPE {prefix}_model_evictions_total counter")
+        lines.append(f"{prefix}_model_evictions_total {self.evictions}")
+
+        return "\n".join(lines) + "\n"
+
+    def get_sizes(self) -> dict[str, int]:
+        """Estimated bytes of every loaded model, least recently used first"""
+        with self._lock:
+            return {key: size for key, (_, size) in self._items.items()}
+
+
+MODELS = ModelRegistry(
+    int(os.environ["MODEL_MEMORY_BUDGET_MB"]) * 1024 * 1024
+    if "MODEL_MEMORY_BUDGET_MB" in os.environ
+    else None
+)
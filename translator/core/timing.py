@@ -0,0 +1,196 @@
+import threading
+import time
+from typing import Union
+
+
+class TimingSpan:
+    def __init__(
+        self,
+        stage: str,
+        page_id: int,
+        start: float,
+        duration: float,
+        bubbles: int = 0,
+        pixels: int = 0,
+    ) -> None:
+        self.stage = stage
+        self.page_id = page_id
+        self.start = start
+        self.duration = duration
+        self.bubbles = bubbles
+        self.pixels = pixels
+
+    def get(self) -> dict:
+        return {
+            "stage": self.stage,
+            "page_id": self.page_id,
+            "start": self.start,
+            "duration": self.duration,
+            "bubbles": self.bubbles,
+            "pixels": self.pixels,
+        }
+
+
+class TimingReport:
+    """Every span recorded during a single FullConversion call"""
+
+    def __init__(self) -> None:
+        self.start = time.time()
+        self.end = None
+        self.spans: list[TimingSpan] = []
+        # pages that were returned without being fully converted
+        self.failed_pages: set[int] = set()
+        self._lock = threading.Lock()
+
+    def add(self, span: TimingSpan):
+        with self._lock:
+            self.spans.append(span)
+
+    def add_failure(self, page_id: int):
+        with self._lock:
+            self.failed_pages.add(page_id)
+
+    def is_failed(self, page_id: int) -> bool:
+        return page_id in self.failed_pages
+
+    def finish(self):
+        self.end = time.time()
+
+    def wall_time(self) -> float:
+        return (self.end if self.end is not None else time.time()) - self.start
+
+    def by_stage(self) -> dict[str, float]:
+        totals = {}
+        for span in self.spans:
+            totals[span.stage] = totals.get(span.stage, 0.0) + span.duration
+        return totals
+
+    def for_page(self, page_id: int) -> list[TimingSpan]:
+        return [x for x in self.spans if x.page_id == page_id]
+
+    def get(self) -> dict:
+        return {
+            "wall_time": self.wall_time(),
+            "stages": self.by_stage(),
+            "spans": [x.get() for x in self.spans],
+            "failed_pages": sorted(self.failed_pages),
+        }
+
+    def __str__(self) -> str:
+        lines = [f"Total Process => {self.wall_time()} seconds"]
+        for stage, total in self.by_stage().items():
+            lines.append(f"  {stage} => {total} seconds")
+        return "\n".join(lines)
+
+
+class Histogram:
+    DEFAULT_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+    def __init__(self, buckets: list[float] = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0 for _ in buckets]
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """Process wide stage latency histograms and throughput counters, rendered in the prometheus text format"""
+
+    PREFIX = "manga_translator"
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.latency: dict[str, Histogram] = {}
+        self.spans: dict[str, int] = {}
+        self.bubbles: dict[str, int] = {}
+        self.pixels: dict[str, int] = {}
+        self.pages = 0
+
+    def observe(self, span: TimingSpan):
+        with self._lock:
+            if span.stage not in self.latency:
+                self.latency[span.stage] = Histogram()
+            self.latency[span.stage].observe(span.duration)
+            self.spans[span.stage] = self.spans.get(span.stage, 0) + 1
+            self.bubbles[span.stage] = self.bubbles.get(span.stage, 0) + span.bubbles
+            self.pixels[span.stage] = self.pixels.get(span.stage, 0) + span.pixels
+
+    def add_pages(self, count: int):
+        with self._lock:
+            self.pages += count
+
+    def render(self) -> str:
+        prefix = MetricsRegistry.PREFIX
+        lines = []
+        with self._lock:
+            lines.append(f"# HELP {prefix}_stage_seconds Time spent in each pipeline stage per page")
+            lines.append(f"# TYPE {prefix}_stage_seconds histogram")
+            for stage, histogram in self.latency.items():
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {histogram.sum}')
+                lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+
+            for name, description, values in [
+                ("stage_spans_total", "Pages processed by each stage", self.spans),
+                ("stage_bubbles_total", "Bubbles processed by each stage", self.bubbles),
+                ("stage_pixels_total", "Pixels processed by each stage", self.pixels),
+            ]:
+                lines.append(f"# HELP {prefix}_{name} {description}")
+                lines.append(f"# TYPE {prefix}_{name} counter")
+                for stage, value in values.items():
+                    lines.append(f'{prefix}_{name}{{stage="{stage}"}} {value}')
+
+            lines.append(f"# HELP {prefix}_pages_total Pages converted")
+            lines.append(f"# TYPE {prefix}_pages_total counter")
+            lines.append(f"{prefix}_pages_total {self.pages}")
+
+        return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry()
+
+
+class StageTimer:
+    """Records a span into report (if any) and the global metrics when the with block exits"""
+
+    def __init__(
+        self,
+        report: Union[TimingReport, None],
+        stage: str,
+        page_id: int = 0,
+        bubbles: int = 0,
+        pixels: int = 0,
+    ) -> None:
+        self.report = report
+        self.stage = stage
+        self.page_id = page_id
+        self.bubbles = bubbles
+        self.pixels = pixels
+        self.start = 0.0
+
+    def __enter__(self) -> "StageTimer":
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        span = TimingSpan(
+            self.stage,
+            self.page_id,
+            self.start,
+            time.time() - self.start,
+            self.bubbles,
+            self.pixels,
+        )
+        if self.report is not None:
+            self.report.add(span)
+        METRICS.observe(span)
+        return False
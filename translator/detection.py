@@ -0,0 +1,379 @@
+import cv2
+import numpy as np
+import torch
+from typing import Union
+
+
+class DetectionResult:
+    """Yolo boxes, classes and (optionally) segmentation polygons in the coordinates of the original page"""
+
+    def __init__(
+        self,
+        boxes: np.ndarray,
+        classes: np.ndarray,
+        confidences: np.ndarray,
+        names: dict[int, str],
+        masks: Union[list[np.ndarray], None] = None,
+    ) -> None:
+        self.boxes = boxes  # [N, 4] x1, y1, x2, y2
+        self.classes = classes  # [N]
+        self.confidences = confidences  # [N]
+        self.names = names
+        self.masks = masks  # N polygons of [M, 2] or None
+
+    def __len__(self) -> int:
+        return len(self.boxes)
+
+    def select(self, indices: np.ndarray) -> "DetectionResult":
+        indices = np.asarray(indices, dtype=np.int64)
+        return DetectionResult(
+            boxes=self.boxes[indices],
+            classes=self.classes[indices],
+            confidences=self.confidences[indices],
+            names=self.names,
+            masks=[self.masks[x] for x in indices] if self.masks is not None else None,
+        )
+
+    @staticmethod
+    def from_yolo(
+        result,
+        gain: float = 1.0,
+        pad: tuple[float, float] = (0, 0),
+        shape: Union[tuple[int, int], None] = None,
+    ) -> "DetectionResult":
+        """Converts an ultralytics result, undoing a letterbox of gain and pad if the input was preprocessed by us"""
+        boxes = result.boxes.xyxy.cpu().numpy().astype(np.float32)
+        pad_x, pad_y = pad
+
+        if len(boxes) > 0:
+            boxes[:, [0, 2]] -= pad_x
+            boxes[:, [1, 3]] -= pad_y
+            boxes /= gain
+
+            if shape is not None:
+                h, w = shape
+                boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, w)
+                boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, h)
+
+        masks = None
+        if result.masks is not None:
+            masks = [(x - (pad_x, pad_y)) / gain for x in result.masks.xy]
+
+        return DetectionResult(
+            boxes=boxes,
+            classes=result.boxes.cls.cpu().numpy().astype(np.int64),
+            confidences=result.boxes.conf.cpu().numpy().astype(np.float32),
+            names=result.names,
+            masks=masks,
+        )
+
+
+class LetterboxTransform:
+    def __init__(self, gain: float, pad: tuple[float, float], shape: tuple[int, int]) -> None:
+        self.gain = gain
+        self.pad = pad
+        self.shape = shape  # original (h, w)
+
+
+def letterbox(
+    image: np.ndarray,
+    size: int = 640,
+    pad_color: tuple[int, int, int] = (114, 114, 114),
+    out: Union[np.ndarray, None] = None,
+) -> tuple[np.ndarray, LetterboxTransform]:
+    """Resizes image to fit in a size x size square and centres it on pad_color, the same way ultralytics does"""
+    h, w = image.shape[:2]
+    gain = min(size / h, size / w)
+    new_w, new_h = round(w * gain), round(h * gain)
+    pad_x, pad_y = (size - new_w) / 2, (size - new_h) / 2
+    left, top = round(pad_x - 0.1), round(pad_y - 0.1)
+
+    if out is None:
+        out = np.empty((size, size, 3), dtype=np.uint8)
+
+    out[:] = pad_color
+    out[top : top + new_h, left : left + new_w] = cv2.resize(
+        image, (new_w, new_h), interpolation=cv2.INTER_LINEAR
+    )
+
+    return out, LetterboxTransform(gain, (left, top), (h, w))
+
+
+def letterbox_batch(
+    images: list[np.ndarray], size: int = 640, device: Union[torch.device, str, int] = "cpu"
+) -> tuple[torch.Tensor, list[LetterboxTransform]]:
+    """Letterboxes and normalizes a batch once so it can be fed to several yolo models as a [B, 3, size, size] RGB tensor"""
+    batch = np.empty((len(images), size, size, 3), dtype=np.uint8)
+    transforms = [letterbox(image, size, out=batch[i])[1] for i, image in enumerate(images)]
+
+    if isinstance(device, int):
+        device = torch.device("cuda", device)
+
+    tensor = (
+        torch.from_numpy(batch)
+        .to(device)
+        .permute(0, 3, 1, 2)
+        .flip(1)  # BGR => RGB
+        .float()
+        .div_(255)
+        .contiguous()
+    )
+
+    return tensor, transforms
+
+
+def split_combined_result(
+    result: DetectionResult, segmentation_classes: list[str]
+) -> tuple[DetectionResult, DetectionResult]:
+    """Splits the output of a single model with both detection and segmentation classes into (detection, segmentation)"""
+    is_seg = np.array(
+        [result.names[x] in segmentation_classes for x in result.classes], dtype=bool
+    )
+    detect_result = result.select(np.flatnonzero(~is_seg))
+    detect_result.masks = None
+    return detect_result, result.select(np.flatnonzero(is_seg))
+
+
+class Tile:
+    def __init__(self, image: np.ndarray, x: int, y: int, page_shape: tuple[int, int]) -> None:
+        self.image = image  # a view into the page, not a copy
+        self.x = x
+        self.y = y
+        self.page_shape = page_shape  # (h, w) of the page this tile was cut from
+
+
+def get_tile_starts(length: int, tile_size: int, overlap: int) -> list[int]:
+    """Start positions of windows of tile_size along length, the last one is moved back so it ends on the edge"""
+    if length <= tile_size:
+        return [0]
+
+    stride = max(1, tile_size - overlap)
+    starts = list(range(0, length - tile_size, stride))
+    starts.append(length - tile_size)
+    return starts
+
+
+def make_tiles(image: np.ndarray, tile_size: int = 1024, overlap: int = 256) -> list[Tile]:
+    """Cuts image into overlapping tile_size x tile_size windows (smaller if the image is), every tile is a view of image"""
+    h, w = image.shape[:2]
+    tile_h, tile_w = min(h, tile_size), min(w, tile_size)
+    return [
+        Tile(image[y : y + tile_h, x : x + tile_w], x, y, (h, w))
+        for y in get_tile_starts(h, tile_size, overlap)
+        for x in get_tile_starts(w, tile_size, overlap)
+    ]
+
+
+def offset_result(result: DetectionResult, tile: Tile, seam_margin: float = 2) -> tuple[DetectionResult, np.ndarray]:
+    """Moves a result detected on tile into page coordinates, also returns which sides (left, top, right, bottom) of
+    every box touch an inner seam of the tile (and are probably cut off) as a [N, 4] bool array"""
+    boxes = result.boxes.copy()
+    tile_h, tile_w = tile.image.shape[:2]
+    page_h, page_w = tile.page_shape
+
+    seams = np.zeros((len(boxes), 4), dtype=bool)
+    if len(boxes) > 0:
+        if tile.x > 0:
+            seams[:, 0] = boxes[:, 0] <= seam_margin
+        if tile.y > 0:
+            seams[:, 1] = boxes[:, 1] <= seam_margin
+        if tile.x + tile_w < page_w:
+            seams[:, 2] = boxes[:, 2] >= tile_w - seam_margin
+        if tile.y + tile_h < page_h:
+            seams[:, 3] = boxes[:, 3] >= tile_h - seam_margin
+
+        boxes[:, [0, 2]] += tile.x
+        boxes[:, [1, 3]] += tile.y
+
+    masks = None
+    if result.masks is not None:
+        masks = [x + (tile.x, tile.y) for x in result.masks]
+
+    return (
+        DetectionResult(boxes, result.classes, result.confidences, result.names, masks),
+        seams,
+    )
+
+
+def concat_results(results: list[DetectionResult], names: dict[int, str]) -> DetectionResult:
+    if len(results) == 0:
+        return DetectionResult(
+            np.zeros((0, 4), dtype=np.float32),
+            np.zeros(0, dtype=np.int64),
+            np.zeros(0, dtype=np.float32),
+            names,
+            None,
+        )
+
+    has_masks = all([x.masks is not None for x in results])
+    return DetectionResult(
+        boxes=np.concatenate([x.boxes for x in results]).reshape(-1, 4),
+        classes=np.concatenate([x.classes for x in results]),
+        confidences=np.concatenate([x.confidences for x in results]),
+        names=names,
+        masks=[mask for x in results for mask in x.masks] if has_masks else None,
+    )
+
+
+def non_max_suppression(
+    boxes: np.ndarray,
+    scores: np.ndarray,
+    classes: np.ndarray,
+    iou_threshold: float = 0.5,
+    ios_threshold: Union[float, None] = 0.7,
+) -> np.ndarray:
+    """Class aware greedy nms, returns the indices of the boxes to keep in order of score.
+
+    A box is also treated as a duplicate when its intersection over the smaller box exceeds ios_threshold,
+    which catches bubbles that were cut in half by a tile seam.
+    """
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = np.maximum(x2 - x1, 0) * np.maximum(y2 - y1, 0)
+
+    # pairwise overlaps for every box at once
+    inter_w = np.maximum(np.minimum(x2[:, None], x2[None, :]) - np.maximum(x1[:, None], x1[None, :]), 0)
+    inter_h = np.maximum(np.minimum(y2[:, None], y2[None, :]) - np.maximum(y1[:, None], y1[None, :]), 0)
+    inter = inter_w * inter_h
+
+    iou = inter / np.maximum(areas[:, None] + areas[None, :] - inter, 1e-6)
+    duplicate = iou > iou_threshold
+    if ios_threshold is not None:
+        duplicate |= inter / np.maximum(np.minimum(areas[:, None], areas[None, :]), 1e-6) > ios_threshold
+    duplicate &= classes[:, None] == classes[None, :]
+
+    order = np.argsort(-scores, kind="stable")
+    suppressed = np.zeros(len(boxes), dtype=bool)
+    keep = []
+    for i in order:
+        if suppressed[i]:
+            continue
+        keep.append(i)
+        suppressed |= duplicate[i]
+
+    return np.array(keep, dtype=np.int64)
+
+
+def union_polygons(polygons: list[np.ndarray]) -> np.ndarray:
+    """Outline ([M, 2]) of the union of polygons, the convex hull if they do not touch"""
+    points = np.concatenate(polygons)
+    x1, y1 = np.floor(points.min(axis=0)).astype(np.int64)
+    x2, y2 = np.ceil(points.max(axis=0)).astype(np.int64)
+
+    canvas = np.zeros((y2 - y1 + 1, x2 - x1 + 1), dtype=np.uint8)
+    cv2.fillPoly(canvas, [np.round(x - (x1, y1)).astype(np.int32) for x in polygons], 255)
+    contours, _ = cv2.findContours(canvas, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    contour = contours[0] if len(contours) == 1 else cv2.convexHull(np.concatenate(contours))
+
+    return (contour[:, 0, :] + (x1, y1)).astype(polygons[0].dtype)
+
+
+def merge_seam_halves(
+    result: DetectionResult,
+    seams: np.ndarray,
+    tile_ids: np.ndarray,
+    seam_margin: float = 2,
+    alignment: float = 0.5,
+) -> tuple[DetectionResult, np.ndarray]:
+    """Replaces boxes that were cut by opposite seams of different tiles (i.e. the left half of a bubble wider than the
+    overlap cut by the right edge of one tile, and its right half cut by the left edge of the next) with their union.
+
+    The pieces have to be of the same class, overlap (or be at most seam_margin apart) across the seam and overlap by
+    at least alignment of the shorter one along it. Masks of merged boxes are unioned too.
+    Returns the merged result and which of its boxes still touch a seam (the ones that were not merged)
+    """
+    touches_seam = seams.any(axis=1)
+    if touches_seam.sum() < 2:
+        return result, touches_seam
+
+    boxes = result.boxes
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    left, top, right, bottom = seams[:, 0], seams[:, 1], seams[:, 2], seams[:, 3]
+
+    inter_w = np.minimum(x2[:, None], x2[None, :]) - np.maximum(x1[:, None], x1[None, :])
+    inter_h = np.minimum(y2[:, None], y2[None, :]) - np.maximum(y1[:, None], y1[None, :])
+    min_w = np.minimum((x2 - x1)[:, None], (x2 - x1)[None, :])
+    min_h = np.minimum((y2 - y1)[:, None], (y2 - y1)[None, :])
+
+    # [i, j] is set when box i is the left (top) piece and box j the right (bottom) one
+    across_x = right[:, None] & left[None, :] & (x1[:, None] <= x1[None, :]) & (x2[:, None] <= x2[None, :])
+    across_x &= (inter_w >= -seam_margin) & (inter_h >= alignment * min_h)
+    across_y = bottom[:, None] & top[None, :] & (y1[:, None] <= y1[None, :]) & (y2[:, None] <= y2[None, :])
+    across_y &= (inter_h >= -seam_margin) & (inter_w >= alignment * min_w)
+
+    pieces = across_x | across_y
+    pieces |= pieces.T
+    pieces &= result.classes[:, None] == result.classes[None, :]
+    pieces &= tile_ids[:, None] != tile_ids[None, :]
+
+    if not pieces.any():
+        return result, touches_seam
+
+    # a bubble can be cut into more than two pieces, so pieces are grouped transitively
+    groups = np.arange(len(boxes))
+
+    def find(i):
+        while groups[i] != i:
+            groups[i] = groups[groups[i]]
+            i = groups[i]
+        return i
+
+    for i, j in zip(*np.nonzero(np.triu(pieces, 1))):
+        groups[find(i)] = find(j)
+
+    members: dict[int, list[int]] = {}
+    for i in range(len(boxes)):
+        members.setdefault(find(i), []).append(i)
+
+    merged_boxes, classes, confidences, masks, still_touches = [], [], [], [], []
+    for group in members.values():
+        merged_boxes.append(
+            [x1[group].min(), y1[group].min(), x2[group].max(), y2[group].max()]
+        )
+        classes.append(result.classes[group[0]])
+        confidences.append(result.confidences[group].max())
+        if result.masks is not None:
+            masks.append(
+                result.masks[group[0]] if len(group) == 1 else union_polygons([result.masks[x] for x in group])
+            )
+        still_touches.append(len(group) == 1 and touches_seam[group[0]])
+
+    return (
+        DetectionResult(
+            boxes=np.array(merged_boxes, dtype=boxes.dtype).reshape(-1, 4),
+            classes=np.array(classes, dtype=result.classes.dtype),
+            confidences=np.array(confidences, dtype=result.confidences.dtype),
+            names=result.names,
+            masks=masks if result.masks is not None else None,
+        ),
+        np.array(still_touches, dtype=bool),
+    )
+
+
+def merge_tile_results(
+    results: list[DetectionResult],
+    tiles: list[Tile],
+    iou_threshold: float = 0.5,
+    ios_threshold: Union[float, None] = 0.7,
+) -> DetectionResult:
+    """Combines the results of every tile of a page, joining the pieces of boxes cut by seams (see merge_seam_halves)
+    and removing the duplicates found where tiles overlap"""
+    offset = [offset_result(result, tile) for result, tile in zip(results, tiles)]
+    names = results[0].names if len(results) > 0 else {}
+    merged = concat_results([x for x, _ in offset], names)
+
+    if len(merged) == 0:
+        return merged
+
+    seams = np.concatenate([x for _, x in offset]).reshape(-1, 4)
+    tile_ids = np.concatenate([np.full(len(x), i) for i, (x, _) in enumerate(offset)])
+    merged, touches_seam = merge_seam_halves(merged, seams, tile_ids)
+
+    # boxes cut by a seam lose to the complete box from the neighbouring tile
+    scores = merged.confidences * np.where(touches_seam, 0.5, 1.0)
+
+    return merged.select(
+        non_max_suppression(merged.boxes, scores, merged.classes, iou_threshold, ios_threshold)
+    )
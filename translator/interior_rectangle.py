@@ -0,0 +1,82 @@
+import threading
+from collections import OrderedDict
+from typing import Union
+import cv2
+import numba as nb
+import numpy as np
+from translator.core.cache import hash_image
+
+# hash of the filled mask => (x, y, w, h) in the mask
+_cache: OrderedDict[str, tuple[int, int, int, int]] = OrderedDict()
+
+_cache_lock = threading.Lock()
+
+CACHE_SIZE = 4096
+
+
+@nb.njit("int64[:](boolean[:, ::1])", cache=True)
+def _largest_rectangle(mask):
+    h, w = mask.shape
+    # heights[x] is how many set pixels end at the current row in column x, heights[w] stays 0 to empty the stack
+    heights = np.zeros(w + 1, dtype=np.int64)
+    stack = np.zeros(w + 1, dtype=np.int64)
+    best = np.zeros(4, dtype=np.int64)
+    best_area = 0
+
+    for y in range(h):
+        for x in range(w):
+            heights[x] = heights[x] + 1 if mask[y, x] else 0
+
+        top = 0
+        for x in range(w + 1):
+            while top > 0 and heights[stack[top - 1]] >= heights[x]:
+                height = heights[stack[top - 1]]
+                top -= 1
+                left = stack[top - 1] + 1 if top > 0 else 0
+                area = height * (x - left)
+                y1 = y - height + 1
+                # ties go to the top most, then left most rectangle like lir.lir
+                if area > best_area or (
+                    area == best_area and area > 0 and (y1 < best[1] or (y1 == best[1] and left < best[0]))
+                ):
+                    best_area = area
+                    best[0], best[1], best[2], best[3] = left, y1, x - left, height
+            stack[top] = x
+            top += 1
+
+    return best
+
+
+def largest_interior_rectangle(mask: np.ndarray) -> tuple[int, int, int, int]:
+    """(x, y, w, h) of the largest rectangle inside the boolean mask. Exact, it is the largest rectangle in the histogram
+    of every row (O(h * w)) instead of the span maps lir.lir builds"""
+    return tuple([int(x) for x in _largest_rectangle(np.ascontiguousarray(mask, dtype=bool))])
+
+
+def get_interior_rectangle(polygon: np.ndarray) -> Union[tuple[tuple[int, int], tuple[int, int]], None]:
+    """Same as lir.pt1 / lir.pt2 of lir.lir(polygon) (a (1, n, 2) contour), see largest_interior_rectangle.
+    Results are remembered by the filled polygon, so the same bubble on a page that is converted again is free"""
+    x, y, w, h = cv2.boundingRect(polygon)
+    if w == 0 or h == 0:
+        return None
+
+    mask = np.zeros((h, w), dtype=np.uint8)
+    cv2.fillPoly(mask, [polygon[0] - (x, y)], 255)
+
+    key = hash_image(mask)
+    with _cache_lock:
+        rect = _cache.get(key, None)
+        if rect is not None:
+            _cache.move_to_end(key)
+
+    if rect is None:
+        rect = largest_interior_rectangle(mask > 0)
+        with _cache_lock:
+            _cache[key] = rect
+            while len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+
+    rx, ry, rw, rh = rect
+    if rw == 0 or rh == 0:
+        return None
+    return (x + rx, y + ry), (x + rx + rw - 1, y + ry + rh - 1)
@@ -1,5 +1,6 @@
 import numpy
 from translator.utils import cv2_to_pil, lang_code_to_name
+from translator.core.registry import MODELS
 from translator.core.plugin import (
     Ocr,
     OcrResult,
@@ -99,17 +100,20 @@ class EasyOcr(Ocr):
     ]
 
     def __init__(self, lang=languages[0]) -> None:
-        import easyocr
-
         super().__init__()
-        self.easy = easyocr.Reader([lang])
         self.language = lang
 
+    def use_reader(self):
+        import easyocr
+
+        return MODELS.use(f"easyocr:{self.language}", lambda: easyocr.Reader([self.language]))
+
     async def do_ocr(self, batch: list[numpy.ndarray]):
-        return [OcrResult(
-            text=self.easy.readtext(x, detail=0, paragraph=True)[0],
-            language=self.language,
-        )  for x in batch]
+        with self.use_reader() as reader:
+            return [OcrResult(
+                text=reader.readtext(x, detail=0, paragraph=True)[0],
+                language=self.language,
+            )  for x in batch]
 
     @staticmethod
     def get_name() -> str:
@@ -5,6 +5,7 @@ import jaconv
 from transformers import pipeline
 from translator.utils import cv2_to_pil, get_torch_device
 from translator.core.plugin import Ocr, OcrResult
+from translator.core.registry import MODELS
 
 
 class JapaneseOcr(Ocr):
@@ -12,13 +13,21 @@ class JapaneseOcr(Ocr):
 
     def __init__(self,model='TareHimself/manga-ocr-base') -> None:
         super().__init__()
-        self.pipeline = pipeline("image-to-text", model=model, device=get_torch_device())
+        self.model = model
+
+    def use_pipeline(self):
+        device = get_torch_device()
+        return MODELS.use(
+            f"hf-ocr:{self.model}:{device}",
+            lambda: pipeline("image-to-text", model=self.model, device=device),
+        )
     
     async def do_ocr(self, batch: list[numpy.ndarray]):
 
         with torch.inference_mode():
             frames = [cv2_to_pil(x).convert('L').convert('RGB') for x in batch]
-            results = self.pipeline(frames,max_new_tokens=300)
+            with self.use_pipeline() as ocr:
+                results = ocr(frames,max_new_tokens=300)
 
             return [OcrResult(self._post_process(x[0]['generated_text']), "ja") for x in results]
     
@@ -1,26 +1,45 @@
 import time
+import math
 import cv2
 import numpy as np
 import sys
 from ultralytics import YOLO
 from translator.utils import (
     display_image,
-    mask_text_and_make_bubble_mask,
-    get_bounds_for_text,
+    BubbleAnalyzer,
     TranslatorGlobals,
     has_white,
     get_model_path,
-    apply_mask
+    apply_mask,
+    run_in_thread,
+    get_in_paint_window,
+    select_dirty_detections,
 )
 from translator.color_detect.utils import apply_transforms
 import traceback
 import threading
 import torch
 import asyncio
-from typing import Union
+import inspect
+import itertools
+from typing import AsyncIterator, Iterable, Union
 from concurrent.futures import ThreadPoolExecutor
 from translator.color_detect.models import get_color_detection_model
 from translator.core.plugin import Drawable, Translator, Ocr, Drawer, Cleaner
+from translator.core.constants import PipelineStages
+from translator.core.executors import StageExecutor
+from translator.core.timing import TimingReport, TimingSpan, StageTimer, METRICS
+from translator.core.pipelining import StagedPipeline, PipelineStage, PipelineFailure
+from translator.core.batching import MicroBatcher, BatchedOcr, BatchedTranslator
+from translator.core.cache import StageCache, hash_image, make_cache_key
+from translator.core.registry import MODELS
+from translator.detection import (
+    DetectionResult,
+    letterbox_batch,
+    split_combined_result,
+    make_tiles,
+    merge_tile_results,
+)
 from translator.cleaners.deepfillv2 import DeepFillV2Cleaner
 from translator.drawers.horizontal import HorizontalDrawer
 
@@ -46,6 +65,139 @@ def resize_percent(image, dest_percent=50):
     return cv2.resize(image, dim, interpolation=cv2.INTER_AREA)
 
 
+def get_pixel_count(images: list[np.ndarray]) -> int:
+    return sum([x.shape[0] * x.shape[1] for x in images])
+
+
+def scale_bbox(
+    bbox: tuple[int, int, int, int], scale_x: float, scale_y: float, shape: tuple[int, int]
+) -> tuple[int, int, int, int]:
+    """Scales bbox, rounding outwards so the scaled box still covers everything the original did, and clips it to shape (h, w)"""
+    x1, y1, x2, y2 = bbox
+    h, w = shape[:2]
+    return (
+        max(0, int(math.floor(x1 * scale_x))),
+        max(0, int(math.floor(y1 * scale_y))),
+        min(w, int(math.ceil(x2 * scale_x))),
+        min(h, int(math.ceil(y2 * scale_y))),
+    )
+
+
+class PipelinePage:
+    """The state of a single page as it moves through FullConversion's pipelined mode"""
+
+    def __init__(self, frame: np.ndarray, page_id: int = 0, report: Union[TimingReport, None] = None) -> None:
+        self.input_frame = frame
+        self.page_id = page_id
+        self.report = report
+        self.cache_keys = {}
+        self.frame = frame
+        self.detect_result = None
+        self.seg_result = None
+        self.frame_clean = None
+        self.text_mask = None
+        self.to_translate = []
+        self.draw_colors = []
+        self.translation_results = []
+
+
+def extract_text_regions(
+    frame: np.ndarray,
+    frame_clean: np.ndarray,
+    text_mask: np.ndarray,
+    detect_result: list[tuple[tuple[int, int, int, int], str, float]],
+    translate_free_text: bool = False,
+    debug: bool = False,
+    native: Union[tuple[np.ndarray, np.ndarray], None] = None,
+):
+    """Pastes the cleaned bubbles into frame and returns it along with the areas that need to be translated as [(x1, y1, x2, y2), text_only]
+
+    If native (frame, frame_clean) is given the other arguments are a downscaled copy of it, the analysis runs on the copy
+    while the bubbles are pasted into the native frame which is returned instead, with the areas scaled to match
+    """
+    if native is not None:
+        output, output_clean = native
+        scale_x, scale_y = output.shape[1] / frame.shape[1], output.shape[0] / frame.shape[0]
+    else:
+        output, output_clean = frame, frame_clean
+        scale_x, scale_y = 1.0, 1.0
+
+    def paste_clean(x1, y1, x2, y2):
+        frame[y1:y2, x1:x2] = frame_clean[y1:y2, x1:x2]
+        if native is not None:
+            nx1, ny1, nx2, ny2 = scale_bbox((x1, y1, x2, y2), scale_x, scale_y, output.shape)
+            output[ny1:ny2, nx1:nx2] = output_clean[ny1:ny2, nx1:nx2]
+
+    to_translate = []
+    analyzer = BubbleAnalyzer()
+    # First pass, mask all bubbles
+    for bbox, cls, conf in detect_result:
+        try:
+            # if conf < 0.65:
+            #     continue
+
+            # print(get_ocr(get_box_section(frame, box)))
+            color = (0, 0, 255) if cls == 1 else (0, 255, 0)
+
+            (x1, y1, x2, y2) = bbox
+
+            class_name = cls
+
+            bubble = frame[y1:y2, x1:x2]
+            bubble_clean = frame_clean[y1:y2, x1:x2]
+            bubble_text_mask = text_mask[y1:y2, x1:x2]
+
+            if class_name == "text_bubble":
+                analysis = analyzer.analyze(bubble, bubble_text_mask, bubble_clean)
+                if analysis is not None:
+                    text_only, _, text_draw_bounds = analysis
+
+                    paste_clean(x1, y1, x2, y2)
+
+                    if text_draw_bounds is not None:
+                        pt1, pt2 = text_draw_bounds
+
+                        pt1_x, pt1_y = pt1
+                        pt2_x, pt2_y = pt2
+
+                        pt1_x += x1
+                        pt2_x += x1
+                        pt1_y += y1
+                        pt2_y += y1
+
+                        to_translate.append([scale_bbox((pt1_x, pt1_y, pt2_x, pt2_y), scale_x, scale_y, output.shape), text_only])
+
+                    # frame = cv2.rectangle(frame,(x1,y1),(x2,y2),color=(255,255,0),thickness=2)
+                    # debug_image(text_only,"Text Only")
+            else:
+                if translate_free_text:
+                    free_text = frame[y1:y2, x1:x2]
+                    analysis = analyzer.analyze(free_text, bubble_text_mask) if has_white(free_text) else None
+                    if analysis is not None:
+                        text_only = analysis[0]
+
+                        to_translate.append([scale_bbox((x1, y1, x2, y2), scale_x, scale_y, output.shape), text_only])
+
+                    paste_clean(x1, y1, x2, y2)
+                else:
+                    paste_clean(x1, y1, x2, y2)
+
+            if debug:
+                cv2.putText(
+                    output,
+                    str(f"{cls} | {conf * 100:.1f}%"),
+                    (round(x1 * scale_x), round(y1 * scale_y) - 20),
+                    cv2.FONT_HERSHEY_PLAIN,
+                    1,
+                    color,
+                    2,
+                )
+        except:
+            traceback.print_exc()
+
+    return output, to_translate
+
+
 class FullConversion:
     def __init__(
         self,
@@ -60,38 +212,168 @@ class FullConversion:
         device=torch.device("cuda:0") if torch.cuda.is_available() else torch.device("cpu"),
         yolo_device=0 if torch.cuda.is_available() else "cpu",
         debug=False,
+        pipelined: bool = False,
+        pipeline_queue_size: int = 2,
+        shared_preprocessing: bool = False,
+        yolo_image_size: int = 640,
+        combined_model: Union[str, None] = None,
+        combined_segmentation_classes: list[str] = ["text"],
+        micro_batching: bool = False,
+        max_batch_size: int = 32,
+        max_batch_wait: float = 0.02,
+        executors: Union[dict[str, StageExecutor], None] = None,
+        stage_cache: Union[StageCache, None] = None,
+        tiled_detection: bool = False,
+        tile_size: int = 1024,
+        tile_overlap: int = 256,
+        tile_batch_size: int = 16,
+        working_max_side: Union[int, None] = None,
     ) -> None:
         self.device = device
         print("Pipeline created using",device)
         self.yolo_device = yolo_device
-        self.segmentation_model = YOLO(seg_model)
-        self.detection_model = YOLO(detect_model)
-        try:
-            if color_detect_model is not None:
-                self.color_detect_model = get_color_detection_model(
-                    weights_path=color_detect_model, device=self.device
-                )
-                self.color_detect_model.eval()
-            else:
-                self.color_detect_model = None
-        except:
-            self.color_detect_model = None
-            traceback.print_exc()
+        self.shared_preprocessing = shared_preprocessing
+        self.yolo_image_size = yolo_image_size
+        self.combined_segmentation_classes = combined_segmentation_classes
+        self.stage_cache = stage_cache
+        self.tiled_detection = tiled_detection
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        self.tile_batch_size = tile_batch_size
+        # detection, mask building and bubble analysis run on pages downscaled to this, inpainting and drawing stay at full resolution
+        self.working_max_side = working_max_side
+        # everything that changes the yolo results, used to key cached detections
+        self.detection_config = (
+            [combined_model, combined_segmentation_classes, yolo_image_size]
+            if combined_model is not None
+            else [detect_model, seg_model, yolo_image_size if shared_preprocessing else None]
+        ) + ([tile_size, tile_overlap] if tiled_detection else []) + [working_max_side]
+        self.color_detect_model_path = color_detect_model
+        # models are fetched from the process wide registry on every use so pipelines share them
+        self.combined_model_path = combined_model
+        self.detect_model_path = detect_model
+        self.seg_model_path = seg_model
+        self.color_detect_failed = False
+        self.yolo_executor = ThreadPoolExecutor(max_workers=2)
 
         self.translate_free_text = translate_free_text
         self.translator = translator
         self.ocr = ocr
+        self.executors = executors if executors is not None else {}
+        self.color_batcher = None
+        if micro_batching:
+            # crops from every in flight page (and request if this instance is shared) go through the same batches
+            self.translator = BatchedTranslator(translator, max_batch_size, max_batch_wait)
+            self.ocr = BatchedOcr(ocr, max_batch_size, max_batch_wait)
+            self.color_batcher = MicroBatcher(self._predict_colors_async, max_batch_size, max_batch_wait)
         self.drawer = drawer
         self.debug = debug
         self.cleaner = cleaner
         self.frame_process_mutex = threading.Lock()
+        self.pipelined = pipelined
+        self.pipeline_queue_size = pipeline_queue_size
+        self.last_pipeline_report = None
+        self.last_timing_report = None
+
+    async def run_stage(self, stage: str, func, *args, **kwargs):
+        """Runs func on the executor configured for stage, or inline on the event loop if there is none"""
+        executor = self.executors.get(stage, None)
+        if executor is not None:
+            return await executor(func, *args, **kwargs)
+
+        result = func(*args, **kwargs)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    def get_working_shape(self, frame: np.ndarray) -> tuple[int, int]:
+        """The (h, w) frame is analysed at"""
+        h, w = frame.shape[:2]
+        if self.working_max_side is None or max(h, w) <= self.working_max_side:
+            return h, w
+
+        scale = self.working_max_side / max(h, w)
+        return max(1, round(h * scale)), max(1, round(w * scale))
+
+    def to_working_resolution(self, frame: np.ndarray, interpolation: int = cv2.INTER_AREA) -> np.ndarray:
+        h, w = self.get_working_shape(frame)
+        if (h, w) == frame.shape[:2]:
+            return frame
+        return cv2.resize(frame, (w, h), interpolation=interpolation)
 
-    def filter_results(self, results, min_confidence=0.1):
-        bounding_boxes = np.array(results.boxes.xyxy.cpu(), dtype="int")
+    @staticmethod
+    def use_yolo(path: str):
+        # predictors keep state between calls, so every model only runs one batch at a time
+        return MODELS.use(f"yolo:{path}", lambda: YOLO(path))
 
-        classes = np.array(results.boxes.cls.cpu(), dtype="int")
+    @property
+    def color_detect_model(self):
+        if self.color_detect_model_path is None or self.color_detect_failed:
+            return None
 
-        confidence = np.array(results.boxes.conf.cpu(), dtype="float")
+        try:
+            return MODELS.get(
+                f"color-detection:{self.color_detect_model_path}:{self.device}",
+                lambda: get_color_detection_model(
+                    weights_path=self.color_detect_model_path, device=self.device
+                ).eval(),
+            )
+        except:
+            self.color_detect_failed = True
+            traceback.print_exc()
+            return None
+
+    def get_cache_keys(self, frame: np.ndarray) -> dict[str, str]:
+        """Keys for the cached outputs of each stage for frame, every key is derived from the key of the stage
+        it depends on and the configuration of its own plugin so changing a plugin only invalidates its stage and the ones after it
+        """
+        if self.stage_cache is None:
+            return {}
+
+        def plugin_key(plugin):
+            return plugin.get_cache_key() if plugin is not None else None
+
+        keys = {}
+        keys[PipelineStages.DETECTION] = make_cache_key(
+            hash_image(frame), PipelineStages.DETECTION, self.detection_config
+        )
+        keys[PipelineStages.CLEANING] = make_cache_key(
+            keys[PipelineStages.DETECTION], PipelineStages.CLEANING, plugin_key(self.cleaner)
+        )
+        keys[PipelineStages.MASKING] = make_cache_key(
+            keys[PipelineStages.CLEANING], PipelineStages.MASKING, self.translate_free_text, self.debug
+        )
+        keys[PipelineStages.COLOR_DETECTION] = make_cache_key(
+            keys[PipelineStages.MASKING], PipelineStages.COLOR_DETECTION, self.color_detect_model_path
+        )
+        keys[PipelineStages.OCR] = make_cache_key(
+            keys[PipelineStages.MASKING], PipelineStages.OCR, plugin_key(self.ocr)
+        )
+        keys[PipelineStages.TRANSLATION] = make_cache_key(
+            keys[PipelineStages.OCR], PipelineStages.TRANSLATION, plugin_key(self.translator)
+        )
+        return keys
+
+    async def cached(self, stage: str, key: Union[str, None], func, should_cache=None):
+        """Returns the cached output of stage for key if there is one, otherwise awaits func() and caches the result
+        unless should_cache(result) is False"""
+        if self.stage_cache is None or key is None:
+            return await func()
+
+        result = self.stage_cache.get(stage, key)
+        if result is None:
+            result = await func()
+            if should_cache is None or should_cache(result):
+                self.stage_cache.put(stage, key, result)
+
+        return result
+
+    def filter_results(self, results: DetectionResult, min_confidence=0.1):
+        bounding_boxes = np.array(results.boxes, dtype="int")
+
+        classes = np.array(results.classes, dtype="int")
+
+        confidence = np.array(results.confidences, dtype="float")
 
         raw_results: list[tuple[tuple[int, int, int, int], str, float]] = []
 
@@ -123,11 +405,22 @@ class FullConversion:
         # print(f"Ended with {len(results)} results")
         return results
 
-    async def process_ml_results(self, detect_result, seg_result, frame):
-        text_mask = np.zeros_like(frame, dtype=frame.dtype)
+    async def process_ml_results(self, detect_result, seg_result, frame, page_id: int = 0, report: Union[TimingReport, None] = None, cache_keys: dict[str, str] = {}):
+        frame_clean, text_mask, detect_result = await self.cached(
+            PipelineStages.CLEANING,
+            cache_keys.get(PipelineStages.CLEANING),
+            lambda: self.clean_frame(detect_result, seg_result, frame, page_id, report),
+        )
+
+        return frame, frame_clean, text_mask, detect_result
+
+    async def clean_frame(self, detect_result, seg_result, frame, page_id: int = 0, report: Union[TimingReport, None] = None):
+        """Builds the text mask from detect_result and seg_result (which are in working resolution) and runs the cleaner on the full resolution frame"""
+        working_h, working_w = self.get_working_shape(frame)
+        text_mask = np.zeros((working_h, working_w) + frame.shape[2:], dtype=frame.dtype)
 
         if seg_result.masks is not None:  # Fill in segmentation results
-            for seg in list(map(lambda a: a.astype("int"), seg_result.masks.xy)):
+            for seg in list(map(lambda a: a.astype("int"), seg_result.masks)):
                 cv2.fillPoly(text_mask, [seg], (255, 255, 255))
 
         detect_result = self.filter_results(detect_result)
@@ -139,89 +432,188 @@ class FullConversion:
                     text_mask, (x1, y1), (x2, y2), (255, 255, 255), -1
                 )
 
-        start = time.time()
-
-        frame_clean, text_mask = await self.cleaner(
-            frame=frame, mask=text_mask, detection_results=detect_result
-        )  # segmentation_results.boxes.xyxy.cpu().numpy()
+        to_clean = detect_result
+        if (working_h, working_w) != frame.shape[:2]:
+            # only the inpainting happens at full resolution
+            scale_x, scale_y = frame.shape[1] / working_w, frame.shape[0] / working_h
+            text_mask = cv2.resize(text_mask, (frame.shape[1], frame.shape[0]), interpolation=cv2.INTER_NEAREST)
+            to_clean = [(scale_bbox(bbox, scale_x, scale_y, frame.shape), cls, conf) for bbox, cls, conf in detect_result]
 
-        print(f"Inpainting => {time.time() - start} seconds")
+        with StageTimer(report, PipelineStages.CLEANING, page_id, len(detect_result), frame.shape[0] * frame.shape[1]):
+            frame_clean, text_mask = await self.run_stage(
+                PipelineStages.CLEANING, self.cleaner, frame=frame, mask=text_mask, detection_results=to_clean
+            )  # segmentation_results.boxes.xyxy.cpu().numpy()
 
-        return frame, frame_clean, text_mask, detect_result
+        return frame_clean, text_mask, detect_result
 
-    async def process_frame(self, detect_result, seg_result, input_frame):
-        try:
-            frame, frame_clean, text_mask, detect_result = await self.process_ml_results(
-                detect_result, seg_result, input_frame
+    async def reclean(
+        self,
+        frame: np.ndarray,
+        frame_clean: np.ndarray,
+        text_mask: np.ndarray,
+        mask: np.ndarray,
+        detection_results: list[tuple[tuple[int, int, int, int], str, float]],
+        dirty_regions: list[tuple[int, int, int, int]],
+        page_id: int = 0,
+        report: Union[TimingReport, None] = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Updates a previous cleaning result of frame after the mask was edited inside dirty_regions (x1, y1, x2, y2).
+
+        frame_clean and text_mask are the previous output of the cleaner, mask the edited mask and detection_results the
+        boxes the cleaner was given, all at the resolution of frame. The cleaner only runs on the detections whose windows
+        intersect a dirty region (see select_dirty_detections), on a crop of frame just big enough to hold their windows,
+        and the boxes of those detections are copied into copies of frame_clean and text_mask which are returned
+        """
+        selected = select_dirty_detections(detection_results, dirty_regions, frame.shape)
+        if len(selected) == 0:
+            return frame_clean, text_mask
+
+        windows = [get_in_paint_window(detection_results[i][0], frame.shape) for i in selected]
+        cx1, cy1 = min([x[0] for x in windows]), min([x[1] for x in windows])
+        cx2, cy2 = max([x[2] for x in windows]), max([x[3] for x in windows])
+
+        # every window fits in the crop, so the cleaner cuts the same windows out of it as out of the whole frame
+        to_clean = []
+        for i in selected:
+            (x1, y1, x2, y2), cls, conf = detection_results[i]
+            to_clean.append(((x1 - cx1, y1 - cy1, x2 - cx1, y2 - cy1), cls, conf))
+
+        with StageTimer(report, PipelineStages.CLEANING, page_id, len(selected), (cx2 - cx1) * (cy2 - cy1)):
+            crop_clean, crop_text_mask = await self.run_stage(
+                PipelineStages.CLEANING,
+                self.cleaner,
+                frame=np.ascontiguousarray(frame[cy1:cy2, cx1:cx2]),
+                mask=np.ascontiguousarray(mask[cy1:cy2, cx1:cx2]),
+                detection_results=to_clean,
             )
 
-            to_translate = []
-            # First pass, mask all bubbles
-            for bbox, cls, conf in detect_result:
-                try:
-                    # if conf < 0.65:
-                    #     continue
-
-                    # print(get_ocr(get_box_section(frame, box)))
-                    color = (0, 0, 255) if cls == 1 else (0, 255, 0)
+        frame_clean = frame_clean.copy()
+        text_mask = text_mask.copy()
+        for (x1, y1, x2, y2), _, _ in to_clean:
+            # the box is drawn inclusive of its far edge when the cleaners limit the mask to it
+            x1, y1 = max(0, round(x1)), max(0, round(y1))
+            x2, y2 = min(cx2 - cx1, round(x2) + 1), min(cy2 - cy1, round(y2) + 1)
+            frame_clean[cy1 + y1 : cy1 + y2, cx1 + x1 : cx1 + x2] = crop_clean[y1:y2, x1:x2]
+            text_mask[cy1 + y1 : cy1 + y2, cx1 + x1 : cx1 + x2] = crop_text_mask[y1:y2, x1:x2]
+
+        return frame_clean, text_mask
+
+    async def mask_text_regions(self, frame, frame_clean, text_mask, detect_result, page_id: int = 0, report: Union[TimingReport, None] = None, cache_keys: dict[str, str] = {}):
+        async def extract():
+            with StageTimer(report, PipelineStages.MASKING, page_id, len(detect_result), get_pixel_count([frame])):
+                if self.get_working_shape(frame) != frame.shape[:2]:
+                    # bubble analysis runs on a downscaled copy, the cleaned bubbles are still pasted at full resolution
+                    return await self.run_stage(
+                        PipelineStages.MASKING,
+                        extract_text_regions,
+                        self.to_working_resolution(frame),
+                        self.to_working_resolution(frame_clean),
+                        self.to_working_resolution(text_mask, cv2.INTER_NEAREST),
+                        detect_result,
+                        self.translate_free_text,
+                        self.debug,
+                        (frame, frame_clean),
+                    )
+
+                return await self.run_stage(
+                    PipelineStages.MASKING, extract_text_regions, frame, frame_clean, text_mask, detect_result, self.translate_free_text, self.debug
+                )
 
-                    (x1, y1, x2, y2) = bbox
+        return await self.cached(PipelineStages.MASKING, cache_keys.get(PipelineStages.MASKING), extract)
 
-                    class_name = cls
+    def _predict_colors(self, frames_with_text: list[np.ndarray]):
+        with torch.no_grad():  # model needs work
+            with torch.inference_mode():
+                with self.frame_process_mutex:  # this may not be needed
 
-                    bubble = frame[y1:y2, x1:x2]
-                    bubble_clean = frame_clean[y1:y2, x1:x2]
-                    bubble_text_mask = text_mask[y1:y2, x1:x2]
+                    images = [apply_transforms(frame_with_text.copy()) for frame_with_text in frames_with_text]
 
-                    if class_name == "text_bubble":
-                        if has_white(bubble_text_mask):
-                            text_only, bubble_mask = mask_text_and_make_bubble_mask(
-                                bubble, bubble_text_mask, bubble_clean
+                    return [((y[0:3] * 255).astype(np.uint8),(y[3:-1] * 255).astype(np.uint8),(True if y[-1] > 0.5 else False)) for y in [
+                        x.cpu().numpy()
+                        for x in self.color_detect_model(
+                            torch.stack(images).to(
+                                self.device
                             )
-
-                            frame[y1:y2, x1:x2] = bubble_clean
-                            text_draw_bounds = get_bounds_for_text(bubble_mask)
-
-                            pt1, pt2 = text_draw_bounds
-
-                            pt1_x, pt1_y = pt1
-                            pt2_x, pt2_y = pt2
-
-                            pt1_x += x1
-                            pt2_x += x1
-                            pt1_y += y1
-                            pt2_y += y1
-
-                            to_translate.append([(pt1_x, pt1_y, pt2_x, pt2_y), text_only])
-
-                            # frame = cv2.rectangle(frame,(x1,y1),(x2,y2),color=(255,255,0),thickness=2)
-                            # debug_image(text_only,"Text Only")
-                    else:
-                        if self.translate_free_text:
-                            free_text = frame[y1:y2, x1:x2]
-                            if has_white(free_text):
-                                text_only, _ = mask_text_and_make_bubble_mask(
-                                    free_text, bubble_text_mask, bubble_clean
-                                )
-
-                                to_translate.append([(x1, y1, x2, y2), text_only])
-
-                            frame[y1:y2, x1:x2] = frame_clean[y1:y2, x1:x2]
-                        else:
-                            frame[y1:y2, x1:x2] = frame_clean[y1:y2, x1:x2]
-
-                    if self.debug:
-                        cv2.putText(
-                            frame,
-                            str(f"{cls} | {conf * 100:.1f}%"),
-                            (x1, y1 - 20),
-                            cv2.FONT_HERSHEY_PLAIN,
-                            1,
-                            color,
-                            2,
                         )
-                except:
-                    traceback.print_exc()
+                    ]]
+
+    async def _predict_colors_async(self, frames_with_text: list[np.ndarray]):
+        return await self.run_stage(PipelineStages.COLOR_DETECTION, self._predict_colors, frames_with_text)
+
+    async def detect_colors(self, to_translate, page_id: int = 0, report: Union[TimingReport, None] = None, cache_keys: dict[str, str] = {}):
+        draw_colors = [(TranslatorGlobals.COLOR_BLACK,TranslatorGlobals.COLOR_BLACK,False) for x in to_translate]
+
+        if self.color_detect_model is not None and len(draw_colors) > 0:
+            frames_with_text = [frame_with_text for _, frame_with_text in to_translate]
+
+            async def predict():
+                with StageTimer(report, PipelineStages.COLOR_DETECTION, page_id, len(to_translate), get_pixel_count(frames_with_text)):
+                    if self.color_batcher is not None:
+                        return await self.color_batcher(frames_with_text)
+                    return await self._predict_colors_async(frames_with_text)
+
+            draw_colors = await self.cached(PipelineStages.COLOR_DETECTION, cache_keys.get(PipelineStages.COLOR_DETECTION), predict)
+        else:
+            print("Using black since color detect model is 'None'")
+
+        return draw_colors
+
+    async def translate_regions(self, to_translate, page_id: int = 0, report: Union[TimingReport, None] = None, cache_keys: dict[str, str] = {}):
+        _, images = zip(*to_translate)
+
+        async def ocr():
+            with StageTimer(report, PipelineStages.OCR, page_id, len(images), get_pixel_count(images)):
+                return await self.ocr(list(images))
+
+        ocr_results = await self.cached(PipelineStages.OCR, cache_keys.get(PipelineStages.OCR), ocr)
+
+        async def translate():
+            with StageTimer(report, PipelineStages.TRANSLATION, page_id, len(images), get_pixel_count(images)):
+                return await self.translator(ocr_results)
+
+        def succeeded(results):
+            return not any([x.failed for x in results])
+
+        results = await self.cached(PipelineStages.TRANSLATION, cache_keys.get(PipelineStages.TRANSLATION), translate, succeeded)
+        if not succeeded(results) and report is not None:
+            # the error messages are still drawn, but the page should be converted again next time
+            report.add_failure(page_id)
+
+        return results
+
+    async def draw_translations(self, frame, to_translate, translation_results, draw_colors, page_id: int = 0, report: Union[TimingReport, None] = None):
+        bboxes = [bbox for bbox, _ in to_translate]
+
+        to_draw = []
+        for bbox,translation,color in zip(bboxes,translation_results,draw_colors):
+
+            (x1, y1, x2, y2) = bbox
+            draw_area = frame[y1:y2, x1:x2].copy()
+
+            to_draw.append(Drawable(color=color,frame=draw_area,translation=translation))
+
+        with StageTimer(report, PipelineStages.DRAWING, page_id, len(to_draw), get_pixel_count([x.frame for x in to_draw])):
+            drawn_frames = await self.run_stage(PipelineStages.DRAWING, self.drawer, to_draw)
+
+        for bbox, drawn_frame in zip(bboxes,drawn_frames):
+            (x1, y1, x2, y2) = bbox
+            drawn_frame,drawn_frame_mask = drawn_frame
+            frame[y1:y2, x1:x2] = apply_mask(drawn_frame,frame[y1:y2, x1:x2],drawn_frame_mask)
+
+        return frame
+
+    def should_translate(self, to_translate) -> bool:
+        return bool(self.translator and self.ocr and len(to_translate) > 0)
+
+    async def process_frame(self, detect_result, seg_result, input_frame, page_id: int = 0, report: Union[TimingReport, None] = None, cache_keys: dict[str, str] = {}):
+        try:
+            frame, frame_clean, text_mask, detect_result = await self.process_ml_results(
+                detect_result, seg_result, input_frame, page_id, report, cache_keys
+            )
+
+            frame, to_translate = await self.mask_text_regions(
+                frame, frame_clean, text_mask, detect_result, page_id, report, cache_keys
+            )
 
             # second pass, fix intersecting text areas
             # for i in range(len(to_translate)):
@@ -310,90 +702,286 @@ class FullConversion:
             # print("intersection found")
 
             # third pass, draw text
-            draw_colors = [(TranslatorGlobals.COLOR_BLACK,TranslatorGlobals.COLOR_BLACK,False) for x in to_translate]
-
-            start = time.time()
-            if self.color_detect_model is not None and len(draw_colors) > 0:
-                with torch.no_grad():  # model needs work
-                    with torch.inference_mode():
-                        with self.frame_process_mutex:  # this may not be needed
-
-                            images = [apply_transforms(frame_with_text.copy()) for _, frame_with_text in to_translate]
-
-                            draw_colors = [((y[0:3] * 255).astype(np.uint8),(y[3:-1] * 255).astype(np.uint8),(True if y[-1] > 0.5 else False)) for y in [
-                                x.cpu().numpy()
-                                for x in self.color_detect_model(
-                                    torch.stack(images).to(
-                                        self.device
-                                    )
-                                )
-                            ]]
-            else:
-                print("Using black since color detect model is 'None'")
-
-            print(f"Color Detection => {time.time() - start} seconds")
+            draw_colors = await self.detect_colors(to_translate, page_id, report, cache_keys)
 
-            start = time.time()
+            if self.should_translate(to_translate):
+                translation_results = await self.translate_regions(to_translate, page_id, report, cache_keys)
 
-            to_draw = []
+                frame = await self.draw_translations(frame, to_translate, translation_results, draw_colors, page_id, report)
 
-            if self.translator and self.ocr and len(to_translate) > 0:
-                bboxes,images = zip(*to_translate)
-
-                ocr_results = await self.ocr(list(images))
-
-                translation_results = await self.translator(ocr_results)
+            return frame
+        except:
+            traceback.print_exc()
+            if report is not None:
+                report.add_failure(page_id)
+            return input_frame
 
-                to_draw = []
-                for bbox,translation,color in zip(bboxes,translation_results,draw_colors):
+    def _run_yolo(self, path: str, inputs):
+        with FullConversion.use_yolo(path) as model:
+            return model(inputs, device=self.yolo_device, verbose=False)
 
-                    (x1, y1, x2, y2) = bbox
-                    draw_area = frame[y1:y2, x1:x2].copy()
+    async def detect(self, images: list[np.ndarray], cache_keys: Union[list[dict[str, str]], None] = None) -> list[tuple[DetectionResult, DetectionResult]]:
+        """Returns (detection, segmentation) results for each image, only running the models on the ones that are not cached"""
+        keys = [x.get(PipelineStages.DETECTION) for x in cache_keys] if cache_keys is not None else [None for _ in images]
 
-                    to_draw.append(Drawable(color=color,frame=draw_area,translation=translation))
+        results = [
+            self.stage_cache.get(PipelineStages.DETECTION, key) if self.stage_cache is not None and key is not None else None
+            for key in keys
+        ]
 
-                    
+        to_detect = [i for i, result in enumerate(results) if result is None]
 
-                print(f"Ocr And Translation => {time.time() - start} seconds")
+        if len(to_detect) > 0:
+            for i, result in zip(to_detect, await self.run_detection([images[i] for i in to_detect])):
+                results[i] = result
+                if self.stage_cache is not None and keys[i] is not None:
+                    self.stage_cache.put(PipelineStages.DETECTION, keys[i], result)
 
-                start = time.time()
+        return results
 
-                drawn_frames = await self.drawer(to_draw)
+    async def run_detection(self, images: list[np.ndarray]) -> list[tuple[DetectionResult, DetectionResult]]:
+        """Results are in the coordinates of the working resolution of each image"""
+        images = [self.to_working_resolution(x) for x in images]
+
+        if self.tiled_detection:
+            return await self.run_tiled_detection(images)
+        return await self.detect_batch(images)
+
+    async def run_tiled_detection(self, images: list[np.ndarray]) -> list[tuple[DetectionResult, DetectionResult]]:
+        """Runs the models on overlapping tiles of every image so tall strips are not squashed to the model size,
+        then merges the tiles of each page back together"""
+        tiles = [make_tiles(image, self.tile_size, self.tile_overlap) for image in images]
+        all_tiles = [tile.image for page_tiles in tiles for tile in page_tiles]
+
+        results = []
+        for i in range(0, len(all_tiles), self.tile_batch_size):
+            results.extend(await self.detect_batch(all_tiles[i : i + self.tile_batch_size]))
+
+        merged = []
+        start = 0
+        for page_tiles in tiles:
+            page_results = results[start : start + len(page_tiles)]
+            start += len(page_tiles)
+            merged.append(
+                (
+                    merge_tile_results([x for x, _ in page_results], page_tiles),
+                    # text masks are unioned when they are drawn so partial masks from either side of a seam are kept
+                    merge_tile_results([x for _, x in page_results], page_tiles, ios_threshold=None),
+                )
+            )
 
+        return merged
+
+    async def detect_batch(self, images: list[np.ndarray]) -> list[tuple[DetectionResult, DetectionResult]]:
+        """Runs the yolo models on images and returns (detection, segmentation) results for each one"""
+        if self.shared_preprocessing or self.combined_model_path is not None:
+            # letterbox and normalize once, every model gets the same tensor
+            batch, transforms = letterbox_batch(images, self.yolo_image_size, self.yolo_device)
+        else:
+            batch, transforms = images, [None for _ in images]
+
+        def convert(result, transform):
+            if transform is None:
+                return DetectionResult.from_yolo(result)
+            return DetectionResult.from_yolo(result, transform.gain, transform.pad, transform.shape)
+
+        if self.combined_model_path is not None:
+            # a single checkpoint with both the detection and segmentation classes
+            return [
+                split_combined_result(convert(result, transform), self.combined_segmentation_classes)
+                for result, transform in zip(self._run_yolo(self.combined_model_path, batch), transforms)
+            ]
+
+        if self.shared_preprocessing:
+            loop = asyncio.get_event_loop()
+            detect_results, seg_results = await asyncio.gather(
+                loop.run_in_executor(self.yolo_executor, self._run_yolo, self.detect_model_path, batch),
+                loop.run_in_executor(self.yolo_executor, self._run_yolo, self.seg_model_path, batch),
+            )
+        else:
+            detect_results = self._run_yolo(self.detect_model_path, batch)
+            seg_results = self._run_yolo(self.seg_model_path, batch)
 
-                for bbox, drawn_frame in zip(bboxes,drawn_frames):
-                    (x1, y1, x2, y2) = bbox
-                    drawn_frame,drawn_frame_mask = drawn_frame
-                    frame[y1:y2, x1:x2] = apply_mask(drawn_frame,frame[y1:y2, x1:x2],drawn_frame_mask)
+        return [
+            (convert(detect_result, transform), convert(seg_result, transform))
+            for detect_result, seg_result, transform in zip(detect_results, seg_results, transforms)
+        ]
 
-                    
+    async def _detect_page(self, page: PipelinePage):
+        with StageTimer(page.report, PipelineStages.DETECTION, page.page_id, 0, get_pixel_count([page.input_frame])) as timer:
+            page.cache_keys = self.get_cache_keys(page.input_frame)
+            page.detect_result, page.seg_result = (await self.detect([page.input_frame], [page.cache_keys]))[0]
+            timer.bubbles = len(page.detect_result)
+        return page
+
+    async def _clean_page(self, page: PipelinePage):
+        page.frame, page.frame_clean, page.text_mask, page.detect_result = await self.process_ml_results(
+            page.detect_result, page.seg_result, page.input_frame, page.page_id, page.report, page.cache_keys
+        )
+        page.frame, page.to_translate = await self.mask_text_regions(
+            page.frame, page.frame_clean, page.text_mask, page.detect_result, page.page_id, page.report, page.cache_keys
+        )
+        page.draw_colors = await self.detect_colors(page.to_translate, page.page_id, page.report, page.cache_keys)
+        return page
+
+    async def _translate_page(self, page: PipelinePage):
+        if self.should_translate(page.to_translate):
+            page.translation_results = await self.translate_regions(page.to_translate, page.page_id, page.report, page.cache_keys)
+        return page
+
+    async def _draw_page(self, page: PipelinePage):
+        if self.should_translate(page.to_translate):
+            page.frame = await self.draw_translations(page.frame, page.to_translate, page.translation_results, page.draw_colors, page.page_id, page.report)
+        return page
+
+    async def run_pipelined(self, images: list[np.ndarray], report: Union[TimingReport, None] = None) -> list[np.ndarray]:
+        """Converts images with each stage running on a different page at the same time, i.e. page N+1 is detected while page N is cleaned and page N-1 is translated"""
+        pipeline = StagedPipeline(
+            [
+                PipelineStage(PipelineStages.DETECTION, lambda page: run_in_thread(self._detect_page, page)),
+                PipelineStage(PipelineStages.CLEANING, lambda page: run_in_thread(self._clean_page, page)),
+                PipelineStage(PipelineStages.TRANSLATION, self._translate_page),
+                PipelineStage(PipelineStages.DRAWING, lambda page: run_in_thread(self._draw_page, page)),
+            ],
+            queue_size=self.pipeline_queue_size,
+        )
+
+        pages, pipeline_report = await pipeline([PipelinePage(x, i, report) for i, x in enumerate(images)])
+
+        self.last_pipeline_report = pipeline_report
+        print(pipeline_report)
+
+        for page in pages:
+            if isinstance(page, PipelineFailure) and report is not None:
+                report.add_failure(page.item.page_id)
+
+        return [x.item.input_frame if isinstance(x, PipelineFailure) else x.frame for x in pages]
+
+    def report_detection(self, report: TimingReport, page_id: int, start: float, batch_size: int, detect_result, frame: np.ndarray):
+        """Records the detection of one page of a batch that started at start"""
+        # the models run on the whole batch so each page is charged an equal share
+        span = TimingSpan(PipelineStages.DETECTION, page_id, start, (time.time() - start) / max(1, batch_size), len(detect_result), get_pixel_count([frame]))
+        report.add(span)
+        METRICS.observe(span)
+
+    async def convert_page(self, frame: np.ndarray, page_id: int = 0, report: Union[TimingReport, None] = None) -> np.ndarray:
+        """Runs every stage on a single page"""
+        cache_keys = self.get_cache_keys(frame)
+
+        with StageTimer(report, PipelineStages.DETECTION, page_id, 0, get_pixel_count([frame])) as timer:
+            detect_result, seg_result = (await self.detect([frame], [cache_keys]))[0]
+            timer.bubbles = len(detect_result)
+
+        return await self.process_frame(detect_result, seg_result, frame, page_id, report, cache_keys)
+
+    async def stream(
+        self,
+        images: Iterable[Union[np.ndarray, str]],
+        read_ahead: int = 4,
+        report: Union[TimingReport, None] = None,
+        detect_batch_size: int = 1,
+    ) -> AsyncIterator[tuple[int, np.ndarray]]:
+        """Converts images (frames or paths to read them from) and yields (index, frame) as each page finishes, not in input order.
+        images is consumed lazily and at most read_ahead pages are loaded at a time so memory does not grow with the number of pages.
+        Pages are read and detected detect_batch_size at a time with one call to the models, the next batch is read once
+        that many pages have finished
+        """
+        report = report if report is not None else TimingReport()
+        self.last_timing_report = report
+        loop = asyncio.get_event_loop()
+        images = iter(images)
+        detect_batch_size = max(1, detect_batch_size)
+        read_ahead = max(detect_batch_size, read_ahead)
+
+        async def load(item: Union[np.ndarray, str]) -> np.ndarray:
+            if isinstance(item, str):
+                frame = await loop.run_in_executor(None, cv2.imread, item)
+                if frame is None:
+                    raise BaseException(f"Failed to read image {item}")
+                return frame
+            return item
+
+        async def load_and_detect(items: list[Union[np.ndarray, str]]):
+            frames = await asyncio.gather(*[load(item) for item in items])
+            cache_keys = [self.get_cache_keys(x) for x in frames]
+            start = time.time()
+            results = await self.detect(frames, cache_keys)
+            return [[*x, start, len(items)] for x in zip(frames, cache_keys, results)]
+
+        async def convert(detection: asyncio.Future, position: int, index: int):
+            pages = await detection
+            # each page takes its frame out so a finished page is not kept alive by the rest of its batch
+            frame, cache_keys, (detect_result, seg_result), start, batch_size = pages[position]
+            pages[position] = None
+            self.report_detection(report, index, start, batch_size, detect_result, frame)
+            return index, await self.process_frame(detect_result, seg_result, frame, index, report, cache_keys)
+
+        pending = set()
+        detections = []
+        next_index = 0
+        exhausted = False
 
-                print(f"Drawing => {time.time() - start} seconds")
-            return frame
-        except:
-            traceback.print_exc()
-            return input_frame
+        try:
+            while True:
+                # only kept to be cancelled, finished ones would hold on to their frames
+                detections = [x for x in detections if not x.done()]
+                while not exhausted and len(pending) + detect_batch_size <= read_ahead:
+                    items = list(itertools.islice(images, detect_batch_size))
+                    if len(items) < detect_batch_size:
+                        exhausted = True
+                    if len(items) == 0:
+                        break
+
+                    detection = asyncio.ensure_future(load_and_detect(items))
+                    detections.append(detection)
+                    for position in range(len(items)):
+                        pending.add(asyncio.ensure_future(convert(detection, position, next_index)))
+                        next_index += 1
+
+                if len(pending) == 0:
+                    break
+
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    index, frame = task.result()
+                    METRICS.add_pages(1)
+                    yield index, frame
+        finally:
+            for task in [*pending, *detections]:
+                task.cancel()
+
+            report.finish()
+            print(report)
 
     async def __call__(
         self,
         images: list[np.ndarray],
+        report: Union[TimingReport, None] = None,
     ) -> list[np.ndarray]:
+        """Converts images, the time spent in each stage is recorded into report (or a new one) which is kept on last_timing_report.
+        Pages that could not be fully converted are still returned (as they were or with the error text drawn) and their index is added to report.failed_pages"""
+        report = report if report is not None else TimingReport()
+        self.last_timing_report = report
+
         # frames = [resize_percent(x, 50) for x in frames]
-        total_start = time.time()
-        start = time.time()
-        to_process = [
-            x
-            for x in zip(
-                self.detection_model(images, device=self.yolo_device, verbose=False),
-                self.segmentation_model(images, device=self.yolo_device, verbose=False),
-                images,
-            )
-        ]
+        if self.pipelined:
+            results = await self.run_pipelined(images, report)
+        else:
+            cache_keys = [self.get_cache_keys(x) for x in images]
+
+            start = time.time()
+            to_process = [
+                (detect_result, seg_result, frame)
+                for (detect_result, seg_result), frame in zip(await self.detect(images, cache_keys), images)
+            ]
 
-        print(f"Yolov8 Models => {time.time() - start} seconds")
+            for page_id, (detect_result, _, frame) in enumerate(to_process):
+                self.report_detection(report, page_id, start, len(images), detect_result, frame)
 
-        tasks = [self.process_frame(detect_result=detect_result,seg_result=seg_result,input_frame=frame) for detect_result, seg_result, frame in to_process]
-        results = await asyncio.gather(*tasks)
+            tasks = [self.process_frame(detect_result=detect_result,seg_result=seg_result,input_frame=frame,page_id=page_id,report=report,cache_keys=cache_keys[page_id]) for page_id, (detect_result, seg_result, frame) in enumerate(to_process)]
+            results = await asyncio.gather(*tasks)
 
-        print(f"Total Process => {time.time() - total_start} seconds")
+        report.finish()
+        METRICS.add_pages(len(images))
+        print(report)
         return results
\ No newline at end of file
@@ -58,7 +58,7 @@ class DeepLTranslator(Translator):
                         )
             except:
                 traceback.print_exc()
-                return TranslatorResult("Failed To Get Translation")
+                return TranslatorResult("Failed To Get Translation", failed=True)
         else:
             return TranslatorResult("Language not supported")
 
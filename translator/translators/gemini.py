@@ -91,16 +91,16 @@ class GeminiTranslator(Translator):
                     if "candidates" not in data.keys():
                         if "error" in data.keys():
                             if depth < GeminiTranslator.MAX_DEPTH:
-                                asyncio.sleep(0.1)
-                                return self.do_api(result,depth + 1)
+                                await asyncio.sleep(0.1)
+                                return await self.do_api(result,depth + 1)
                             else:
-                                return TranslatorResult("Gemini failed to translate for safety reasons")
+                                return TranslatorResult("Gemini failed to translate for safety reasons", failed=True)
                         elif "promptFeedback" in data.keys():
                             print("Gemini failed to translate for safety reasons :",data["promptFeedback"])
-                            return TranslatorResult("Gemini failed to translate for safety reasons")
+                            return TranslatorResult("Gemini failed to translate for safety reasons", failed=True)
                         else:
                             print(data)
-                            return TranslatorResult("Unknown Gemini Error, Check console")
+                            return TranslatorResult("Unknown Gemini Error, Check console", failed=True)
 
 
                         
@@ -110,7 +110,7 @@ class GeminiTranslator(Translator):
                     )
         except:
             traceback.print_exc()
-            return TranslatorResult("Failed To Get Translation")
+            return TranslatorResult("Failed To Get Translation", failed=True)
 
     async def translate(self, batch: list[OcrResult]):
         return await asyncio.gather(*[self.do_api(x) for x in batch])
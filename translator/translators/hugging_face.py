@@ -1,6 +1,7 @@
 import torch
 from transformers import pipeline
 from translator.utils import get_torch_device
+from translator.core.registry import MODELS
 from translator.core.plugin import (
     Translator,
     TranslatorResult,
@@ -16,17 +17,23 @@ class HuggingFace(Translator):
     def __init__(self, model_url: str = "Helsinki-NLP/opus-mt-ja-en") -> None:
         super().__init__()
         print("Using model",model_url)
-        self.pipeline = pipeline("translation", model=model_url, device=get_torch_device())
+        self.model_url = model_url
 
         # if torch.cuda.is_available():
         #     self.pipeline.cuda()
         # elif torch.backends.mps.is_available():
         #     self.pipeline.to('mps')
 
-    async def translate(self, batch: list[OcrResult]):
-        #return [print(y) for y in self.pipeline([x.text for x in batch])]
+    def use_pipeline(self):
+        device = get_torch_device()
+        return MODELS.use(
+            f"hf-translation:{self.model_url}:{device}",
+            lambda: pipeline("translation", model=self.model_url, device=device),
+        )
 
-        return [TranslatorResult(y["translation_text"]) for y in self.pipeline([x.text for x in batch])]
+    async def translate(self, batch: list[OcrResult]):
+        with self.use_pipeline() as translation:
+            return [TranslatorResult(y["translation_text"]) for y in translation([x.text for x in batch])]
 
     @staticmethod
     def get_name() -> str:
@@ -21,6 +21,8 @@ from hyphen import Hyphenator
 from tqdm import tqdm
 from collections import deque
 import traceback
+from translator.color_stats import get_color_stats
+from translator.interior_rectangle import get_interior_rectangle
 
 
 class TranslatorGlobals:
@@ -35,11 +37,14 @@ async def run_in_thread(func,*args,**kwargs):
         nonlocal func
         nonlocal task
         
-        result = func(*args,**kwargs)
-        
-        if inspect.isawaitable(result):
-            result = asyncio.run(result)
-        loop.call_soon_threadsafe(task.set_result,result)
+        try:
+            result = func(*args,**kwargs)
+
+            if inspect.isawaitable(result):
+                result = asyncio.run(result)
+            loop.call_soon_threadsafe(task.set_result,result)
+        except BaseException as e:
+            loop.call_soon_threadsafe(task.set_exception,e)
     
     task_thread = threading.Thread(group=None,daemon=True,target=run)
     task_thread.start()
@@ -312,6 +317,97 @@ def get_bounds_for_text(frame_mask: np.ndarray):
     return lir.pt1(rect), lir.pt2(rect)
 
 
+class BubbleAnalyzer:
+    """Does the work of has_white, mask_text_and_make_bubble_mask and get_bounds_for_text for a bubble in one go.
+
+    The text mask is converted to grey once and everything after the edge detection runs on single channel scratch
+    buffers that are kept between bubbles, so an analyzer should only be used by one thread at a time (i.e. one per page).
+    Masks are expected to be black and white like the ones the cleaners return
+    """
+
+    def __init__(self, exact_lir: bool = False) -> None:
+        self.exact_lir = exact_lir
+        self._buffers: dict[str, np.ndarray] = {}
+        self._kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+
+    def get_buffer(self, name: str, h: int, w: int, dtype=np.uint8) -> np.ndarray:
+        """A contiguous (h, w) view of the scratch buffer name, which only grows"""
+        buffer = self._buffers.get(name, None)
+        if buffer is None or buffer.size < h * w:
+            buffer = np.empty(h * w, dtype=dtype)
+            self._buffers[name] = buffer
+        return buffer[: h * w].reshape(h, w)
+
+    def get_text(self, frame: np.ndarray, text_mask: np.ndarray) -> Union[np.ndarray, None]:
+        """The masked text of frame on white, cut to the bounds of the mask. None if the mask is empty"""
+        h, w = frame.shape[:2]
+        gray = text_mask
+        if text_mask.ndim > 2:
+            gray = cv2.cvtColor(text_mask, cv2.COLOR_BGR2GRAY, dst=self.get_buffer("gray", h, w))
+
+        thresh = self.get_buffer("thresh", h, w)
+        cv2.threshold(gray, 199, 255, cv2.THRESH_BINARY, dst=thresh)
+        if cv2.countNonZero(thresh) == 0:
+            return None
+
+        # the bounding rect of a binary image is the one of its non zero pixels
+        cv2.threshold(gray, 200, 255, cv2.THRESH_BINARY, dst=thresh)
+        x, y, bw, bh = cv2.boundingRect(thresh)
+
+        text = np.full((bh, bw, 3), 255, dtype=np.uint8)
+        np.copyto(text, frame[y : y + bh, x : x + bw], where=(gray[y : y + bh, x : x + bw] == 255)[:, :, None])
+        return text
+
+    def get_bubble_mask(self, frame_clean: np.ndarray) -> np.ndarray:
+        """Single channel mask of the largest region enclosed by the edges of the cleaned bubble"""
+        h, w = frame_clean.shape[:2]
+
+        # canny keeps the strongest gradient of the three channels, so it still gets the colour crop
+        edges = cv2.Canny(cv2.GaussianBlur(frame_clean, (5, 5), 0), 50, 150, edges=self.get_buffer("edges", h, w))
+        contours, _ = cv2.findContours(edges, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE)
+
+        regions = self.get_buffer("regions", h, w)
+        regions.fill(255)
+        cv2.drawContours(regions, contours, -1, 0, thickness=2)
+
+        labels = self.get_buffer("labels", h, w, np.int32)
+        _, _, stats, _ = cv2.connectedComponentsWithStats(regions, labels=labels)
+        largest_island_label = int(np.argmax(stats[1:, cv2.CC_STAT_AREA]) + 1)
+
+        bubble_mask = cv2.compare(labels, largest_island_label, cv2.CMP_EQ)
+        return cv2.morphologyEx(bubble_mask, cv2.MORPH_OPEN, self._kernel)
+
+    def get_draw_bounds(self, bubble_mask: np.ndarray) -> Union[tuple[tuple[int, int], tuple[int, int]], None]:
+        """Largest rectangle inside the largest part of bubble_mask, None if it is empty.
+        Found with get_interior_rectangle unless exact_lir is set, which uses lir.lir"""
+        contours, _ = cv2.findContours(bubble_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+        if len(contours) == 0:
+            return None
+
+        largest_contour = max(contours, key=cv2.contourArea)
+        polygon = np.array([largest_contour[:, 0, :]])
+        if not self.exact_lir:
+            return get_interior_rectangle(polygon)
+
+        rect = lir.lir(polygon)
+        return lir.pt1(rect), lir.pt2(rect)
+
+    def analyze(
+        self, frame: np.ndarray, text_mask: np.ndarray, frame_clean: Union[np.ndarray, None] = None
+    ) -> Union[tuple[np.ndarray, Union[np.ndarray, None], Union[tuple[tuple[int, int], tuple[int, int]], None]], None]:
+        """Returns (text only crop, bubble mask, draw rectangle) of a bubble, or None if text_mask has no text.
+        The bubble mask and draw rectangle are only made when frame_clean is given (free text has no bubble to draw in)"""
+        text = self.get_text(frame, text_mask)
+        if text is None:
+            return None
+
+        if frame_clean is None:
+            return text, None, None
+
+        bubble_mask = self.get_bubble_mask(frame_clean)
+        return text, bubble_mask, self.get_draw_bounds(bubble_mask)
+
+
 def fix_order_after_intersection_fix(
     a1: int, a2: int, b1: int, b2: int, was_sorted: bool, was_intersecting: bool = False
 ):
@@ -384,15 +480,8 @@ def simplify_points(points: np.ndarray):
 def mask_text_for_in_painting(frame: np.ndarray, mask: np.ndarray):
     image = frame.copy()
 
-    hist = get_histogram_for_region(frame, np.full_like(frame, 255, dtype=frame.dtype))
-
-    # Find the bin with the highest frequency
-    max_bin = np.unravel_index(hist.argmax(), hist.shape)
-
-    # Retrieve the corresponding color value
-    is_white = (
-        ((max_bin[2] + max_bin[1] + max_bin[0]) / 3) / 255
-    ) > 0.5  # checks if the dominant color is bright or dark with a 0.5 threshold
+    # checks if the dominant color is bright or dark with a 0.5 threshold
+    is_white = get_color_stats(frame).is_bright(0.5)
 
     if not is_white:
         image = cv2.bitwise_not(image)
@@ -435,6 +524,274 @@ def mask_text_for_in_painting(frame: np.ndarray, mask: np.ndarray):
 
     return new_mask
 
+class InPaintJob:
+    """A window of the frame to inpaint and the part of it (target) that gets pasted back"""
+
+    def __init__(
+        self,
+        window: tuple[int, int, int, int],
+        target: tuple[int, int, int, int],
+        mask: np.ndarray,
+    ) -> None:
+        self.window = window  # x1, y1, x2, y2 in the frame
+        self.target = target  # x1, y1, x2, y2 in the window
+        self.mask = mask  # dilated mask of the window
+
+    def get_section(self, frame: np.ndarray) -> np.ndarray:
+        x1, y1, x2, y2 = self.window
+        return frame[y1:y2, x1:x2]
+
+    def get_target(self, frame: np.ndarray) -> np.ndarray:
+        """The view of frame the target is pasted into"""
+        tx1, ty1, tx2, ty2 = self.target
+        return self.get_section(frame)[ty1:ty2, tx1:tx2]
+
+    def get_destinations(self, frame: np.ndarray) -> list[tuple[np.ndarray, tuple[int, int, int, int]]]:
+        """Views of frame the result is pasted into, each with the region (in the window) that goes there"""
+        return [(self.get_target(frame), self.target)]
+
+    def get_area(self) -> int:
+        x1, y1, x2, y2 = self.window
+        return (x2 - x1) * (y2 - y1)
+
+    def paste(self, frame: np.ndarray, in_painted: np.ndarray):
+        for destination, (x1, y1, x2, y2) in self.get_destinations(frame):
+            destination[:] = in_painted[y1:y2, x1:x2]
+
+
+class MergedInPaintJob(InPaintJob):
+    """Jobs with overlapping windows inpainted as a single window, every job still only pastes its own target"""
+
+    def __init__(self, jobs: list[InPaintJob]) -> None:
+        x1 = min([job.window[0] for job in jobs])
+        y1 = min([job.window[1] for job in jobs])
+        x2 = max([job.window[2] for job in jobs])
+        y2 = max([job.window[3] for job in jobs])
+
+        mask = np.zeros((y2 - y1, x2 - x1), dtype=np.uint8)
+        for job in jobs:
+            jx1, jy1, jx2, jy2 = job.window
+            section = mask[jy1 - y1 : jy2 - y1, jx1 - x1 : jx2 - x1]
+            np.maximum(section, ensure_gray(job.mask), out=section)
+
+        # the jobs moved into the coordinates of the merged window
+        self.jobs = [
+            InPaintJob(
+                job.window,
+                (
+                    job.target[0] + job.window[0] - x1,
+                    job.target[1] + job.window[1] - y1,
+                    job.target[2] + job.window[0] - x1,
+                    job.target[3] + job.window[1] - y1,
+                ),
+                job.mask,
+            )
+            for job in jobs
+        ]
+
+        super().__init__(
+            (x1, y1, x2, y2),
+            (
+                min([job.target[0] for job in self.jobs]),
+                min([job.target[1] for job in self.jobs]),
+                max([job.target[2] for job in self.jobs]),
+                max([job.target[3] for job in self.jobs]),
+            ),
+            mask,
+        )
+
+    def get_destinations(self, frame: np.ndarray) -> list[tuple[np.ndarray, tuple[int, int, int, int]]]:
+        x1, y1 = self.window[:2]
+        return [
+            (frame[y1 + ty1 : y1 + ty2, x1 + tx1 : x1 + tx2], (tx1, ty1, tx2, ty2))
+            for tx1, ty1, tx2, ty2 in [job.target for job in self.jobs]
+        ]
+
+
+def windows_overlap(a: tuple[int, int, int, int], b: tuple[int, int, int, int]) -> bool:
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def merge_in_paint_jobs(jobs: list[InPaintJob], max_area: int = 512 * 512) -> list[InPaintJob]:
+    """Unions jobs whose windows overlap as long as the merged window stays within max_area and is smaller than the
+    windows it replaces, so pixels shared by several windows only go through the model once. Pastes keep the order of jobs"""
+    groups = [[(i, job)] for i, job in enumerate(jobs)]
+
+    def get_window(group: list[tuple[int, InPaintJob]]) -> tuple[int, int, int, int]:
+        return (
+            min([job.window[0] for _, job in group]),
+            min([job.window[1] for _, job in group]),
+            max([job.window[2] for _, job in group]),
+            max([job.window[3] for _, job in group]),
+        )
+
+    def get_area(window: tuple[int, int, int, int]) -> int:
+        return (window[2] - window[0]) * (window[3] - window[1])
+
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(groups)):
+            for j in range(i + 1, len(groups)):
+                a, b = get_window(groups[i]), get_window(groups[j])
+                if not windows_overlap(a, b):
+                    continue
+
+                x1, y1, x2, y2 = min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])
+                area = (x2 - x1) * (y2 - y1)
+                # the merged window also covers the corners neither window had, only merge if it is still less work
+                if area > max_area or area >= get_area(a) + get_area(b):
+                    continue
+
+                groups[i] = sorted(groups[i] + groups.pop(j), key=lambda x: x[0])
+                merged = True
+                break
+
+            if merged:
+                break
+
+    groups.sort(key=lambda x: x[0][0])
+    return [
+        group[0][1] if len(group) == 1 else MergedInPaintJob([job for _, job in group])
+        for group in groups
+    ]
+
+
+def log_in_paint_area(jobs: list[InPaintJob], merged: list[InPaintJob]):
+    if len(jobs) == 0:
+        return
+
+    area = sum([job.get_area() for job in jobs])
+    merged_area = sum([job.get_area() for job in merged])
+    saved = (1 - merged_area / area) * 100 if area > 0 else 0
+    print(
+        f"Inpainting {merged_area} px in {len(merged)} windows instead of {area} px in {len(jobs)} windows ({saved:.1f}% less)"
+    )
+
+
+def plan_in_paint(
+    frame: np.ndarray,
+    mask: np.ndarray,
+    text_mask: np.ndarray,
+    bbox: tuple[int, int, int, int],
+    max_height: int = 256,
+    max_width: int = 256,
+    mask_dilation_kernel_size: int = 9,
+) -> Union[InPaintJob, None]:
+    """Picks the window around bbox to inpaint and refines its mask to the actual characters, the refined mask is also written into text_mask"""
+    h, w, c = frame.shape
+    max_height = int(math.floor(max_height / 8) * 8)
+    max_width = int(math.floor(max_width / 8) * 8)
+
+    half_height = int(max_height / 2)
+    half_width = int(max_width / 2)
+
+    bx1, by1, bx2, by2 = bbox
+    bx1, by1, bx2, by2 = round(bx1), round(by1), round(bx2), round(by2)
+
+    half_bx = round((bx2 - bx1) / 2)
+    half_by = round((by2 - by1) / 2)
+    midpoint_x, midpoint_y = round(bx1 + half_bx), round(by1 + half_by)
+
+    x1, y1 = max(0, midpoint_x - half_width), max(0, midpoint_y - half_height)
+
+    x2, y2 = min(w, midpoint_x + half_width), min(h, midpoint_y + half_height)
+
+    if y2 < by2:
+        y2 = by2
+
+    if y1 > by1:
+        y1 = by1
+
+    if x2 < bx2:
+        x2 = bx2
+
+    if x1 > bx1:
+        x1 = bx1
+
+    overflow_x = (x2 - x1) % 8
+    x1_adjust = 0
+    if overflow_x != 0:
+        if x2 > x1:
+            x2 -= overflow_x
+        else:
+            x1 += overflow_x
+            x1_adjust = overflow_x
+
+    overflow_y = (y2 - y1) % 8
+
+    y1_adjust = 0
+    if overflow_y != 0:
+        if y2 > y1:
+            y2 -= overflow_y
+        else:
+            y1 += overflow_y
+            y1_adjust = overflow_y
+
+    bx1 = bx1 - (x1 + x1_adjust)
+    bx2 = bx2 - (x1 + x1_adjust)
+    by1 = by1 - (y1 + y1_adjust)
+    by2 = by2 - (y1 + y1_adjust)
+
+    region_mask = mask[y1:y2, x1:x2].copy()
+
+    focus_mask = cv2.rectangle(
+        np.zeros_like(region_mask),
+        (bx1, by1),
+        (bx2, by2),
+        (255, 255, 255),
+        -1,
+    )
+
+    region_mask = apply_mask(
+        region_mask, np.zeros_like(region_mask), focus_mask
+    )
+
+    if not has_white(region_mask):
+        return None
+
+    (
+        target_region_x1,
+        target_region_y1,
+        target_region_x2,
+        target_region_y2,
+    ) = get_masked_bounds(region_mask)
+
+    section_to_in_paint = frame[y1:y2, x1:x2]
+
+    section_to_refine = section_to_in_paint[
+        target_region_y1:target_region_y2, target_region_x1:target_region_x2
+    ]
+    section_to_refine_mask = region_mask[
+        target_region_y1:target_region_y2, target_region_x1:target_region_x2
+    ]
+
+    # Generate a mask of the actual characters/text
+    refined_mask = np.zeros_like(region_mask)
+    refined_mask[
+        target_region_y1:target_region_y2, target_region_x1:target_region_x2
+    ] = mask_text_for_in_painting(section_to_refine, section_to_refine_mask)
+
+    # The text mask is used for other stuff so we set it here before we dilate for inpainting
+    text_mask[y1:y2, x1:x2][
+        target_region_y1:target_region_y2, target_region_x1:target_region_x2
+    ] = refined_mask[
+        target_region_y1:target_region_y2, target_region_x1:target_region_x2
+    ].copy()
+
+    # Dilate the text mask for inpainting
+    kernel = np.ones(
+        (mask_dilation_kernel_size, mask_dilation_kernel_size), np.uint8
+    )
+    refined_mask = cv2.dilate(refined_mask, kernel, iterations=1)
+
+    return InPaintJob(
+        (x1, y1, x2, y2),
+        (target_region_x1, target_region_y1, target_region_x2, target_region_y2),
+        refined_mask,
+    )
+
+
 def in_paint_optimized(
     frame: np.ndarray,
     mask: np.ndarray,
@@ -443,126 +800,174 @@ def in_paint_optimized(
     max_width: int = 256,
     mask_dilation_kernel_size: int = 9,
     inpaint_fun: Callable[[np.ndarray, np.ndarray], np.ndarray] = lambda a, b: a,
+    inpaint_into_fun: Union[
+        Callable[[np.ndarray, np.ndarray, list[tuple[np.ndarray, tuple[int, int, int, int]]]], None], None
+    ] = None,
+    max_merged_area: Union[int, None] = None,
 ) -> tuple[np.ndarray, np.ndarray]:
-    h, w, c = frame.shape
-    max_height = int(math.floor(max_height / 8) * 8)
-    max_width = int(math.floor(max_width / 8) * 8)
+    """inpaint_into_fun(section, mask, destinations) can be given instead of inpaint_fun by cleaners that write the
+    regions of their result straight into the destinations (views of the frame) rather than returning a copy.
 
+    If max_merged_area is set every window is planned up front on the original frame and overlapping windows are
+    merged (see merge_in_paint_jobs) before anything is inpainted"""
     # only inpaint sections with masks and isolate said masks
     final = frame.copy()
     text_mask = np.zeros_like(mask)
 
-    half_height = int(max_height / 2)
-    half_width = int(max_width / 2)
+    def run_job(job: InPaintJob):
+        # Inpaint using the dilated text mask
+        if inpaint_into_fun is not None:
+            inpaint_into_fun(job.get_section(final), job.mask, job.get_destinations(final))
+        else:
+            job.paste(final, inpaint_fun(job.get_section(final), job.mask))
+
+    if max_merged_area is not None:
+        jobs = plan_in_paint_jobs(
+            frame, mask, text_mask, filtered, max_height, max_width, mask_dilation_kernel_size
+        )
+        merged = merge_in_paint_jobs(jobs, max_merged_area)
+        log_in_paint_area(jobs, merged)
+
+        for job in merged:
+            try:
+                run_job(job)
+            except:
+                traceback.print_exc()
+                continue
+
+        return final, text_mask
 
     for bbox, cls, conf in filtered:
         try:
-            bx1, by1, bx2, by2 = bbox
-            bx1, by1, bx2, by2 = round(bx1), round(by1), round(bx2), round(by2)
+            job = plan_in_paint(
+                final, mask, text_mask, bbox, max_height, max_width, mask_dilation_kernel_size
+            )
 
-            half_bx = round((bx2 - bx1) / 2)
-            half_by = round((by2 - by1) / 2)
-            midpoint_x, midpoint_y = round(bx1 + half_bx), round(by1 + half_by)
+            if job is not None:
+                run_job(job)
+        except:
+            traceback.print_exc()
+            continue
 
-            x1, y1 = max(0, midpoint_x - half_width), max(0, midpoint_y - half_height)
+    return final, text_mask
 
-            x2, y2 = min(w, midpoint_x + half_width), min(h, midpoint_y + half_height)
 
-            if y2 < by2:
-                y2 = by2
+def plan_in_paint_jobs(
+    frame: np.ndarray,
+    mask: np.ndarray,
+    text_mask: np.ndarray,
+    filtered: list[tuple[tuple[int, int, int, int], str, float]] = [],
+    max_height: int = 256,
+    max_width: int = 256,
+    mask_dilation_kernel_size: int = 9,
+) -> list[InPaintJob]:
+    """plan_in_paint for every box on the same frame, boxes that fail to plan are skipped"""
+    jobs: list[InPaintJob] = []
+    for bbox, cls, conf in filtered:
+        try:
+            job = plan_in_paint(
+                frame, mask, text_mask, bbox, max_height, max_width, mask_dilation_kernel_size
+            )
+            if job is not None:
+                jobs.append(job)
+        except:
+            traceback.print_exc()
 
-            if y1 > by1:
-                y1 = by1
+    return jobs
 
-            if x2 < bx2:
-                x2 = bx2
 
-            if x1 > bx1:
-                x1 = bx1
+def get_in_paint_window(
+    bbox: tuple[int, int, int, int],
+    shape: tuple[int, int],
+    max_height: int = 256,
+    max_width: int = 256,
+) -> tuple[int, int, int, int]:
+    """The window plan_in_paint cuts around bbox in a frame of shape (h, w), before it is trimmed to a multiple of 8.
+    Always contains the trimmed window"""
+    h, w = shape[:2]
+    half_height = int(math.floor(max_height / 8) * 8 / 2)
+    half_width = int(math.floor(max_width / 8) * 8 / 2)
+
+    bx1, by1, bx2, by2 = [round(x) for x in bbox]
+    midpoint_x = round(bx1 + round((bx2 - bx1) / 2))
+    midpoint_y = round(by1 + round((by2 - by1) / 2))
+
+    return (
+        min(max(0, midpoint_x - half_width), bx1),
+        min(max(0, midpoint_y - half_height), by1),
+        max(min(w, midpoint_x + half_width), bx2),
+        max(min(h, midpoint_y + half_height), by2),
+    )
 
-            overflow_x = (x2 - x1) % 8
-            x1_adjust = 0
-            if overflow_x != 0:
-                if x2 > x1:
-                    x2 -= overflow_x
-                else:
-                    x1 += overflow_x
-                    x1_adjust = overflow_x
 
-            overflow_y = (y2 - y1) % 8
+def select_dirty_detections(
+    filtered: list[tuple[tuple[int, int, int, int], str, float]],
+    dirty_regions: list[tuple[int, int, int, int]],
+    shape: tuple[int, int],
+    max_height: int = 256,
+    max_width: int = 256,
+) -> list[int]:
+    """Indices of the detections whose inpainting window intersects one of dirty_regions, plus every detection whose box
+    overlaps the box of a selected one. Cleaners only write inside the boxes they are given, so recleaning the selection
+    rewrites everything inside the selected boxes"""
+    selected = [
+        i
+        for i, (bbox, _, _) in enumerate(filtered)
+        if any(
+            windows_overlap(get_in_paint_window(bbox, shape, max_height, max_width), region)
+            for region in dirty_regions
+        )
+    ]
 
-            y1_adjust = 0
-            if overflow_y != 0:
-                if y2 > y1:
-                    y2 -= overflow_y
-                else:
-                    y1 += overflow_y
-                    y1_adjust = overflow_y
-
-            bx1 = bx1 - (x1 + x1_adjust)
-            bx2 = bx2 - (x1 + x1_adjust)
-            by1 = by1 - (y1 + y1_adjust)
-            by2 = by2 - (y1 + y1_adjust)
-
-            region_mask = mask[y1:y2, x1:x2].copy()
-
-            focus_mask = cv2.rectangle(
-                np.zeros_like(region_mask),
-                (bx1, by1),
-                (bx2, by2),
-                (255, 255, 255),
-                -1,
-            )
+    # boxes are limited inclusive of their far edge, so touching boxes count as overlapping
+    boxes = [(round(x1), round(y1), round(x2) + 1, round(y2) + 1) for (x1, y1, x2, y2), _, _ in filtered]
+    pending = list(selected)
+    while len(pending) > 0:
+        current = boxes[pending.pop()]
+        for i, box in enumerate(boxes):
+            if i not in selected and windows_overlap(current, box):
+                selected.append(i)
+                pending.append(i)
 
-            region_mask = apply_mask(
-                region_mask, np.zeros_like(region_mask), focus_mask
-            )
+    return sorted(selected)
 
-            if has_white(region_mask):
-                (
-                    target_region_x1,
-                    target_region_y1,
-                    target_region_x2,
-                    target_region_y2,
-                ) = get_masked_bounds(region_mask)
-
-                section_to_in_paint = final[y1:y2, x1:x2]
-
-                section_to_refine = section_to_in_paint[
-                    target_region_y1:target_region_y2, target_region_x1:target_region_x2
-                ]
-                section_to_refine_mask = region_mask[
-                    target_region_y1:target_region_y2, target_region_x1:target_region_x2
-                ]
-
-                # Generate a mask of the actual characters/text
-                refined_mask = np.zeros_like(region_mask)
-                refined_mask[
-                    target_region_y1:target_region_y2, target_region_x1:target_region_x2
-                ] = mask_text_for_in_painting(section_to_refine, section_to_refine_mask)
-
-                # The text mask is used for other stuff so we set it here before we dilate for inpainting
-                text_mask[y1:y2, x1:x2][
-                    target_region_y1:target_region_y2, target_region_x1:target_region_x2
-                ] = refined_mask[
-                    target_region_y1:target_region_y2, target_region_x1:target_region_x2
-                ].copy()
-
-                # Dilate the text mask for inpainting
-                kernel = np.ones(
-                    (mask_dilation_kernel_size, mask_dilation_kernel_size), np.uint8
-                )
-                refined_mask = cv2.dilate(refined_mask, kernel, iterations=1)
-
-                # Inpaint using the dilated text mask
-                final[y1:y2, x1:x2][
-                    target_region_y1:target_region_y2, target_region_x1:target_region_x2
-                ] = inpaint_fun(final[y1:y2, x1:x2], refined_mask)[
-                    target_region_y1:target_region_y2, target_region_x1:target_region_x2
-                ]
-        except:
-            traceback.print_exc()
-            continue
+
+def in_paint_optimized_batched(
+    frame: np.ndarray,
+    mask: np.ndarray,
+    filtered: list[tuple[tuple[int, int, int, int], str, float]] = [],
+    max_height: int = 256,
+    max_width: int = 256,
+    mask_dilation_kernel_size: int = 9,
+    inpaint_batch_fun: Callable[
+        [list[np.ndarray], list[np.ndarray]], list[np.ndarray]
+    ] = lambda a, b: a,
+    max_merged_area: Union[int, None] = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Same as in_paint_optimized but every window is planned first and inpainted with a single call to inpaint_batch_fun.
+    Windows are cut from the original frame so overlapping windows do not see each others results"""
+    final = frame.copy()
+    text_mask = np.zeros_like(mask)
+
+    jobs = plan_in_paint_jobs(
+        frame, mask, text_mask, filtered, max_height, max_width, mask_dilation_kernel_size
+    )
+
+    if max_merged_area is not None:
+        merged = merge_in_paint_jobs(jobs, max_merged_area)
+        log_in_paint_area(jobs, merged)
+        jobs = merged
+
+    if len(jobs) == 0:
+        return final, text_mask
+
+    results = inpaint_batch_fun(
+        [job.get_section(frame) for job in jobs], [job.mask for job in jobs]
+    )
+
+    # paste in the original order so overlapping windows resolve the same way as in_paint_optimized
+    for job, result in zip(jobs, results):
+        job.paste(final, result)
 
     return final, text_mask
 